@@ -1,47 +1,193 @@
 import argparse
 import os
-import uuid
 import sys
+import weakref
 
-from . import msvc_ccproj
+from . import msvc_ccproj, snapshot, trace
+from .cache import ParseCache, default_cache_dir
+from .fetch import Http, RepoCache
 from .fs import Fs
+from .graph import TargetGraph
 from .label import parse_label
-from .msvc import gen_msvc
-from .package import PackageSet
-from .workspace import Workspace
+from .manifest import Manifest
+from .msvc import label_guid
+from .output import OutputDir, discard
+from .query import QueryEngine, QueryError
+from .server import Server, WorkspaceCache, default_socket_path, request
+from .workspace import Workspace, Rule, File
 
-def _main():
-    ap = argparse.ArgumentParser()
+def _add_workspace_args(ap):
     ap.add_argument('--workspace', '-w', default='.')
+    ap.add_argument('--cache-dir', default=default_cache_dir())
+    ap.add_argument('--no-cache', action='store_true', help='do not use the persistent parse cache')
+    ap.add_argument('--evaluator', choices=('ast', 'compiled'), default=None,
+        help='how BUILD and .bzl files are run; `ast` unless --lazy-rules is given')
+    ap.add_argument('--preparse', action='store_true', help='parse all BUILD files in parallel before loading')
+    ap.add_argument('--jobs', '-j', type=int, default=None)
+    ap.add_argument('--prefetch', type=int, default=0, metavar='THREADS',
+        help='read and parse BUILD files of dependencies on a thread pool')
+    ap.add_argument('--fetch', action='store_true', help='download all http_archive repositories in parallel up front')
+    ap.add_argument('--lazy-rules', action='store_true',
+        help='only instantiate the rules that are needed (implies --evaluator=compiled)')
+    ap.add_argument('--trace', metavar='FILE', help='write a Chrome trace-event profile of the run to FILE')
+    ap.add_argument('--connect', action='store_true', help='send the request to a running `bzlsk server`')
+    ap.add_argument('--socket', default=default_socket_path())
+
+def _make_arg_parser():
+    ap = argparse.ArgumentParser()
+    _add_workspace_args(ap)
     ap.add_argument('--output', '-o', default='.')
+    ap.add_argument('--full', action='store_true', help='ignore the manifest of the previous run and regenerate everything')
+    ap.add_argument('--configuration', '-c', action='append', default=[], metavar='NAME=KEY=VALUE[,KEY=VALUE...]',
+        help='the config of a project configuration, e.g. `Debug|x64=mode=dbg,cpu=x64`; '
+            'KEY=VALUE targets apply to all of them')
     ap.add_argument('targets', nargs='*', default=[])
-    args = ap.parse_args()
+    return ap
+
+def _make_query_arg_parser():
+    ap = argparse.ArgumentParser(prog='bzlsk query')
+    _add_workspace_args(ap)
+    ap.add_argument('expr', help='e.g. `deps(//app)`, `rdeps(//app, //lib)` or `somepath(//app, //lib)`')
+    ap.add_argument('config', nargs='*', default=[], metavar='KEY=VALUE')
+    return ap
 
+def _split_targets(targets):
     config = {}
     labels = []
 
-    for tgt in args.targets:
+    for tgt in targets:
         if '=' in tgt:
             k, v = tgt.split('=', 1)
             config[k] = v
         else:
             labels.append(tgt)
 
-    w = Workspace(args.workspace, config, fs=Fs(), http=None)
-    targets = set(w.resolve_target(lbl, '', '') for lbl in labels)
+    return config, labels
+
+def _make_matrix(configurations, config):
+    """
+    Return a dict mapping every project configuration to the config
+    it is evaluated in.
+    """
+
+    matrix = { name: dict(config) for name in msvc_ccproj.configurations }
+    for arg in configurations:
+        name, sep, settings = arg.partition('=')
+        if not sep or name not in matrix:
+            raise RuntimeError('invalid configuration {!r}, expected one of {} followed by =KEY=VALUE'.format(
+                arg, ', '.join(msvc_ccproj.configurations)))
+
+        for item in settings.split(','):
+            if item:
+                k, sep, v = item.partition('=')
+                if not sep:
+                    raise RuntimeError('invalid configuration setting: {!r}'.format(item))
+                matrix[name][k] = v
+    return matrix
+
+def _evaluator(args):
+    # Every module is run once, so compiling it doesn't pay off
+    # by itself; only deferred rule calls need it.
+    if args.evaluator is not None:
+        return args.evaluator
+    return 'compiled' if args.lazy_rules else 'ast'
+
+def _open_workspace(args, config, keep_modules=False):
+    parse_cache = None if args.no_cache else ParseCache(os.path.join(args.cache_dir, 'ast'))
+    with trace.span('open_workspace', 'load', workspace=args.workspace):
+        w = Workspace(args.workspace, config, fs=Fs(), http=Http(), parse_cache=parse_cache,
+            evaluator=_evaluator(args), prefetch_jobs=args.prefetch, lazy_rules=args.lazy_rules,
+            repo_cache=RepoCache(os.path.join(args.cache_dir, 'repos')), keep_modules=keep_modules)
+    try:
+        if not args.no_cache:
+            snapshot.load(w, _snapshot_path(args, w))
+        if args.fetch:
+            with trace.span('fetch_repos', 'io'):
+                w.fetch_repos(args.jobs)
+        if args.preparse:
+            with trace.span('preparse', 'load'):
+                w.preparse(args.jobs)
+    except BaseException:
+        w.close()
+        raise
+    return w
+
+def _snapshot_path(args, w):
+    return os.path.join(args.cache_dir, 'snapshots', snapshot.snapshot_name(w, _evaluator(args), args.lazy_rules))
+
+def generate(args, open_workspace=_open_workspace):
+    config, labels = _split_targets(args.targets)
+    matrix = _make_matrix(args.configuration, config)
+
+    manifest_path = os.path.join(args.output, _manifest_name)
+    old = None if args.full else Manifest.load(manifest_path)
+    if old is not None and old.matches(matrix, labels):
+        changed = old.changed_inputs()
+        if (not changed and os.path.exists(os.path.join(args.output, _sln_name))
+                and all(os.path.exists(os.path.join(args.output, proj['fname'])) for proj in old.projects.values())):
+            return 0
+
+        for path in changed:
+            del old.inputs[path]
+        reuse = changed.isdisjoint(old.workspace_inputs)
+    else:
+        old = None
+        changed = set()
+        reuse = False
+
+    w = open_workspace(args, config)
+    try:
+        _generate(args, w, matrix, labels, old, changed, reuse)
+    finally:
+        w.close()
+    return 0
+
+def _generate(args, w, matrix, labels, old, changed, reuse):
+    """
+    Generate the projects of `labels` and the solution. `old` is the
+    manifest of the previous run, if it is for the same targets,
+    and `changed` the inputs that changed since; with `reuse`, projects
+    whose inputs didn't change are kept.
+    """
+
+    manifest_path = os.path.join(args.output, _manifest_name)
+
+    # The workspace is loaded once; only the attributes that `select`
+    # are resolved again for each distinct config.
+    distinct = {}
+    for name, cfg in matrix.items():
+        distinct.setdefault(tuple(sorted(cfg.items())), (cfg, []))[1].append(name)
 
-    gen_projs = {}
+    manifest = Manifest(matrix, labels)
+    manifest.workspace_inputs = sorted(w.inputs)
+    for path in w.inputs:
+        manifest.record_input(path, old)
 
+    # Projects keep the names they were given on previous runs,
+    # so that the file names don't depend on the traversal order.
     used_names = set()
+    if old is not None:
+        used_names.update(proj['name'] for proj in old.projects.values())
 
-    seen = set(targets)
-    while targets:
-        tgt = targets.pop()
+    targets = [parse_label(lbl, '', '').abslabel for lbl in labels]
+    dirty = []
+    fresh = []
 
-        if isinstance(tgt, FileTarget):
-            tgt = tgt.rule
+    def visit(label):
+        prev = old.projects.get(label) if old is not None else None
+        if (prev is not None and reuse and changed.isdisjoint(prev['inputs'])
+                and os.path.exists(os.path.join(args.output, prev['fname']))):
+            manifest.add_project(label, prev['name'], prev['fname'], prev['guid'], prev['deps'], prev['inputs'], old)
+            return prev['deps']
 
-        if isinstance(tgt, (CcBinary, CcLibrary, CcTest)):
+        tgt = w.resolve_target(label, '', '')
+        if not isinstance(tgt, Rule) or tgt.kind not in ('cc_binary', 'cc_library', 'cc_test'):
+            raise RuntimeError('XXX not implemented')
+
+        if prev is not None:
+            name = prev['name']
+            guid = prev['guid']
+        else:
             name_base = tgt.package.name.replace('/', '_') + tgt.name
             name = name_base
 
@@ -51,20 +197,198 @@ def _main():
                 name = name_base + '_' + str(name_idx)
 
             used_names.add(name)
+            guid = label_guid(label)
 
-            gen_projs[tgt] = (os.path.join(args.output, name + '.vcxproj'), uuid.uuid4())
-            for dep in tgt.deps:
-                if dep not in seen:
-                    seen.add(dep)
-                    targets.add(dep)
-        else:
-            raise RuntimeError('XXX not implemented')
+        srcs = []
+        deps = []
+        seen_srcs = set()
+        seen_deps = set()
+        configs = {}
+        for cfg, conf_names in distinct.values():
+            with w.configure(cfg):
+                cfg_deps = [dep.label for dep in tgt.attrs.get('deps', ())]
+                cfg_srcs = [os.path.relpath(w._fs.native_path(src._path), args.output)
+                    for src in tgt.attrs.get('srcs', ()) + tgt.attrs.get('hdrs', ())
+                    if isinstance(src, File)]
+                defines = tgt.attrs.get('defines', ())
+
+            settings = _ConfigSettings(cfg_srcs, cfg_deps, defines)
+            for conf_name in conf_names:
+                configs[conf_name] = settings
+
+            # Keep the order of the first config, then append whatever
+            # the others add.
+            srcs.extend(src for src in cfg_srcs if src not in seen_srcs)
+            deps.extend(dep for dep in cfg_deps if dep not in seen_deps)
+            seen_srcs.update(cfg_srcs)
+            seen_deps.update(cfg_deps)
+
+        fresh.append((label, name, guid, deps, tgt.package))
+        dirty.append(_Project(label, srcs, deps, configs))
+        return deps
+
+    TargetGraph.build(targets, visit)
+
+    # A project also depends on every package its package referred to,
+    # e.g. those of the config_settings its attributes select on.
+    dependencies = w.package_dependencies()
+    for label, name, guid, deps, pkg in fresh:
+        inputs = set(pkg.inputs)
+        for dep in dependencies.get(pkg, ()):
+            inputs.update(dep.inputs)
+        manifest.add_project(label, name, name + '.vcxproj', guid, deps, inputs, old)
 
-    for tgt, (fname_root, uuid) in gen_projs:
-        with open(name + '.vcxproj', 'w') as fout:
-            fout.write(msvc_ccproj.make_vcxproj(p))
+    proj_map = { label: (proj['fname'], proj['guid']) for label, proj in manifest.projects.items() }
+    with trace.span('render_projects', 'generate', count=len(dirty)):
+        rendered = msvc_ccproj.write_vcxprojs(args.output, dirty, proj_map, args.jobs)
 
+    output = OutputDir(args.output, dict(old.outputs) if old is not None else None)
+    for i, (proj, temp) in enumerate(zip(dirty, rendered)):
+        fname = proj_map[proj.label][0]
+        try:
+            with trace.span('write_project', 'generate', label=proj.label, file=fname):
+                output.commit(fname, temp)
+        except BaseException:
+            for temp in rendered[i+1:]:
+                discard(temp)
+            raise
+
+    projects = sorted((proj['name'], proj['fname'], proj['guid']) for proj in manifest.projects.values())
+    output.write(_sln_name, msvc_ccproj.make_sln(projects))
+
+    # Only keep the records of files that are still generated.
+    fnames = { proj['fname'] for proj in manifest.projects.values() }
+    fnames.add(_sln_name)
+    manifest.outputs = { k: v for k, v in output.records.items() if k in fnames }
+    manifest.save(manifest_path)
+
+def query(args, open_workspace=_open_workspace, engines=None):
+    """
+    Run a query and return the status and the output, one label
+    per line. `engines` may keep query engines between calls;
+    it maps workspaces to engines and is best a `WeakKeyDictionary`.
+    """
+
+    config, labels = _split_targets(args.config)
+    if labels:
+        return 2, 'expected KEY=VALUE, found {}\n'.format(labels[0])
+
+    w = open_workspace(args, config)
+
+    engine = None if engines is None else engines.get(w)
+    if engine is None:
+        engine = QueryEngine(w)
+        if engines is not None:
+            engines[w] = engine
+
+    try:
+        with trace.span('query', 'query', expr=args.expr), w.configure(config):
+            result = engine.run(args.expr)
+    except QueryError as e:
+        return 2, 'error: {}\n'.format(e)
+    finally:
+        w.close()
+
+    return 0, ''.join(label + '\n' for label in result)
+
+def _serve(argv):
+    ap = argparse.ArgumentParser(prog='bzlsk server')
+    ap.add_argument('--socket', default=default_socket_path())
+    args = ap.parse_args(argv)
+
+    workspaces = WorkspaceCache()
+
+    def handle_generate(argv, cwd):
+        args = _make_arg_parser().parse_args(argv)
+        args.workspace = os.path.join(cwd, args.workspace)
+        args.output = os.path.join(cwd, args.output)
+        args.cache_dir = os.path.join(cwd, args.cache_dir)
+        return generate(args, open_workspace), ''
+
+    def handle_query(argv, cwd):
+        args = _make_query_arg_parser().parse_args(argv)
+        args.workspace = os.path.join(cwd, args.workspace)
+        args.cache_dir = os.path.join(cwd, args.cache_dir)
+        return query(args, open_workspace, engines)
+
+    # Workspaces don't depend on the config, see `Workspace.configure`.
+    def open_workspace(args, config):
+        key = (os.path.abspath(args.workspace), _evaluator(args), args.no_cache, args.lazy_rules)
+        return workspaces.get(key, lambda: _open_workspace(args, config, keep_modules=True))
+
+    engines = weakref.WeakKeyDictionary()
+    Server(args.socket, { 'generate': handle_generate, 'query': handle_query }).serve_forever()
     return 0
 
+def _main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if argv[:1] == ['server']:
+        return _serve(argv[1:])
+
+    if argv[:1] == ['query']:
+        command = 'query'
+        argv = argv[1:]
+        args = _make_query_arg_parser().parse_args(argv)
+    else:
+        command = 'generate'
+        args = _make_arg_parser().parse_args(argv)
+
+    if args.connect:
+        return request(args.socket, command, argv)
+
+    opened = []
+    def open_workspace(args, config):
+        w = _open_workspace(args, config)
+        opened.append(w)
+        return w
+
+    def run():
+        if command == 'generate':
+            status = generate(args, open_workspace)
+        else:
+            status, output = query(args, open_workspace)
+            sys.stdout.write(output)
+
+        for w in opened:
+            if w._parse_cache is not None:
+                trace.counter('parse_cache', hits=w._parse_cache.hits, misses=w._parse_cache.misses)
+
+        # The next run restores what this one loaded.
+        if not args.no_cache:
+            for w in opened:
+                snapshot.save(w, _snapshot_path(args, w))
+        return status
+
+    if not args.trace:
+        return run()
+
+    tracer = trace.Tracer()
+    trace.set_tracer(tracer)
+    try:
+        with trace.span(command, command):
+            return run()
+    finally:
+        trace.set_tracer(None)
+        with open(args.trace, 'w') as fout:
+            tracer.write(fout)
+
+class _Project:
+    def __init__(self, label, srcs, deps, configs=None):
+        self.label = label
+        self.srcs = srcs
+        self.deps = deps
+        self.configs = configs
+
+class _ConfigSettings:
+    def __init__(self, srcs, deps, defines):
+        self.srcs = frozenset(srcs)
+        self.deps = frozenset(deps)
+        self.defines = defines
+
+_manifest_name = '.bzlsk-manifest.json'
+_sln_name = 'all.sln'
+
 if __name__ == '__main__':
     sys.exit(_main())
@@ -0,0 +1,1082 @@
+"""
+Compiles parsed BUILD and .bzl modules into trees of closures.
+
+`bzlfile._Evaluator` dispatches on the node type for every node every time
+a module is evaluated. Here the dispatch happens once, in `compile`; the
+result can then be evaluated any number of times and each node costs
+a single Python call.
+
+Top-level calls of the form `f(name = "...", ...)` can be deferred. If
+`evaluate` is given a `defer` callback and `f` turns out to be
+`deferrable` (i.e. a rule), the arguments are not evaluated; instead,
+`defer(name, thunk)` is called, and calling `thunk()` later makes
+the call. The globals the call refers to are captured when it is
+deferred, so that later assignments don't affect it. Modules that
+modify values in place (`x[k] = v`, `d.update(...)`) never defer, and
+neither do calls that refer to a dict, which a function the module
+calls could modify.
+
+Functions (`def`) are compiled once, when the module is. Their local
+variables, comprehension variables included, are resolved to fixed
+slots of a per-call list, so reading or writing a local costs an index
+operation rather than a dict lookup. How arguments bind to parameters
+is worked out from the signature at compile time as well; a call
+copies a template of the slots (with the defaults filled in) and
+stores the arguments into it. Statements return `None`, or one
+of `_BREAK`, `_CONTINUE` and `_RETURN` to unwind loops and calls.
+
+Functions are called with the caller's `ctx` (i.e. the package of
+the BUILD file that is being evaluated), so that a macro defined in
+a .bzl file instantiates its rules in the package that called it.
+"""
+
+import ast
+import operator
+import sys
+
+from .depset import Depset
+
+class _Frame:
+    __slots__ = ('globals', 'builtins', 'ctx', 'loader', 'defer', 'locals', 'result')
+
+    def __init__(self, globals, builtins, ctx, loader, defer=None, locals=()):
+        self.globals = globals
+        self.builtins = builtins
+        self.ctx = ctx
+        self.loader = loader
+        self.defer = defer
+        self.locals = locals
+        self.result = None
+
+class _Unbound:
+    def __repr__(self):
+        return '<unbound>'
+
+# The value of local slots that weren't assigned yet.
+_unbound = _Unbound()
+
+# Control flow signals returned by statements.
+_BREAK = 1
+_CONTINUE = 2
+_RETURN = 3
+
+class Module:
+    """
+    A compiled module, see `compile`.
+    """
+
+    def __init__(self, stmts, mutates, nslots=0):
+        self._stmts = stmts
+        self._mutates = mutates
+        self._nslots = nslots
+
+    def evaluate(self, builtins, ctx, loader, defer=None):
+        if self._mutates:
+            defer = None
+
+        fr = _Frame({}, builtins, ctx, loader, defer, [_unbound] * self._nslots)
+        for stmt in self._stmts:
+            stmt(fr)
+        return fr.globals
+
+def compile(mod):
+    if not isinstance(mod, ast.Module):
+        raise RuntimeError('expected a module')
+
+    c = _Compiler()
+    stmts = c.module(mod)
+    return Module(stmts, c.mutates, c.nslots)
+
+def compile_function(stmt):
+    """
+    Compile a `def` statement on its own, returning a `FunctionCode`.
+    The default values are left to the caller, see
+    `FunctionCode.make_function`.
+    """
+
+    return _Compiler().function(stmt)
+
+def compile_node(node):
+    """
+    Compile a single top-level statement or expression on its own, for
+    `bzlfile._Evaluator`. The result is called as
+    `fn(globals, builtins, ctx, loader)`, where `globals` are those of
+    the module being evaluated.
+    """
+
+    c = _Compiler()
+    fn = c.stmt(node) if isinstance(node, ast.stmt) else c.expr(node)
+    nslots = c.nslots
+
+    def evaluate(globals, builtins, ctx, loader):
+        return fn(_Frame(globals, builtins, ctx, loader, None, [_unbound] * nslots))
+    return evaluate
+
+class FunctionCode:
+    """
+    A compiled function body along with its signature.
+
+    Slots `0..nparams-1` hold the named parameters in order (positional
+    ones first), followed by `*args` and `**kwargs` if present, then by
+    the other local variables.
+    """
+
+    def __init__(self, name, params, npositional, varargs, kwargs, has_default, nslots, body):
+        self.name = name
+        self.params = params
+        self.npositional = npositional
+        self.varargs = varargs
+        self.kwargs = kwargs
+        self.has_default = has_default
+        self.nslots = nslots
+        self.body = body
+        self.kw_index = { param: i for i, param in enumerate(params) }
+
+    def make_function(self, globals, builtins, loader, defaults):
+        """
+        Create the function value, with `globals` being the globals of
+        the defining module. `defaults` are the values of the default
+        arguments, in the order of the signature.
+        """
+
+        return Function(self, globals, builtins, loader, defaults)
+
+class Function:
+    """
+    A user-defined Starlark function.
+    """
+
+    deferrable = False
+
+    def __init__(self, code, globals, builtins, loader, defaults):
+        self._code = code
+        self._globals = globals
+        self._builtins = builtins
+        self._loader = loader
+
+        # Mandatory parameters are left unbound in the template
+        # and checked for after binding.
+        template = [_unbound] * code.nslots
+        params_with_defaults = [i for i, d in enumerate(code.has_default) if d]
+        for i, value in zip(params_with_defaults, defaults):
+            template[i] = value
+        if code.varargs is not None:
+            template[code.varargs] = ()
+
+        self._template = template
+        self._mandatory = tuple(i for i, d in enumerate(code.has_default) if not d)
+
+    @property
+    def name(self):
+        return self._code.name
+
+    def __repr__(self):
+        return '<function {}>'.format(self._code.name)
+
+    def __call__(self, ctx, *args, **kw):
+        code = self._code
+        slots = self._template[:]
+
+        n = len(args)
+        if n > code.npositional:
+            if code.varargs is None:
+                raise RuntimeError('{}() accepts at most {} positional arguments, got {}'.format(
+                    code.name, code.npositional, n))
+            slots[code.varargs] = args[code.npositional:]
+            n = code.npositional
+            args = args[:n]
+        slots[:n] = args
+
+        if kw:
+            extra = None
+            kw_index = code.kw_index
+            for k, v in kw.items():
+                i = kw_index.get(k)
+                if i is None:
+                    if code.kwargs is None:
+                        raise RuntimeError('{}() got an unexpected keyword argument {}'.format(code.name, k))
+                    if extra is None:
+                        extra = {}
+                    extra[k] = v
+                elif i < n:
+                    raise RuntimeError('{}() got multiple values for argument {}'.format(code.name, k))
+                else:
+                    slots[i] = v
+
+            if extra is not None:
+                slots[code.kwargs] = extra
+
+        if code.kwargs is not None and slots[code.kwargs] is _unbound:
+            slots[code.kwargs] = {}
+
+        for i in self._mandatory:
+            if i >= n and slots[i] is _unbound:
+                raise RuntimeError('{}() missing argument {}'.format(code.name, code.params[i]))
+
+        fr = _Frame(self._globals, self._builtins, ctx, self._loader, None, slots)
+        code.body(fr)
+        return fr.result
+
+def _fail(ctx, *args, **kw):
+    raise RuntimeError(' '.join(_str(arg) for arg in args) or 'fail() called')
+
+def _print(ctx, *args, sep=' '):
+    sys.stderr.write('DEBUG: ' + sep.join(_str(arg) for arg in args) + '\n')
+
+def _str(value):
+    if isinstance(value, str):
+        return value
+    return _repr(value)
+
+def _repr(value):
+    if value is None:
+        return 'None'
+    if value is True:
+        return 'True'
+    if value is False:
+        return 'False'
+    if isinstance(value, tuple):
+        return '[' + ', '.join(_repr(el) for el in value) + ']'
+    if isinstance(value, dict):
+        return '{' + ', '.join(_repr(k) + ': ' + _repr(v) for k, v in value.items()) + '}'
+    return repr(value)
+
+def _type(value):
+    if value is None:
+        return 'NoneType'
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, tuple):
+        return 'list'
+    if isinstance(value, dict):
+        return 'dict'
+    if isinstance(value, Function):
+        return 'function'
+    if isinstance(value, Depset):
+        return 'depset'
+    return type(value).__name__
+
+def _depset(ctx, direct=None, order='default', *, transitive=None):
+    return Depset(direct or (), transitive or (), order)
+
+def _range(ctx, *args):
+    return tuple(range(*args))
+
+def _sorted(ctx, iterable, key=None, reverse=False):
+    if key is not None:
+        fn = key
+        key = lambda el: fn(ctx, el)
+    return tuple(sorted(iterable, key=key, reverse=reverse))
+
+# Functions available in every module, after the module's globals
+# and the builtins it was evaluated with. Lists are tuples.
+universe = {
+    'all': lambda ctx, iterable: all(iterable),
+    'any': lambda ctx, iterable: any(iterable),
+    'bool': lambda ctx, value=False: bool(value),
+    'depset': _depset,
+    'dict': lambda ctx, *args, **kw: dict(*args, **kw),
+    'enumerate': lambda ctx, iterable, start=0: tuple(enumerate(iterable, start)),
+    'fail': _fail,
+    'getattr': lambda ctx, obj, name, *default: getattr(obj, name, *default),
+    'hasattr': lambda ctx, obj, name: hasattr(obj, name),
+    'int': lambda ctx, value=0, *base: int(value, *base),
+    'len': lambda ctx, value: len(value),
+    'list': lambda ctx, iterable=(): tuple(iterable),
+    'max': lambda ctx, *args: max(*args),
+    'min': lambda ctx, *args: min(*args),
+    'print': _print,
+    'range': _range,
+    'repr': lambda ctx, value: _repr(value),
+    'reversed': lambda ctx, iterable: tuple(reversed(tuple(iterable))),
+    'sorted': _sorted,
+    'str': lambda ctx, value: _str(value),
+    'tuple': lambda ctx, iterable=(): tuple(iterable),
+    'type': lambda ctx, value: _type(value),
+    'zip': lambda ctx, *args: tuple(zip(*args)),
+    }
+
+_binops = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Mod: operator.mod,
+    ast.FloorDiv: operator.floordiv,
+    ast.BitOr: operator.or_,
+    ast.BitAnd: operator.and_,
+    }
+
+_cmpops = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda lhs, rhs: lhs in rhs,
+    ast.NotIn: lambda lhs, rhs: lhs not in rhs,
+    }
+
+_unaryops = {
+    ast.Not: operator.not_,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    }
+
+# Methods that modify their object in place. Like stores to `x[k]`, they
+# keep the module from deferring rule calls, see `Module.evaluate`.
+_mutating_methods = frozenset(('clear', 'pop', 'popitem', 'setdefault', 'update',
+    'append', 'extend', 'insert', 'remove'))
+
+# Values whose methods are called without a `ctx`.
+_plain_types = (str, tuple, dict, int, bool, Depset)
+
+def call_method(ctx, obj, name, args, kw):
+    """
+    Call `obj.name(*args, **kw)`. Methods of strings, lists and dicts
+    are plain Python methods; anything else (`native`, `attr`, ...)
+    gets the `ctx`, like builtin functions do.
+    """
+
+    m = getattr(obj, name)
+    if not isinstance(obj, _plain_types):
+        return m(ctx, *args, **kw)
+
+    if name.startswith('_'):
+        raise RuntimeError('{} has no method {}'.format(_type(obj), name))
+
+    # Starlark has no views or mutable lists.
+    r = m(*args, **kw)
+    if isinstance(r, (list, type({}.keys()), type({}.values()), type({}.items()))):
+        return tuple(r)
+    return r
+
+_containers = (tuple, dict)
+
+def _holds_dict(value):
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        t = type(value)
+        if t is dict:
+            return True
+        if t is tuple:
+            stack.extend(value)
+    return False
+
+class _Compiler:
+    def __init__(self):
+        self.mutates = False
+        self.nslots = 0
+
+        # Maps local names to slots; at the module level, only
+        # comprehension variables are local.
+        self._scope = {}
+        self._bound = frozenset()
+        self._in_function = False
+        self._loops = 0
+
+    def module(self, mod):
+        r = []
+        for stmt in mod.body:
+            name = _rule_call_name(stmt)
+            if name is not None:
+                r.append(self._deferrable_call(stmt.value, name))
+            else:
+                r.append(self.stmt(stmt))
+        return r
+
+    def stmt(self, stmt):
+        if is_load(stmt):
+            if self._in_function:
+                raise RuntimeError('`load` is only allowed at the top level')
+            return self._load(stmt.value)
+        return self._dispatch(stmt)
+
+    def block(self, stmts):
+        stmts = tuple(self.stmt(stmt) for stmt in stmts)
+        if len(stmts) == 1:
+            return stmts[0]
+
+        def block(fr):
+            for stmt in stmts:
+                r = stmt(fr)
+                if r is not None:
+                    return r
+        return block
+
+    def _alloc(self):
+        i = self.nslots
+        self.nslots += 1
+        return i
+
+    def expr(self, e):
+        return self._dispatch(e)
+
+    def _dispatch(self, node):
+        fn = getattr(self, '_' + type(node).__name__, None)
+        if fn is None:
+            raise RuntimeError('Unknown expression')
+        return fn(node)
+
+    def _load(self, call):
+        if len(call.args) == 0:
+            raise RuntimeError('`load` takes a string argument')
+
+        if not all(_is_str(arg) for arg in call.args) or not all(_is_str(kw.value) for kw in call.keywords):
+            raise RuntimeError('the arguments to `load` must be string literals')
+
+        label = _str_value(call.args[0])
+        names = [(_str_value(arg), _str_value(arg)) for arg in call.args[1:]]
+        names.extend((kw.arg, _str_value(kw.value)) for kw in call.keywords)
+
+        def load(fr):
+            bzl = fr.loader(label)
+            g = fr.globals
+            for local, remote in names:
+                g[local] = bzl[remote]
+        return load
+
+    def _deferrable_call(self, e, name):
+        call = self._Call(e)
+        fn = self.expr(e.func)
+        free_names = sorted({node.id for node in ast.walk(e) if isinstance(node, ast.Name)})
+
+        def deferrable_call(fr):
+            if fr.defer is None:
+                return call(fr)
+
+            f = fn(fr)
+            if not getattr(f, 'deferrable', False):
+                return call(fr)
+
+            g = fr.globals
+            env = { k: g[k] for k in free_names if k in g }
+            for value in env.values():
+                if type(value) in _containers and _holds_dict(value):
+                    # A function may still modify it before the thunk runs.
+                    return call(fr)
+
+            def thunk():
+                return call(_Frame(env, fr.builtins, fr.ctx, fr.loader, None, [_unbound] * len(fr.locals)))
+
+            fr.defer(name, thunk)
+        return deferrable_call
+
+    def _Expr(self, stmt):
+        value = self.expr(stmt.value)
+        def expr_stmt(fr):
+            value(fr)
+        return expr_stmt
+
+    def _Pass(self, stmt):
+        return lambda fr: None
+
+    def _Assign(self, stmt):
+        if len(stmt.targets) != 1:
+            raise RuntimeError('only a single target is allowed in an assignment')
+
+        target = stmt.targets[0]
+        value = self.expr(stmt.value)
+
+        if isinstance(target, ast.Name):
+            name = target.id
+            i = self._scope.get(name)
+            if i is not None:
+                def assign(fr):
+                    fr.locals[i] = value(fr)
+            else:
+                def assign(fr):
+                    fr.globals[name] = value(fr)
+        elif isinstance(target, ast.Subscript):
+            self.mutates = True
+            obj = self.expr(target.value)
+            index = self.expr(target.slice)
+            def assign(fr):
+                rhs = value(fr)
+                obj(fr)[index(fr)] = rhs
+        else:
+            store = self._store(target)
+            def assign(fr):
+                store(fr, value(fr))
+        return assign
+
+    def _AugAssign(self, stmt):
+        op = _binops.get(type(stmt.op))
+        if op is None:
+            raise RuntimeError('Unknown expression')
+
+        target = stmt.target
+        value = self.expr(stmt.value)
+        if isinstance(target, ast.Name):
+            i = self._scope.get(target.id)
+            if i is not None:
+                name = target.id
+                def aug_assign(fr):
+                    slots = fr.locals
+                    lhs = slots[i]
+                    if lhs is _unbound:
+                        raise RuntimeError('local variable {} referenced before assignment'.format(name))
+                    slots[i] = op(lhs, value(fr))
+                return aug_assign
+
+            load = self._Name(ast.Name(id=target.id, ctx=ast.Load()))
+        elif isinstance(target, ast.Subscript):
+            self.mutates = True
+            obj = self.expr(target.value)
+            index = self.expr(target.slice)
+            def aug_assign(fr):
+                o = obj(fr)
+                k = index(fr)
+                o[k] = op(o[k], value(fr))
+            return aug_assign
+        else:
+            raise RuntimeError('invalid assignment target')
+
+        store = self._store(target)
+        def aug_assign(fr):
+            store(fr, op(load(fr), value(fr)))
+        return aug_assign
+
+    def _store(self, target):
+        """
+        Compile an assignment target into `store(fr, value)`.
+        """
+
+        if isinstance(target, ast.Name):
+            name = target.id
+            i = self._scope.get(name)
+            if i is not None:
+                def store(fr, value):
+                    fr.locals[i] = value
+            else:
+                def store(fr, value):
+                    fr.globals[name] = value
+            return store
+
+        if isinstance(target, (ast.Tuple, ast.List)):
+            stores = tuple(self._store(elt) for elt in target.elts)
+            def store(fr, value):
+                value = tuple(value)
+                if len(value) != len(stores):
+                    raise RuntimeError('can\'t unpack {} values into {}'.format(len(value), len(stores)))
+                for st, el in zip(stores, value):
+                    st(fr, el)
+            return store
+
+        if isinstance(target, ast.Subscript):
+            self.mutates = True
+            obj = self.expr(target.value)
+            index = self.expr(target.slice)
+            def store(fr, value):
+                obj(fr)[index(fr)] = value
+            return store
+
+        raise RuntimeError('invalid assignment target')
+
+    def function(self, stmt):
+        """
+        Compile the body and the signature of a `def` into a `FunctionCode`.
+        """
+
+        if self._in_function:
+            raise RuntimeError('nested functions are not supported')
+        if stmt.decorator_list:
+            raise RuntimeError('decorators are not supported')
+
+        args = stmt.args
+        if getattr(args, 'posonlyargs', None):
+            raise RuntimeError('positional-only parameters are not supported')
+
+        params = [arg.arg for arg in args.args] + [arg.arg for arg in args.kwonlyargs]
+        if len(set(params)) != len(params):
+            raise RuntimeError('duplicate parameter in {}()'.format(stmt.name))
+
+        has_default = [False] * (len(args.args) - len(args.defaults)) + [True] * len(args.defaults)
+        has_default.extend(d is not None for d in args.kw_defaults)
+
+        scope = { param: i for i, param in enumerate(params) }
+        nslots = len(params)
+        varargs = kwargs = None
+        if args.vararg is not None:
+            varargs = scope[args.vararg.arg] = nslots
+            nslots += 1
+        if args.kwarg is not None:
+            kwargs = scope[args.kwarg.arg] = nslots
+            nslots += 1
+        bound = frozenset(scope)
+
+        for name in _assigned_names(stmt.body):
+            if name not in scope:
+                scope[name] = nslots
+                nslots += 1
+
+        saved = self._scope, self._bound, self._in_function, self.nslots, self._loops
+        self._scope = scope
+        self._bound = bound
+        self._in_function = True
+        self.nslots = nslots
+        self._loops = 0
+        try:
+            body = self.block(stmt.body)
+            nslots = self.nslots
+        finally:
+            self._scope, self._bound, self._in_function, self.nslots, self._loops = saved
+
+        return FunctionCode(stmt.name, tuple(params), len(args.args), varargs, kwargs,
+            tuple(has_default), nslots, body)
+
+    def _FunctionDef(self, stmt):
+        name = stmt.name
+        code = self.function(stmt)
+
+        # The defaults are evaluated once, when the function is defined.
+        args = stmt.args
+        defaults = tuple(self.expr(d) for d in args.defaults)
+        defaults += tuple(self.expr(d) for d in args.kw_defaults if d is not None)
+
+        def define(fr):
+            fr.globals[name] = code.make_function(fr.globals, fr.builtins, fr.loader,
+                tuple(d(fr) for d in defaults))
+        return define
+
+    def _Return(self, stmt):
+        if not self._in_function:
+            raise RuntimeError('`return` outside of a function')
+
+        if stmt.value is None:
+            def return_(fr):
+                return _RETURN
+            return return_
+
+        value = self.expr(stmt.value)
+        def return_(fr):
+            fr.result = value(fr)
+            return _RETURN
+        return return_
+
+    def _If(self, stmt):
+        if not self._in_function:
+            raise RuntimeError('`if` statements are only allowed in functions')
+
+        test = self.expr(stmt.test)
+        body = self.block(stmt.body)
+        if not stmt.orelse:
+            def if_(fr):
+                if test(fr):
+                    return body(fr)
+            return if_
+
+        orelse = self.block(stmt.orelse)
+        def if_else(fr):
+            if test(fr):
+                return body(fr)
+            return orelse(fr)
+        return if_else
+
+    def _For(self, stmt):
+        if not self._in_function:
+            raise RuntimeError('`for` loops are only allowed in functions')
+        if stmt.orelse:
+            raise RuntimeError('`for` loops can\'t have an `else` clause')
+
+        iterable = self.expr(stmt.iter)
+        store = self._store(stmt.target)
+
+        self._loops += 1
+        try:
+            body = self.block(stmt.body)
+        finally:
+            self._loops -= 1
+
+        def for_(fr):
+            for value in _iterate(iterable(fr)):
+                store(fr, value)
+                r = body(fr)
+                if r is not None:
+                    if r == _BREAK:
+                        break
+                    if r == _RETURN:
+                        return r
+        return for_
+
+    def _Break(self, stmt):
+        if not self._loops:
+            raise RuntimeError('`break` outside of a loop')
+        return lambda fr: _BREAK
+
+    def _Continue(self, stmt):
+        if not self._loops:
+            raise RuntimeError('`continue` outside of a loop')
+        return lambda fr: _CONTINUE
+
+    def _Call(self, e):
+        if isinstance(e.func, ast.Attribute):
+            return self._method_call(e)
+
+        fn = self.expr(e.func)
+        if any(kw.arg is None for kw in e.keywords) or any(isinstance(arg, ast.Starred) for arg in e.args):
+            unpack = self._unpacked_args(e)
+            return lambda fr: fn(fr)(fr.ctx, *unpack[0](fr), **unpack[1](fr))
+
+        args = tuple(self.expr(arg) for arg in e.args)
+        kws = tuple((kw.arg, self.expr(kw.value)) for kw in e.keywords)
+
+        if not kws:
+            if not args:
+                return lambda fr: fn(fr)(fr.ctx)
+            if len(args) == 1:
+                arg0, = args
+                return lambda fr: fn(fr)(fr.ctx, arg0(fr))
+            return lambda fr: fn(fr)(fr.ctx, *[arg(fr) for arg in args])
+
+        if not args:
+            return lambda fr: fn(fr)(fr.ctx, **{k: v(fr) for k, v in kws})
+        return lambda fr: fn(fr)(fr.ctx, *[arg(fr) for arg in args], **{k: v(fr) for k, v in kws})
+
+    def _unpacked_args(self, e):
+        """
+        Compile the arguments of a call with `*args` or `**kwargs` into
+        a pair of closures that return the positional arguments
+        and the keyword arguments, respectively.
+        """
+
+        args = tuple((isinstance(arg, ast.Starred), self.expr(arg.value if isinstance(arg, ast.Starred) else arg))
+            for arg in e.args)
+        kws = tuple((kw.arg, self.expr(kw.value)) for kw in e.keywords)
+
+        def get_args(fr):
+            r = []
+            for starred, arg in args:
+                if starred:
+                    r.extend(_iterate(arg(fr)))
+                else:
+                    r.append(arg(fr))
+            return r
+
+        def get_kws(fr):
+            r = {}
+            for k, v in kws:
+                if k is None:
+                    for kk, vv in v(fr).items():
+                        if kk in r:
+                            raise RuntimeError('got multiple values for argument {}'.format(kk))
+                        r[kk] = vv
+                else:
+                    if k in r:
+                        raise RuntimeError('got multiple values for argument {}'.format(k))
+                    r[k] = v(fr)
+            return r
+
+        return get_args, get_kws
+
+    def _method_call(self, e):
+        obj = self.expr(e.func.value)
+        name = e.func.attr
+        if name in _mutating_methods:
+            self.mutates = True
+        get_args, get_kws = self._unpacked_args(e)
+        return lambda fr: call_method(fr.ctx, obj(fr), name, get_args(fr), get_kws(fr))
+
+    def _Name(self, e):
+        if not isinstance(e.ctx, ast.Load):
+            raise RuntimeError('invalid name')
+
+        name = e.id
+        i = self._scope.get(name)
+        if i is not None:
+            if name in self._bound:
+                return lambda fr: fr.locals[i]
+
+            def load_local(fr):
+                r = fr.locals[i]
+                if r is _unbound:
+                    raise RuntimeError('local variable {} referenced before assignment'.format(name))
+                return r
+            return load_local
+
+        def load_name(fr):
+            r = fr.globals.get(name, _unbound)
+            if r is _unbound:
+                r = fr.builtins.get(name, _unbound)
+                if r is _unbound:
+                    r = universe.get(name, _unbound)
+                    if r is _unbound:
+                        raise RuntimeError('name {} is not defined'.format(name))
+            return r
+        return load_name
+
+    def _Subscript(self, e):
+        if not isinstance(e.ctx, ast.Load):
+            raise RuntimeError('invalid subscript')
+
+        value = self.expr(e.value)
+        index = self.expr(e.slice)
+        return lambda fr: value(fr)[index(fr)]
+
+    def _Index(self, e):
+        return self.expr(e.value)
+
+    def _Slice(self, e):
+        lower = self.expr(e.lower) if e.lower is not None else _Const(None)
+        upper = self.expr(e.upper) if e.upper is not None else _Const(None)
+        step = self.expr(e.step) if e.step is not None else _Const(None)
+        return lambda fr: slice(lower(fr), upper(fr), step(fr))
+
+    def _Tuple(self, e):
+        if not isinstance(e.ctx, ast.Load):
+            raise RuntimeError('invalid tuple context')
+
+        elts = tuple(self.expr(elt) for elt in e.elts)
+        if all(isinstance(elt, _Const) for elt in elts):
+            return _Const(tuple(elt.value for elt in elts))
+        return lambda fr: tuple(elt(fr) for elt in elts)
+
+    def _List(self, e):
+        if not isinstance(e.ctx, ast.Load):
+            raise RuntimeError('invalid list context')
+
+        elts = tuple(self.expr(elt) for elt in e.elts)
+        if all(isinstance(elt, _Const) for elt in elts):
+            return _Const(tuple(elt.value for elt in elts))
+        return lambda fr: tuple(elt(fr) for elt in elts)
+
+    def _Dict(self, e):
+        items = tuple((self.expr(k), self.expr(v)) for k, v in zip(e.keys, e.values))
+        return lambda fr: { k(fr): v(fr) for k, v in items }
+
+    def _BinOp(self, e):
+        op = _binops.get(type(e.op))
+        if op is None:
+            raise RuntimeError('Unknown expression')
+
+        lhs = self.expr(e.left)
+        rhs = self.expr(e.right)
+        return lambda fr: op(lhs(fr), rhs(fr))
+
+    def _Compare(self, e):
+        ops = tuple(_cmpops[type(op)] for op in e.ops)
+        lhs = self.expr(e.left)
+        rhss = tuple(self.expr(c) for c in e.comparators)
+
+        if len(ops) == 1:
+            op, = ops
+            rhs, = rhss
+            return lambda fr: op(lhs(fr), rhs(fr))
+
+        def compare(fr):
+            l = lhs(fr)
+            for op, rhs in zip(ops, rhss):
+                r = rhs(fr)
+                if not op(l, r):
+                    return False
+                l = r
+            return True
+        return compare
+
+    def _BoolOp(self, e):
+        values = tuple(self.expr(v) for v in e.values)
+        if isinstance(e.op, ast.And):
+            def and_(fr):
+                for value in values:
+                    r = value(fr)
+                    if not r:
+                        return r
+                return r
+            return and_
+
+        def or_(fr):
+            for value in values:
+                r = value(fr)
+                if r:
+                    return r
+            return r
+        return or_
+
+    def _UnaryOp(self, e):
+        op = _unaryops.get(type(e.op))
+        if op is None:
+            raise RuntimeError('Unknown expression')
+
+        operand = self.expr(e.operand)
+        return lambda fr: op(operand(fr))
+
+    def _IfExp(self, e):
+        test = self.expr(e.test)
+        body = self.expr(e.body)
+        orelse = self.expr(e.orelse)
+        return lambda fr: body(fr) if test(fr) else orelse(fr)
+
+    def _ListComp(self, e):
+        def emit(elt):
+            return lambda fr, out: out.append(elt(fr))
+
+        loop = self._comprehension(e.generators, lambda: emit(self.expr(e.elt)))
+        def list_comp(fr):
+            out = []
+            loop(fr, out)
+            return tuple(out)
+        return list_comp
+
+    def _DictComp(self, e):
+        def emit(key, value):
+            def store(fr, out):
+                out[key(fr)] = value(fr)
+            return store
+
+        loop = self._comprehension(e.generators, lambda: emit(self.expr(e.key), self.expr(e.value)))
+        def dict_comp(fr):
+            out = {}
+            loop(fr, out)
+            return out
+        return dict_comp
+
+    def _comprehension(self, generators, compile_emit):
+        """
+        Compile the `for` and `if` clauses of a comprehension into
+        `loop(fr, out)`, which calls the result of `compile_emit()`
+        for every element. The loop variables get slots of their own.
+        """
+
+        saved = self._scope, self._bound
+        try:
+            clauses = []
+            for gen in generators:
+                if getattr(gen, 'is_async', False):
+                    raise RuntimeError('Unknown expression')
+
+                # The first iterable is evaluated in the enclosing scope.
+                iterable = self.expr(gen.iter)
+
+                self._scope = dict(self._scope)
+                for name in _target_names(gen.target):
+                    self._scope[name] = self._alloc()
+                self._bound = self._bound | _target_names(gen.target)
+
+                store = self._store(gen.target)
+                conds = tuple(self.expr(cond) for cond in gen.ifs)
+                clauses.append((iterable, store, conds))
+
+            loop = compile_emit()
+        finally:
+            self._scope, self._bound = saved
+
+        for iterable, store, conds in reversed(clauses):
+            loop = _comprehension_loop(iterable, store, conds, loop)
+        return loop
+
+    def _Attribute(self, e):
+        if not isinstance(e.ctx, ast.Load):
+            raise RuntimeError('only reads from structures')
+
+        value = self.expr(e.value)
+        attr = e.attr
+        return lambda fr: getattr(value(fr), attr)
+
+    def _Constant(self, e):
+        return _Const(e.value)
+
+    def _Str(self, e):
+        return _Const(e.s)
+
+    def _Num(self, e):
+        return _Const(e.n)
+
+    def _NameConstant(self, e):
+        return _Const(e.value)
+
+def _comprehension_loop(iterable, store, conds, inner):
+    if not conds:
+        def loop(fr, out):
+            for value in _iterate(iterable(fr)):
+                store(fr, value)
+                inner(fr, out)
+        return loop
+
+    def loop(fr, out):
+        for value in _iterate(iterable(fr)):
+            store(fr, value)
+            if all(cond(fr) for cond in conds):
+                inner(fr, out)
+    return loop
+
+def _iterate(value):
+    if isinstance(value, (str, bytes)):
+        raise RuntimeError('strings are not iterable')
+    return value
+
+def _assigned_names(stmts):
+    """
+    Return the names assigned by `stmts` and the blocks nested in them,
+    comprehensions excluded.
+    """
+
+    r = []
+    for stmt in stmts:
+        if isinstance(stmt, ast.Assign):
+            for target in stmt.targets:
+                r.extend(_target_names(target))
+        elif isinstance(stmt, ast.AugAssign):
+            r.extend(_target_names(stmt.target))
+        elif isinstance(stmt, ast.For):
+            r.extend(_target_names(stmt.target))
+            r.extend(_assigned_names(stmt.body))
+        elif isinstance(stmt, ast.If):
+            r.extend(_assigned_names(stmt.body))
+            r.extend(_assigned_names(stmt.orelse))
+    return r
+
+def _target_names(target):
+    if isinstance(target, ast.Name):
+        return frozenset((target.id,))
+    if isinstance(target, (ast.Tuple, ast.List)):
+        return frozenset().union(*(_target_names(elt) for elt in target.elts))
+    return frozenset()
+
+class _Const:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, fr):
+        return self.value
+
+def is_load(stmt):
+    return (isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Call)
+        and isinstance(stmt.value.func, ast.Name) and stmt.value.func.id == 'load')
+
+def _rule_call_name(stmt):
+    """
+    If `stmt` is a call that could be a rule instantiation, i.e.
+    `f(..., name = "literal", ...)`, return the name.
+    """
+
+    if not isinstance(stmt, ast.Expr) or not isinstance(stmt.value, ast.Call):
+        return None
+
+    call = stmt.value
+    if not isinstance(call.func, ast.Name) or call.func.id == 'load':
+        return None
+
+    for kw in call.keywords:
+        if kw.arg == 'name':
+            return _str_value(kw.value)
+    return None
+
+def _is_str(e):
+    return _str_value(e) is not None
+
+def _str_value(e):
+    kind = type(e).__name__
+    if kind == 'Constant':
+        value = e.value
+    elif kind == 'Str':
+        value = e.s
+    else:
+        return None
+    return value if isinstance(value, str) else None
@@ -3,8 +3,25 @@ import inspect
 import functools
 import operator
 
-def parse(fin):
-    mod = ast.parse(fin.read())
+from . import bzlcompile
+
+def parse(fin, cache=None):
+    return parse_string(fin.read(), cache)
+
+def parse_string(source, cache=None):
+    if cache is None:
+        return _parse_source(source)
+    return cache.get(source, _parse_source)
+
+def warm(fin, cache):
+    """
+    Parse `fin` into `cache`, unless it's there already.
+    """
+
+    cache.warm(fin.read(), _parse_source)
+
+def _parse_source(source):
+    mod = ast.parse(source)
     assert isinstance(mod, ast.Module)
     return mod
 
@@ -31,13 +48,25 @@ def make_builtins(obj, ctx):
         r[name] = functools.partial(fn, ctx)
     return r
 
-def evaluate(ast, builtins, ctx, loader):
+def evaluate(mod, builtins, ctx, loader, defer=None):
+    if not isinstance(mod, ast.Module):
+        # compiled by `bzlcompile.compile`
+        return mod.evaluate(builtins, ctx, loader, defer)
+
+    # Only compiled modules can defer rule calls (see `bzlcompile`).
+
     e = _Evaluator(builtins, ctx, loader)
-    e.visit(ast)
+    e.visit(mod)
     return e._globals
 
 _binops = {
     ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Mod: operator.mod,
+    ast.FloorDiv: operator.floordiv,
+    ast.BitOr: operator.or_,
+    ast.BitAnd: operator.and_,
     }
 
 class _Evaluator(ast.NodeVisitor):
@@ -48,8 +77,13 @@ class _Evaluator(ast.NodeVisitor):
         self._globals = {}
 
     def visit_Call(self, e):
+        args = [self.visit(arg) for arg in e.args]
+        kw = { kw.arg: self.visit(kw.value) for kw in e.keywords }
+        if isinstance(e.func, ast.Attribute):
+            return bzlcompile.call_method(self._ctx, self.visit(e.func.value), e.func.attr, args, kw)
+
         fn = self.visit(e.func)
-        return fn(self._ctx, *[self.visit(arg) for arg in e.args], **{ kw.arg: self.visit(kw.value) for kw in e.keywords })
+        return fn(self._ctx, *args, **kw)
 
     def visit_Expr(self, e):
         return self.visit(e.value)
@@ -65,7 +99,9 @@ class _Evaluator(ast.NodeVisitor):
         if isinstance(e.ctx, ast.Load):
             if e.id in self._globals:
                 return self._globals[e.id]
-            return self._builtins[e.id]
+            if e.id in self._builtins:
+                return self._builtins[e.id]
+            return bzlcompile.universe[e.id]
         elif isinstance(e.ctx, ast.Store):
             return _Lvalue(self._globals, e.id)
         else:
@@ -97,22 +133,9 @@ class _Evaluator(ast.NodeVisitor):
 
     def visit_Module(self, node):
         for stmt in node.body:
-            if isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Call) and isinstance(stmt.value.func, ast.Name) and stmt.value.func.id == 'load':
-                # special handling for `load`, instead of calling load(*args),
-                # we'll call load(arg0), expect it to return a dict and then introduce
-                # the requested names into the global scope
-                if len(stmt.value.args) == 0:
-                   raise RuntimeError('`load` takes a string argument')
-
-                if not all(isinstance(arg, ast.Str) for arg in stmt.value.args):
-                    raise RuntimeError('the arguments to `load` must be string literals')
-
-                bzl = self._loader(stmt.value.args[0].s)
-
-                for arg in stmt.value.args[1:]:
-                    self._globals[arg.s] = bzl[arg.s]
-                for k, v_expr in stmt.value.keywords:
-                    self._globals[k] = bzl[v_expr.s]
+            if bzlcompile.is_load(stmt):
+                # `load` binds names instead of making a call.
+                self._compiled(stmt)
             else:
                 self.visit(stmt)
 
@@ -123,16 +146,19 @@ class _Evaluator(ast.NodeVisitor):
         return e.n
 
     def visit_FunctionDef(self, stmt):
+        # Function bodies are always compiled, see `bzlcompile.Function`.
+        code = bzlcompile.compile_function(stmt)
         args = stmt.args
-        body = stmt.body
-        def user_fn(pkg, *args, **kw):
-            pass
-
-        self._globals[stmt.name] = user_fn
+        defaults = [self.visit(d) for d in args.defaults]
+        defaults.extend(self.visit(d) for d in args.kw_defaults if d is not None)
+        self._globals[stmt.name] = code.make_function(self._globals, self._builtins, self._loader, tuple(defaults))
 
     def visit_NameConstant(self, e):
         return e.value
 
+    def visit_Constant(self, e):
+        return e.value
+
     def visit_Attribute(self, e):
         if not isinstance(e.ctx, ast.Load):
             raise RuntimeError('only reads from structures')
@@ -140,4 +166,12 @@ class _Evaluator(ast.NodeVisitor):
         return getattr(lhs, e.attr)
 
     def generic_visit(self, node):
-        raise RuntimeError('Unknown expression')
+        if not isinstance(node, (ast.expr, ast.stmt)):
+            raise RuntimeError('Unknown expression')
+        return self._compiled(node)
+
+    def _compiled(self, node):
+        # Everything the evaluator doesn't handle itself (comprehensions,
+        # comparisons, ...) is compiled, see `bzlcompile.compile_node`.
+        fn = bzlcompile.compile_node(node)
+        return fn(self._globals, self._builtins, self._ctx, self._loader)
@@ -0,0 +1,151 @@
+"""
+Support for the `glob` builtin.
+
+Every repository owns a `DirIndex`, a lazily populated view of its
+directory tree built on `Fs.listdir` (i.e. on `os.scandir`). For each
+package, the index keeps the list of files (and directories) that
+belong to it, stopping at subpackages. Patterns are compiled into
+a single regular expression per pattern set, and compiled sets are
+shared by all packages; `glob` then only filters the package listing.
+
+Listings and results are cached and shared by every caller, so they
+are tuples; Starlark lists are tuples as well, and `glob(...) + [...]`
+makes a new one.
+"""
+
+import functools
+import re
+
+class DirIndex:
+    def __init__(self, fs, root, build_file_names):
+        self._fs = fs
+        self._root = root
+        self._build_file_names = build_file_names
+        self._dirs = {}
+        self._entries = {}
+        self._results = {}
+
+    def _dir(self, rel):
+        """
+        Return the sorted file and subdirectory names of a directory,
+        relative to the repository root.
+        """
+
+        r = self._dirs.get(rel)
+        if r is None:
+            try:
+                listing = self._fs.listdir(self._root + rel)
+            except (IOError, OSError):
+                listing = {}
+
+            files = []
+            dirs = []
+            for name in sorted(listing):
+                if self._fs.isdir(self._root + rel + (name,)):
+                    dirs.append(name)
+                else:
+                    files.append(name)
+            r = self._dirs[rel] = files, dirs
+        return r
+
+    def _is_package(self, rel):
+        files, _ = self._dir(rel)
+        return any(fname in files for fname in self._build_file_names)
+
+    def entries(self, pkg_rel, recursive):
+        """
+        Return `(entries, dirs)`, where `entries` lists `(path, is_dir)`
+        for everything in the package, with paths relative to it, and
+        `dirs` lists the directories that were read. Unless `recursive`
+        is set, only the package directory itself is listed. Both are
+        tuples, shared with the cache.
+        """
+
+        key = pkg_rel, recursive
+        r = self._entries.get(key)
+        if r is not None:
+            return r
+
+        entries = []
+        dirs = []
+        stack = [()]
+        while stack:
+            sub = stack.pop()
+            rel = pkg_rel + sub
+            dirs.append(rel)
+
+            files, subdirs = self._dir(rel)
+            prefix = ''.join(el + '/' for el in sub)
+            entries.extend((prefix + fname, False) for fname in files)
+
+            for name in reversed(subdirs):
+                if self._is_package(rel + (name,)):
+                    continue
+
+                entries.append((prefix + name, True))
+                if recursive:
+                    stack.append(sub + (name,))
+
+        r = self._entries[key] = tuple(entries), tuple(dirs)
+        return r
+
+    def glob(self, pkg_rel, include, exclude=(), exclude_directories=True):
+        """
+        Return the sorted paths in the package matching `include` but not
+        `exclude`, along with the paths of the directories read
+        to compute them.
+        """
+
+        key = pkg_rel, include, exclude, exclude_directories
+        r = self._results.get(key)
+        if r is not None:
+            return r
+
+        if not include:
+            return (), ()
+
+        recursive = any('/' in pattern or '**' in pattern for pattern in include)
+        entries, dirs = self.entries(pkg_rel, recursive)
+
+        inc = _compile_patterns(include)
+        exc = _compile_patterns(exclude)
+
+        matched = []
+        for path, is_dir in entries:
+            if is_dir and exclude_directories:
+                continue
+            if inc.match(path) and not (exc and exc.match(path)):
+                matched.append(path)
+        matched.sort()
+
+        r = self._results[key] = tuple(matched), tuple(self._root + d for d in dirs)
+        return r
+
+@functools.lru_cache(maxsize=1024)
+def _compile_patterns(patterns):
+    if not patterns:
+        return None
+    return re.compile(r'(?:{})\Z'.format('|'.join(_translate(pattern) for pattern in patterns)))
+
+def _translate(pattern):
+    if not pattern or pattern.startswith('/') or pattern.endswith('/'):
+        raise RuntimeError('invalid glob pattern: {!r}'.format(pattern))
+
+    segs = pattern.split('/')
+    r = []
+    for i, seg in enumerate(segs):
+        last = i == len(segs) - 1
+        if seg in ('', '.', '..'):
+            raise RuntimeError('invalid glob pattern: {!r}'.format(pattern))
+
+        if seg == '**':
+            r.append('(?:[^/]+(?:/[^/]+)*)?' if last else '(?:[^/]+/)*')
+            continue
+
+        if '**' in seg:
+            raise RuntimeError('recursive wildcard must be its own segment: {!r}'.format(pattern))
+
+        r.append(''.join('[^/]*' if c == '*' else '[^/]' if c == '?' else re.escape(c) for c in seg))
+        if not last:
+            r.append('/')
+    return ''.join(r)
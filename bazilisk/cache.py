@@ -0,0 +1,144 @@
+import hashlib
+import os, os.path
+import pickle
+import sys
+import tempfile
+
+_format_version = 1
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'bazilisk')
+
+class ParseCache:
+    """
+    An on-disk cache of parsed BUILD, WORKSPACE and .bzl files.
+
+    Entries are keyed by a hash of the file contents and of the interpreter
+    version (the pickled AST is only valid for the interpreter that
+    produced it). The total size of the cache is kept under `max_size`
+    bytes by evicting the least recently used entries.
+
+    `hits` and `misses` count the lookups made in this process; they
+    are written to the `--trace` profile as a `parse_cache` counter.
+    """
+
+    def __init__(self, cache_dir, max_size=256*1024*1024):
+        self._dir = cache_dir
+        self._max_size = max_size
+        self._size = None
+        self.hits = 0
+        self.misses = 0
+
+        self._salt = '{}\0{}\0{}\0'.format(_format_version, sys.implementation.name, sys.version).encode('utf-8')
+
+    def key(self, source):
+        if not isinstance(source, bytes):
+            source = source.encode('utf-8')
+        return hashlib.sha256(self._salt + source).hexdigest()
+
+    def get(self, source, parse):
+        """
+        Return the parsed form of `source`, calling `parse(source)`
+        and storing the result on a miss.
+        """
+
+        key = self.key(source)
+        path = os.path.join(self._dir, key)
+
+        try:
+            with open(path, 'rb') as fin:
+                r = pickle.load(fin)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            pass
+        else:
+            self.hits += 1
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+            return r
+
+        self.misses += 1
+        r = parse(source)
+        self._store(path, r)
+        return r
+
+    def warm(self, source, parse):
+        """
+        Make sure that `source` has an entry, calling `parse(source)`
+        and storing the result if it hasn't. Unlike `get`, an existing
+        entry isn't read.
+        """
+
+        path = os.path.join(self._dir, self.key(source))
+        if not os.path.isfile(path):
+            self._store(path, parse(source))
+
+    def clear(self):
+        for entry in self._entries():
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        self._size = 0
+
+    def _entries(self):
+        try:
+            it = os.scandir(self._dir)
+        except OSError:
+            return []
+
+        with it:
+            return [entry for entry in it if entry.is_file() and not entry.name.startswith('.')]
+
+    def _store(self, path, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self._max_size:
+            return
+
+        try:
+            os.makedirs(self._dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self._dir, prefix='.tmp')
+            with os.fdopen(fd, 'wb') as fout:
+                fout.write(data)
+            os.replace(tmp_path, path)
+        except (IOError, OSError):
+            # The cache is an optimization only, failing to write
+            # an entry must never fail the build.
+            return
+
+        if self._size is None:
+            self._size = sum(entry.stat().st_size for entry in self._entries())
+        else:
+            self._size += len(data)
+
+        if self._size > self._max_size:
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in self._entries():
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+
+        entries.sort()
+        size = sum(size for _, size, _ in entries)
+
+        # Shrink to three quarters of the limit so that we don't
+        # have to evict again on the very next store.
+        target = self._max_size * 3 // 4
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+
+        self._size = size
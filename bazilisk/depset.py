@@ -0,0 +1,172 @@
+"""
+The `depset` type.
+
+A depset is a set of direct elements plus a list of other depsets,
+so that a target's transitive headers or defines share the structure
+of its dependencies' instead of copying it: the depsets of a whole
+graph take memory proportional to the number of nodes and edges,
+rather than to the sum of all the flattened sets.
+
+Flattening (`to_list`) walks the DAG iteratively, visiting every
+shared depset once, and removes duplicate elements, keeping the
+first occurrence. Results are cached; when a depset is flattened, the
+cached lists of its children are reused if they were flattened in the
+same order. The order of the result is:
+
+    default, postorder  the elements of the children, left to right,
+                        before the direct elements
+    preorder            the direct elements before those of
+                        the children, left to right
+    topological         every depset's direct elements before those
+                        of the depsets it contains
+"""
+
+_orders = ('default', 'postorder', 'preorder', 'topological')
+
+# The traversal of each order; `default` is a postorder.
+_traversals = {
+    'default': 'postorder',
+    'postorder': 'postorder',
+    'preorder': 'preorder',
+    'topological': 'topological',
+    }
+
+class Depset:
+    __slots__ = ('_direct', '_transitive', '_order', '_list')
+
+    def __init__(self, direct=(), transitive=(), order='default'):
+        if order not in _orders:
+            raise RuntimeError('invalid depset order: {}'.format(order))
+
+        children = []
+        for child in transitive:
+            if not isinstance(child, Depset):
+                raise RuntimeError('depset transitive elements must be depsets')
+            if child._order != order and child._order != 'default' and order != 'default':
+                raise RuntimeError('order {} is incompatible with {}'.format(child._order, order))
+            if child._direct or child._transitive:
+                children.append(child)
+
+        self._direct = tuple(direct)
+        self._transitive = tuple(children)
+        self._order = order
+        self._list = None
+
+    @property
+    def order(self):
+        return self._order
+
+    def __repr__(self):
+        return 'depset({!r})'.format(list(self.to_list()))
+
+    def __bool__(self):
+        return bool(self._direct) or bool(self._transitive)
+
+    def to_list(self):
+        """
+        Return the elements as a tuple, without duplicates.
+        """
+
+        r = self._list
+        if r is None:
+            if not self._transitive:
+                r = _unique(self._direct)
+            elif self._order == 'preorder':
+                r = self._preorder()
+            elif self._order == 'topological':
+                r = self._topological()
+            else:
+                r = self._postorder()
+            self._list = r
+        return r
+
+    def _cached(self, traversal):
+        # A child's cached list can stand in for its subtree only if
+        # it was flattened the same way; a `default` child of a
+        # `preorder` depset is listed in preorder, for one.
+        if self._transitive and _traversals[self._order] != traversal:
+            return None
+        return self._list
+
+    def _postorder(self):
+        out = []
+        seen = set()
+        visited = set()
+
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                _extend(out, seen, node._direct)
+                continue
+
+            if id(node) in visited:
+                continue
+            visited.add(id(node))
+
+            if node is not self and node._cached('postorder') is not None:
+                _extend(out, seen, node._list)
+                continue
+
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node._transitive))
+        return tuple(out)
+
+    def _preorder(self):
+        out = []
+        seen = set()
+        visited = set()
+
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if id(node) in visited:
+                continue
+            visited.add(id(node))
+
+            if node is not self and node._cached('preorder') is not None:
+                _extend(out, seen, node._list)
+                continue
+
+            _extend(out, seen, node._direct)
+            stack.extend(reversed(node._transitive))
+        return tuple(out)
+
+    def _topological(self):
+        # The reverse of a postorder that visits the children (and
+        # the direct elements) from right to left.
+        out = []
+        seen = set()
+        visited = set()
+
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                _extend(out, seen, reversed(node._direct))
+                continue
+
+            if id(node) in visited:
+                continue
+            visited.add(id(node))
+
+            stack.append((node, True))
+            stack.extend((child, False) for child in node._transitive)
+
+        out.reverse()
+        return tuple(out)
+
+def _unique(values):
+    if len(values) < 2:
+        return values
+
+    seen = set()
+    out = []
+    _extend(out, seen, values)
+    return tuple(out) if len(out) != len(values) else values
+
+def _extend(out, seen, values):
+    for value in values:
+        if value not in seen:
+            seen.add(value)
+            out.append(value)
@@ -0,0 +1,192 @@
+import errno
+import hashlib
+import os, os.path
+import posixpath
+import shutil
+import tarfile
+import tempfile
+import threading
+import zipfile
+
+class Http:
+    """
+    The default `http` dependency of `Workspace`.
+
+    `open(url)` returns a binary stream. `file://` URLs are opened
+    directly, so that archives can be served from the disk in tests.
+    """
+
+    def open(self, url):
+        if url.startswith('file://'):
+            return open(_file_url_path(url), 'rb')
+
+        import urllib.request
+        return urllib.request.urlopen(url)
+
+def _file_url_path(url):
+    import urllib.parse
+    import urllib.request
+    return urllib.request.url2pathname(urllib.parse.urlsplit(url).path)
+
+class RepoCache:
+    """
+    A content-addressed cache of downloaded and extracted archives.
+
+    Archives are stored under `<cache_dir>/sha256/<digest>` and extracted
+    next to them, so an archive is only ever downloaded once, no matter
+    which workspace, repository name or URL refers to it. Downloads are
+    streamed to disk and hashed on the way; extraction reads from
+    the stored file.
+
+    The cache may be shared by threads and processes; entries are
+    created in temporary locations and renamed into place.
+    """
+
+    def __init__(self, cache_dir, chunk_size=1 << 16):
+        self._dir = cache_dir
+        self._chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def fetch(self, http, urls, sha256=None):
+        """
+        Return the path of the archive with the given hash, downloading
+        it from the first of `urls` that works if it isn't cached.
+        Without `sha256`, the archive is always downloaded.
+        """
+
+        if sha256 is not None:
+            sha256 = sha256.lower()
+            path = os.path.join(self._dir, 'sha256', sha256, 'file')
+            if os.path.isfile(path):
+                return path
+
+        errors = []
+        for url in urls:
+            try:
+                return self._download(http, url, sha256)
+            except (IOError, OSError) as e:
+                errors.append('{}: {}'.format(url, e))
+
+        raise RuntimeError('failed to fetch {}'.format('; '.join(errors) or 'archive: no urls'))
+
+    def _download(self, http, url, sha256):
+        tmp_dir = os.path.join(self._dir, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        h = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as fout, http.open(url) as fin:
+                while True:
+                    chunk = fin.read(self._chunk_size)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    fout.write(chunk)
+
+            digest = h.hexdigest()
+            if sha256 is not None and digest != sha256:
+                raise RuntimeError('checksum mismatch for {}: expected {}, got {}'.format(url, sha256, digest))
+
+            entry_dir = os.path.join(self._dir, 'sha256', digest)
+            os.makedirs(entry_dir, exist_ok=True)
+            path = os.path.join(entry_dir, 'file')
+            os.replace(tmp_path, path)
+            return path
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def materialize(self, http, urls, sha256=None, strip_prefix=None, type=None):
+        """
+        Fetch and extract an archive, returning the directory
+        that corresponds to `strip_prefix` inside it.
+        """
+
+        with self._key_lock(sha256 or tuple(urls)):
+            archive = self.fetch(http, urls, sha256)
+            entry_dir = os.path.dirname(archive)
+            out_dir = os.path.join(entry_dir, 'extracted')
+
+            if not os.path.isdir(out_dir):
+                kind = type or _archive_type(urls)
+                tmp_dir = tempfile.mkdtemp(dir=entry_dir, prefix='.tmp')
+                try:
+                    _extract(archive, kind, tmp_dir)
+                    try:
+                        os.rename(tmp_dir, out_dir)
+                    except OSError as e:
+                        # Another process got there first.
+                        if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                            raise
+                        shutil.rmtree(tmp_dir, ignore_errors=True)
+                except BaseException:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    raise
+
+        if strip_prefix:
+            out_dir = os.path.join(out_dir, *strip_prefix.strip('/').split('/'))
+            if not os.path.isdir(out_dir):
+                raise RuntimeError('prefix {} not found in archive'.format(strip_prefix))
+        return out_dir
+
+_archive_suffixes = (
+    ('.zip', 'zip'),
+    ('.jar', 'zip'),
+    ('.tar.gz', 'tar.gz'),
+    ('.tgz', 'tar.gz'),
+    ('.tar.bz2', 'tar.bz2'),
+    ('.tar.xz', 'tar.xz'),
+    ('.tar', 'tar'),
+    )
+
+def _archive_type(urls):
+    for url in urls:
+        path = url.split('?', 1)[0].lower()
+        for suffix, kind in _archive_suffixes:
+            if path.endswith(suffix):
+                return kind
+    raise RuntimeError('can\'t determine the archive type of {}'.format(urls[0] if urls else 'an archive'))
+
+def _check_member(name):
+    name = name.replace('\\', '/')
+    if name.startswith('/') or '..' in posixpath.normpath(name).split('/'):
+        raise RuntimeError('archive member outside the archive: {}'.format(name))
+
+def _extract(archive, kind, out_dir):
+    if kind == 'zip':
+        with zipfile.ZipFile(archive) as z:
+            for name in z.namelist():
+                _check_member(name)
+            z.extractall(out_dir)
+        return
+
+    if kind not in ('tar', 'tar.gz', 'tgz', 'tar.bz2', 'tar.xz'):
+        raise RuntimeError('unsupported archive type: {}'.format(kind))
+
+    kw = {}
+    if hasattr(tarfile, 'data_filter'):
+        kw['filter'] = 'data'
+
+    # Stream mode reads the members in order, without seeking back.
+    with tarfile.open(archive, 'r|*') as tar:
+        for member in tar:
+            _check_member(member.name)
+            if member.issym():
+                _check_member(posixpath.join(posixpath.dirname(member.name), member.linkname))
+            elif member.islnk():
+                _check_member(member.linkname)
+            elif member.isdev():
+                continue
+            tar.extract(member, out_dir, set_attrs=False, **kw)
@@ -1,4 +1,9 @@
+import errno
+import io
+import mmap
 import os, os.path
+import posixpath
+import stat as _stat
 
 class _Path:
     def __init__(self, elems):
@@ -7,6 +12,12 @@ class _Path:
     def __repr__(self):
         return 'Path({!r})'.format(os.path.join(*self._elems))
 
+    def __eq__(self, rhs):
+        return isinstance(rhs, _Path) and self._elems == rhs._elems
+
+    def __hash__(self):
+        return hash(self._elems)
+
     def __truediv__(self, rhs):
         if not isinstance(rhs, str):
             raise TypeError('only strings can be attached to paths')
@@ -19,7 +30,34 @@ class _Path:
 
         return _Path(self._elems + tuple(el for el in rhs if el))
 
+# Kinds of directory entries, as stored in listings.
+_FILE = 0
+_DIR = 1
+_DIR_LINK = 2
+
 class Fs:
+    """
+    The file system, as seen by the workspace.
+
+    Directory listings and stats are cached for the lifetime of
+    the object (or until `invalidate` is called); once a directory has
+    been listed, existence probes of its entries cost no system calls.
+    Files of at least `mmap_threshold` bytes are read through `mmap`.
+    """
+
+    def __init__(self, mmap_threshold=1 << 20):
+        self._mmap_threshold = mmap_threshold
+        self._listings = {}
+        self._stats = {}
+
+    def __getstate__(self):
+        # The caches grow with the workspace; a copy sent to a worker
+        # process starts with empty ones.
+        state = self.__dict__.copy()
+        state['_listings'] = {}
+        state['_stats'] = {}
+        return state
+
     def make_path(self, path):
         path = os.path.abspath(path)
 
@@ -35,5 +73,214 @@ class Fs:
         r.reverse()
         return _Path(tuple(r))
 
+    def native_path(self, path):
+        return os.path.join(*path._elems)
+
+    def split(self, path):
+        if len(path._elems) <= 1:
+            return path, ''
+        return _Path(path._elems[:-1]), path._elems[-1]
+
+    def invalidate(self):
+        """
+        Forget all cached listings and stats.
+        """
+
+        self._listings.clear()
+        self._stats.clear()
+
+    def listdir(self, path):
+        """
+        Return a dict mapping the names in the directory to their kind.
+        The dict is shared with the cache and must not be modified.
+        """
+
+        native_path = self.native_path(path)
+        r = self._listings.get(native_path)
+        if r is None:
+            r = self._list(native_path)
+            self._listings[native_path] = r
+        return r
+
+    def exists(self, path):
+        return self._kind(path) is not None
+
+    def isfile(self, path):
+        return self._kind(path) == _FILE
+
+    def isdir(self, path):
+        return self._kind(path) in (_DIR, _DIR_LINK)
+
+    def _kind(self, path):
+        parent, name = self.split(path)
+        if not name:
+            return _DIR
+
+        try:
+            return self.listdir(parent).get(name)
+        except (IOError, OSError):
+            return None
+
+    def open(self, path, mode):
+        f = open(self.native_path(path), mode)
+        if mode != 'r' or self._mmap_threshold is None:
+            return f
+
+        if os.fstat(f.fileno()).st_size < self._mmap_threshold:
+            return f
+
+        with f:
+            return _MappedFile(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def stat(self, path):
+        native_path = self.native_path(path)
+        r = self._stats.get(native_path)
+        if r is None:
+            r = os.stat(native_path)
+            self._stats[native_path] = r
+        return r
+
+    def walk(self, path):
+        """
+        Walk the directory tree under `path`, yielding a tuple
+        of path components relative to `path` for each directory, along
+        with the lists of its subdirectory and file names. As with
+        `os.walk`, removing names from the subdirectory list prunes
+        the walk, and symlinks to directories are not followed.
+        """
+
+        stack = [()]
+        while stack:
+            rel = stack.pop()
+            try:
+                listing = self.listdir(path + rel)
+            except (IOError, OSError):
+                continue
+
+            dirnames = sorted(name for name, kind in listing.items() if kind != _FILE)
+            filenames = sorted(name for name, kind in listing.items() if kind == _FILE)
+            yield rel, dirnames, filenames
+
+            stack.extend(rel + (name,) for name in reversed(dirnames) if listing[name] == _DIR)
+
+    def _list(self, native_path):
+        r = {}
+        with os.scandir(native_path) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    r[entry.name] = _FILE
+                elif entry.is_symlink():
+                    r[entry.name] = _DIR_LINK
+                else:
+                    r[entry.name] = _DIR
+        return r
+
+class _MappedFile:
+    def __init__(self, mm):
+        self._mm = mm
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        self._mm.close()
+
+    def read(self):
+        # Decode straight from the mapping, without copying it to bytes first.
+        with memoryview(self._mm) as view:
+            return str(view, 'utf-8').replace('\r\n', '\n')
+
+class _MemStat:
+    def __init__(self, mode, size, mtime_ns):
+        self.st_mode = mode
+        self.st_size = size
+        self.st_mtime_ns = mtime_ns
+        self.st_mtime = mtime_ns / 1e9
+
+class MemFs(Fs):
+    """
+    A file system that lives in memory.
+
+    `files` maps absolute slash-separated paths to contents. Relative
+    paths are taken relative to `/`. Loaders can be benchmarked on
+    a `MemFs` without disk noise.
+    """
+
+    def __init__(self, files={}):
+        Fs.__init__(self, mmap_threshold=None)
+        self._files = {}
+        self._dirs = { '/': {} }
+        self._clock = 0
+
+        for path, content in files.items():
+            self.write(path, content)
+
+    def make_path(self, path):
+        path = posixpath.normpath(posixpath.join('/', path))
+        return _Path(('/',) + tuple(el for el in path.split('/') if el))
+
+    def native_path(self, path):
+        return posixpath.join(*path._elems)
+
+    def write(self, path, content):
+        path = self.native_path(self.make_path(path))
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+
+        parent, name = posixpath.split(path)
+        self._mkdirs(parent)
+        self._dirs[parent][name] = _FILE
+
+        self._clock += 1
+        self._files[path] = content, self._clock
+        self.invalidate()
+
+    def remove(self, path):
+        path = self.native_path(self.make_path(path))
+        parent, name = posixpath.split(path)
+        del self._files[path]
+        del self._dirs[parent][name]
+        self.invalidate()
+
+    def _mkdirs(self, path):
+        if path in self._dirs:
+            return
+
+        parent, name = posixpath.split(path)
+        self._mkdirs(parent)
+        self._dirs[parent][name] = _DIR
+        self._dirs[path] = {}
+
+    def _list(self, native_path):
+        r = self._dirs.get(native_path)
+        if r is None:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), native_path)
+        return dict(r)
+
     def open(self, path, mode):
-        return open(os.path.join(*path._elems), mode)
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise IOError(errno.EROFS, os.strerror(errno.EROFS), self.native_path(path))
+
+        native_path = self.native_path(path)
+        try:
+            content, _ = self._files[native_path]
+        except KeyError:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), native_path)
+
+        if 'b' in mode:
+            return io.BytesIO(content)
+        return io.StringIO(content.decode('utf-8'))
+
+    def stat(self, path):
+        native_path = self.native_path(path)
+        if native_path in self._dirs:
+            return _MemStat(_stat.S_IFDIR | 0o755, 0, 0)
+
+        try:
+            content, mtime = self._files[native_path]
+        except KeyError:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), native_path)
+        return _MemStat(_stat.S_IFREG | 0o644, len(content), mtime)
@@ -0,0 +1,249 @@
+from array import array
+
+class TargetGraph:
+    """
+    A dense, integer-indexed dependency graph.
+
+    Nodes are numbered 0..n-1 in discovery order. Edges are stored in
+    two flat arrays (compressed sparse rows): the dependencies of node
+    `i` are `deps[offsets[i]:offsets[i+1]]`. Transitive closures are
+    integer bitsets with bit `j` set if node `j` is reachable; they are
+    computed in topological order and memoized, so that every edge is
+    processed once per closure rather than once per path.
+    """
+
+    def __init__(self, nodes, offsets, deps):
+        self.nodes = nodes
+        self.index = { node: i for i, node in enumerate(nodes) }
+        self._offsets = offsets
+        self._deps = deps
+        self._topo = None
+        self._closures = None
+        self._rev_offsets = None
+        self._rev_deps = None
+
+    @classmethod
+    def build(cls, roots, get_deps):
+        """
+        Discover the graph reachable from `roots`. `get_deps(node)`
+        is called exactly once per node and returns its direct
+        dependencies.
+        """
+
+        nodes = []
+        index = {}
+        for root in roots:
+            if root not in index:
+                index[root] = len(nodes)
+                nodes.append(root)
+
+        offsets = array('l', [0])
+        deps = array('l')
+
+        i = 0
+        while i < len(nodes):
+            for dep in get_deps(nodes[i]):
+                j = index.get(dep)
+                if j is None:
+                    j = index[dep] = len(nodes)
+                    nodes.append(dep)
+                deps.append(j)
+
+            offsets.append(len(deps))
+            i += 1
+
+        return cls(nodes, offsets, deps)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def direct_deps(self, i):
+        return self._deps[self._offsets[i]:self._offsets[i+1]]
+
+    def direct_rdeps(self, i):
+        self._build_reverse()
+        return self._rev_deps[self._rev_offsets[i]:self._rev_offsets[i+1]]
+
+    def _build_reverse(self):
+        if self._rev_offsets is not None:
+            return
+
+        n = len(self.nodes)
+        counts = array('l', [0]) * (n + 1)
+        for w in self._deps:
+            counts[w + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+
+        fill = array('l', counts)
+        rev = array('l', [0]) * len(self._deps)
+        offsets = self._offsets
+        for v in range(n):
+            for pos in range(offsets[v], offsets[v+1]):
+                w = self._deps[pos]
+                rev[fill[w]] = v
+                fill[w] += 1
+
+        self._rev_offsets = counts
+        self._rev_deps = rev
+
+    def reachable(self, bits, reverse=False, depth=None):
+        """
+        Return the bitset of nodes reachable from the nodes in `bits`
+        (which are included) following dependency edges, or reverse
+        edges if `reverse` is set, in at most `depth` steps.
+        """
+
+        if not reverse and depth is None:
+            r = bits
+            for i in iter_bits(bits):
+                r |= self.closure(i)
+            return r
+
+        if reverse:
+            self._build_reverse()
+            offsets, edges = self._rev_offsets, self._rev_deps
+        else:
+            offsets, edges = self._offsets, self._deps
+
+        seen = bits
+        frontier = list(iter_bits(bits))
+        level = 0
+        while frontier and (depth is None or level < depth):
+            level += 1
+            next_frontier = []
+            for v in frontier:
+                for pos in range(offsets[v], offsets[v+1]):
+                    w = edges[pos]
+                    if not (seen >> w) & 1:
+                        seen |= 1 << w
+                        next_frontier.append(w)
+            frontier = next_frontier
+        return seen
+
+    def path(self, src_bits, dst_bits):
+        """
+        Return a shortest path (as a list of indexes) from some node
+        in `src_bits` to some node in `dst_bits`, or `None`.
+        """
+
+        parent = {}
+        frontier = list(iter_bits(src_bits))
+        for v in frontier:
+            parent[v] = None
+
+        while frontier:
+            next_frontier = []
+            for v in frontier:
+                if (dst_bits >> v) & 1:
+                    r = []
+                    while v is not None:
+                        r.append(v)
+                        v = parent[v]
+                    r.reverse()
+                    return r
+
+                for w in self.direct_deps(v):
+                    if w not in parent:
+                        parent[w] = v
+                        next_frontier.append(w)
+            frontier = next_frontier
+
+        return None
+
+    def topo_order(self):
+        """
+        Return node indexes ordered so that every node comes after all
+        of its dependencies. Raises `RuntimeError` on cycles.
+        """
+
+        if self._topo is not None:
+            return self._topo
+
+        n = len(self.nodes)
+        offsets = self._offsets
+        deps = self._deps
+
+        # 0 = unvisited, 1 = on the stack, 2 = done
+        state = bytearray(n)
+        order = array('l')
+
+        for root in range(n):
+            if state[root]:
+                continue
+
+            state[root] = 1
+            stack = [(root, offsets[root])]
+            while stack:
+                v, pos = stack[-1]
+                if pos == offsets[v+1]:
+                    stack.pop()
+                    state[v] = 2
+                    order.append(v)
+                    continue
+
+                stack[-1] = (v, pos + 1)
+                w = deps[pos]
+                if state[w] == 1:
+                    raise RuntimeError('dependency cycle through {}'.format(self.nodes[w]))
+                if state[w] == 0:
+                    state[w] = 1
+                    stack.append((w, offsets[w]))
+
+        self._topo = order
+        return order
+
+    def closure(self, i):
+        """
+        Return the bitset of nodes transitively reachable from node `i`,
+        not including `i` itself unless it is on a cycle.
+        """
+
+        closures = self._closures
+        if closures is None:
+            closures = self._closures = [None] * len(self.nodes)
+
+        r = closures[i]
+        if r is not None:
+            return r
+
+        offsets = self._offsets
+        deps = self._deps
+
+        # The topological order guarantees that the closures of
+        # all dependencies are available when a node is reached.
+        for v in self.topo_order():
+            if closures[v] is not None:
+                continue
+
+            bits = 0
+            for pos in range(offsets[v], offsets[v+1]):
+                w = deps[pos]
+                bits |= closures[w] | (1 << w)
+            closures[v] = bits
+
+        return closures[i]
+
+    def closure_nodes(self, i):
+        return [self.nodes[j] for j in iter_bits(self.closure(i))]
+
+    def transitive(self, roots):
+        """
+        Return the bitset of `roots` (indexes) and everything
+        reachable from them.
+        """
+
+        bits = 0
+        for i in roots:
+            bits |= self.closure(i) | (1 << i)
+        return bits
+
+def iter_bits(bits):
+    """
+    Yield the indexes of the bits set in `bits`, lowest first.
+    """
+
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
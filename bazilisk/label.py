@@ -1,4 +1,64 @@
+import functools
 import re
+import threading
+import weakref
+
+class Label:
+    '''
+    A parsed label, unpacks to `(repo, package, target)`.
+
+    Labels are interned: equal labels are the same object, so they
+    compare and hash by identity. Use `make_label` or `parse_label`
+    to create them. The main repository, named `''`, is stored as
+    `None`, the same as a label without a repository.
+    '''
+
+    __slots__ = ('repo', 'package', 'target', '_abslabel', '__weakref__')
+
+    def __iter__(self):
+        return iter((self.repo, self.package, self.target))
+
+    def __repr__(self):
+        return 'Label({!r}, {!r}, {!r})'.format(self.repo, self.package, self.target)
+
+    @property
+    def abslabel(self):
+        r = self._abslabel
+        if r is None:
+            r = self._abslabel = abslabel(self.repo, self.package, self.target)
+        return r
+
+    def __str__(self):
+        return self.abslabel
+
+_interned = weakref.WeakValueDictionary()
+_intern_lock = threading.Lock()
+
+def make_label(repo, package, target):
+    '''
+    >>> make_label(None, 'pkg', 'target') is make_label(None, 'pkg', 'target')
+    True
+
+    >>> make_label('', 'pkg', 'target') is make_label(None, 'pkg', 'target')
+    True
+    '''
+
+    if repo == '':
+        repo = None
+
+    key = (repo, package, target)
+    r = _interned.get(key)
+    if r is None:
+        with _intern_lock:
+            r = _interned.get(key)
+            if r is None:
+                r = Label.__new__(Label)
+                r.repo = repo
+                r.package = package
+                r.target = target
+                r._abslabel = None
+                _interned[key] = r
+    return r
 
 def parse_label(label, cur_repo=None, cur_pkg=None):
     '''
@@ -6,27 +66,37 @@ def parse_label(label, cur_repo=None, cur_pkg=None):
     represented by `None`, empty components by an empty string.
 
     >>> parse_label('target')
-    (None, None, 'target')
+    Label(None, None, 'target')
 
     >>> parse_label(':target')
-    (None, None, 'target')
+    Label(None, None, 'target')
 
     >>> parse_label(':.')
-    (None, None, '.')
+    Label(None, None, '.')
 
     >>> parse_label('//:target')
-    (None, '', 'target')
+    Label(None, '', 'target')
 
     >>> parse_label('//pkg:target')
-    (None, 'pkg', 'target')
+    Label(None, 'pkg', 'target')
 
     >>> parse_label('@repo//:target')
-    ('repo', '', 'target')
+    Label('repo', '', 'target')
 
     >>> parse_label('//pkg')
-    (None, 'pkg', 'pkg')
+    Label(None, 'pkg', 'pkg')
+
+    >>> parse_label('//pkg') is parse_label('//pkg:pkg')
+    True
+
+    >>> parse_label('//pkg:target', '', '') is parse_label('//pkg:target')
+    True
     '''
 
+    return _parse_label(label, cur_repo, cur_pkg)
+
+@functools.lru_cache(maxsize=1 << 16)
+def _parse_label(label, cur_repo, cur_pkg):
     m = _label_re.match(label)
     if not m:
         raise RuntimeError('invalid label syntax')
@@ -51,9 +121,11 @@ def parse_label(label, cur_repo=None, cur_pkg=None):
     if package is None:
         package = cur_pkg
 
-    return (repo, package, target)
+    return make_label(repo, package, target)
 
 def abslabel(repo, package, target):
+    if package is None:
+        return ':{}'.format(target)
     if repo:
         return '@{}//{}:{}'.format(repo, package, target)
     else:
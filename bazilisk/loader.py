@@ -0,0 +1,90 @@
+from .label import parse_label
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+_prefetch_attrs = ('deps', 'srcs', 'hdrs')
+
+class Prefetcher:
+    """
+    Reads and parses BUILD files on a thread pool ahead of time.
+
+    Whenever a rule is added to a package, the packages named by its
+    `deps`, `srcs` and `hdrs` labels are scheduled for loading. The
+    evaluation itself still happens on the main thread, when the package
+    is first requested; by then the file-system round trips are usually
+    done.
+    """
+
+    def __init__(self, ws, jobs):
+        self._ws = ws
+        self._jobs = jobs
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def close(self):
+        """
+        Stop the worker threads, dropping whatever wasn't taken. The
+        threads are started again when something is scheduled.
+        """
+
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._pending.clear()
+
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+
+    def rule_added(self, pkg, pre_attrs):
+        for k in _prefetch_attrs:
+            item = pre_attrs.get(k)
+            if item is None:
+                continue
+
+            _, value = item
+            for label in _iter_label_strings(value):
+                try:
+                    repo_name, pkg_name, _ = parse_label(label)
+                except RuntimeError:
+                    continue
+
+                if pkg_name is None:
+                    continue
+
+                repo = pkg._repo if repo_name is None else self._ws.get_repo(repo_name)
+                if repo is not None:
+                    self.schedule(repo, pkg_name)
+
+    def schedule(self, repo, pkg_name):
+        key = (repo, pkg_name)
+        with self._lock:
+            if key in self._pending or pkg_name in repo._packages:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._jobs)
+            self._pending[key] = self._executor.submit(repo.read_build_file, pkg_name)
+
+    def take(self, repo, pkg_name):
+        """
+        Return the future for a scheduled package, or `None`.
+        """
+
+        with self._lock:
+            return self._pending.pop((repo, pkg_name), None)
+
+def _iter_label_strings(value):
+    # Walks the values as they are before resolution: plain tuples
+    # and the operands of lazy values (e.g. all branches of a `select`).
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            yield value
+        elif isinstance(value, tuple):
+            stack.extend(value)
+        elif hasattr(value, 'operands'):
+            stack.extend(value.operands())
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os, os.path
+import tempfile
+
+_version = 1
+
+def file_digest(path):
+    h = hashlib.sha256()
+    if os.path.isdir(path):
+        # Directories are inputs of globs; what matters is their listing.
+        for name in sorted(os.listdir(path)):
+            h.update(name.encode('utf-8', 'surrogateescape') + b'\0')
+        return h.hexdigest()
+
+    with open(path, 'rb') as fin:
+        while True:
+            chunk = fin.read(1 << 16)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+_umask = None
+
+def file_mode(path):
+    """
+    Return the permissions for a file that replaces `path`: those of
+    the existing file or, for a new one, what `open` would create.
+    Files made by `tempfile.mkstemp` are only readable by their owner.
+    """
+
+    global _umask
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except OSError:
+        pass
+
+    if _umask is None:
+        # The umask can only be read by setting it.
+        _umask = os.umask(0o022)
+        os.umask(_umask)
+    return 0o666 & ~_umask
+
+class Manifest:
+    """
+    Records what each generated project was derived from.
+
+    For every project, the manifest keeps the BUILD and .bzl files
+    that were read to produce it, the labels of its dependencies and
+    the name and GUID it was given. Files read while loading WORKSPACE
+    are kept separately, as they affect every project. `outputs` records
+    the generated files, see `output.OutputDir`.
+
+    Every input file is stored with its mtime, size and sha256; a file
+    counts as changed only if its stat differs and its contents hash
+    differently.
+    """
+
+    def __init__(self, config, targets):
+        self.config = dict(config)
+        self.targets = sorted(targets)
+        self.inputs = {}
+        self.workspace_inputs = []
+        self.projects = {}
+        self.outputs = {}
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, 'r') as fin:
+                data = json.load(fin)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if data.get('version') != _version:
+            return None
+
+        r = cls(data['config'], data['targets'])
+        r.inputs = { k: tuple(v) for k, v in data['inputs'].items() }
+        r.workspace_inputs = data['workspace_inputs']
+        r.projects = data['projects']
+        r.outputs = { k: tuple(v) for k, v in data.get('outputs', {}).items() }
+        return r
+
+    def save(self, path):
+        data = {
+            'version': _version,
+            'config': self.config,
+            'targets': self.targets,
+            'inputs': self.inputs,
+            'workspace_inputs': self.workspace_inputs,
+            'projects': self.projects,
+            'outputs': self.outputs,
+            }
+
+        dir = os.path.dirname(path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=dir, prefix='.tmp')
+        with os.fdopen(fd, 'w') as fout:
+            json.dump(data, fout, sort_keys=True)
+        os.chmod(tmp_path, file_mode(path))
+        os.replace(tmp_path, path)
+
+    def matches(self, config, targets):
+        return self.config == config and self.targets == sorted(targets)
+
+    def changed_inputs(self):
+        """
+        Return the set of recorded input files that changed or vanished.
+        Files whose stat changed but whose contents didn't get their
+        stat refreshed, so that the next check is cheap again.
+        """
+
+        changed = set()
+        for path, (mtime, size, digest) in self.inputs.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                changed.add(path)
+                continue
+
+            if st.st_mtime_ns == mtime and st.st_size == size:
+                continue
+
+            if file_digest(path) != digest:
+                changed.add(path)
+            else:
+                self.inputs[path] = (st.st_mtime_ns, st.st_size, digest)
+
+        return changed
+
+    def record_input(self, path, old=None):
+        if old is not None and path in old.inputs:
+            self.inputs[path] = old.inputs[path]
+            return
+
+        st = os.stat(path)
+        self.inputs[path] = (st.st_mtime_ns, st.st_size, file_digest(path))
+
+    def add_project(self, label, name, fname, guid, deps, inputs, old=None):
+        self.projects[label] = {
+            'name': name,
+            'fname': fname,
+            'guid': guid,
+            'deps': list(deps),
+            'inputs': sorted(inputs),
+            }
+
+        for path in inputs:
+            if path not in self.inputs:
+                self.record_input(path, old)
@@ -1,171 +1,359 @@
-from collections import OrderedDict
-import six
-import xml.dom.minidom
+from . import output
+from concurrent.futures import ProcessPoolExecutor
+import io
 
 _platforms = 'Win32', 'x64'
 _configs = 'Debug', 'Release'
 
-def _make_item(doc, name, include, *meta):
-    item = doc.createElement(name)
-    if include is not None:
-        item.setAttribute('Include', include)
-
-    for k, v in meta:
-        m = doc.createElement(k)
-        m.appendChild(doc.createTextNode(v))
-        item.appendChild(m)
-
-    return item
-
-def _make_property_group(doc, attrs, *props):
-    gr = doc.createElement('PropertyGroup')
-
-    for k, v in attrs:
-        gr.setAttribute(k, v)
-
-    for k, v in props:
-        prop = doc.createElement(k)
-        prop.appendChild(doc.createTextNode(v))
-        gr.appendChild(prop)
-    return gr
-
-def _make_elem(doc, tag, *attrs):
-    e = doc.createElement(tag)
-    for k, v in attrs:
-        e.setAttribute(k, v)
-    return e
+# The names of the project configurations, e.g. `Debug|x64`.
+configurations = tuple('{}|{}'.format(conf, plat) for plat in _platforms for conf in _configs)
+
+def _condition(name):
+    return "'$(Configuration)|$(Platform)'=='{}'".format(name)
+
+def _escape(data):
+    return data.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;')
+
+class _XmlWriter:
+    """
+    Writes an XML document straight to a binary file, element by
+    element. The output is byte-for-byte what `xml.dom.minidom`'s
+    `toprettyxml(indent='  ', encoding='utf-8')` produces for the same
+    tree, but no tree is ever built.
+    """
+
+    def __init__(self, fout):
+        self._write = fout.write
+        self._stack = []
+        self._write(b'<?xml version="1.0" encoding="utf-8"?>\n')
+
+    def _open_tag(self, tag, attrs):
+        parts = ['  ' * len(self._stack), '<', tag]
+        for k, v in attrs:
+            parts.append(' {}="{}"'.format(k, _escape(v)))
+        return parts
+
+    def start(self, tag, *attrs):
+        parts = self._open_tag(tag, attrs)
+        parts.append('>\n')
+        self._write(''.join(parts).encode('utf-8'))
+        self._stack.append(tag)
+
+    def end(self):
+        tag = self._stack.pop()
+        self._write('{}</{}>\n'.format('  ' * len(self._stack), tag).encode('utf-8'))
+
+    def elem(self, tag, *attrs):
+        parts = self._open_tag(tag, attrs)
+        parts.append('/>\n')
+        self._write(''.join(parts).encode('utf-8'))
+
+    def text_elem(self, tag, text):
+        self._write('{}<{}>{}</{}>\n'.format('  ' * len(self._stack), tag, _escape(text), tag).encode('utf-8'))
+
+    def item(self, name, include, *meta, condition=None):
+        if include is not None and not meta and condition is None:
+            # The common case, one per source file.
+            self._write('{}<{} Include="{}"/>\n'.format('  ' * len(self._stack), name, _escape(include)).encode('utf-8'))
+            return
+
+        attrs = () if include is None else (('Include', include),)
+        if condition is not None:
+            attrs += (('Condition', condition),)
+        if not meta:
+            self.elem(name, *attrs)
+            return
+
+        self.start(name, *attrs)
+        for k, v in meta:
+            self.text_elem(k, v)
+        self.end()
+
+    def property_group(self, attrs, *props):
+        if not props:
+            self.elem('PropertyGroup', *attrs)
+            return
+
+        self.start('PropertyGroup', *attrs)
+        for k, v in props:
+            self.text_elem(k, v)
+        self.end()
 
 def make_vcxproj(tgt, proj_map):
-    fname_root, guid = proj_map[tgt]
-
-    impl = xml.dom.minidom.getDOMImplementation()
-    doc = impl.createDocument('http://schemas.microsoft.com/developer/msbuild/2003', 'Project', None)
-
-    root = doc.documentElement
-    root.setAttribute('DefaultTargets', 'Build')
-    root.setAttribute('ToolsVersion', '14.0')
-    root.setAttribute('xmlns', root.namespaceURI)
-
-    conf_group = doc.createElement('ItemGroup')
-    root.appendChild(conf_group)
-    conf_group.setAttribute('Label', 'ProjectConfigurations')
-
+    fout = io.BytesIO()
+    write_vcxproj(fout, tgt, proj_map)
+    return fout.getvalue()
+
+_worker_dir = None
+_worker_proj_map = None
+
+def _init_worker(dir, proj_map):
+    global _worker_dir, _worker_proj_map
+    _worker_dir = dir
+    _worker_proj_map = proj_map
+
+def _write_vcxproj_chunk(tgts, dir=None, proj_map=None):
+    if dir is None:
+        dir, proj_map = _worker_dir, _worker_proj_map
+
+    temps = []
+    try:
+        for tgt in tgts:
+            temps.append(output.write_temp(dir, lambda fout: write_vcxproj(fout, tgt, proj_map)))
+    except BaseException:
+        for temp in temps:
+            output.discard(temp)
+        raise
+    return temps
+
+def write_vcxprojs(dir, tgts, proj_map, jobs=None, chunk_size=32):
+    """
+    Render the projects of `tgts` into temporary files in `dir`,
+    returning the list of temporaries (see `output.write_temp`). Unless
+    there are only a few projects, they are rendered on a process pool;
+    `proj_map` is sent to each worker only once. Each worker streams
+    its projects to disk, so no document is ever held in memory.
+    """
+
+    if jobs == 1 or len(tgts) < 2 * chunk_size:
+        return _write_vcxproj_chunk(tgts, dir, proj_map)
+
+    chunks = [tgts[i:i+chunk_size] for i in range(0, len(tgts), chunk_size)]
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(dir, proj_map)) as executor:
+        futures = [executor.submit(_write_vcxproj_chunk, chunk) for chunk in chunks]
+
+    temps = []
+    error = None
+    for future in futures:
+        try:
+            temps.extend(future.result())
+        except BaseException as e:
+            if error is None:
+                error = e
+
+    if error is not None:
+        for temp in temps:
+            output.discard(temp)
+        raise error
+    return temps
+
+def _defines(configs, conf, plat):
+    settings = configs.get('{}|{}'.format(conf, plat))
+    if settings is None:
+        return ''
+    return ''.join(define + ';' for define in settings.defines)
+
+def _item_conditions(configs, item, attr):
+    """
+    Return `None` if `item` is in `attr` of every configuration,
+    or the list of conditions of the configurations it is in.
+    """
+
+    if not configs:
+        return None
+
+    present = [name for name, settings in configs.items() if item in getattr(settings, attr)]
+    if len(present) == len(configs):
+        return None
+    return [_condition(name) for name in present]
+
+def write_vcxproj(fout, tgt, proj_map):
+    """
+    `tgt.srcs` and `tgt.deps` list the sources and dependencies of
+    the project in any configuration. If `tgt.configs` is set, it maps
+    configuration names to the settings (`srcs`, `deps` and `defines`)
+    of the configuration; items that only some configurations have
+    are emitted with conditions.
+    """
+
+    fname_root, guid = proj_map[tgt.label]
+    configs = getattr(tgt, 'configs', None) or {}
+
+    w = _XmlWriter(fout)
+    w.start('Project',
+        ('DefaultTargets', 'Build'),
+        ('ToolsVersion', '14.0'),
+        ('xmlns', 'http://schemas.microsoft.com/developer/msbuild/2003'),
+        )
+
+    w.start('ItemGroup', ('Label', 'ProjectConfigurations'))
     for plat in _platforms:
         for conf in _configs:
-                conf_group.appendChild(_make_item(doc, 'ProjectConfiguration', '{}|{}'.format(conf, plat),
+            w.item('ProjectConfiguration', '{}|{}'.format(conf, plat),
                 ('Configuration', conf),
                 ('Platform', plat),
-                ))
+                )
+    w.end()
 
-    root.appendChild(_make_property_group(doc, [('Label', 'Globals')],
+    w.property_group([('Label', 'Globals')],
         ('ProjectGuid', '{{{}}}'.format(guid)),
         ('WindowsTargetPlaform', '8.1'),
-        ))
+        )
 
-    root.appendChild(_make_elem(doc, 'Import', ('Project', '$(VCTargetsPath)\Microsoft.Cpp.Default.props')))
+    w.elem('Import', ('Project', '$(VCTargetsPath)\\Microsoft.Cpp.Default.props'))
 
     for plat in _platforms:
         for conf in _configs:
-            root.appendChild(_make_property_group(doc, [('Condition', "'$(Configuration)|$(Platform)'=='{}|{}'".format(conf, plat)), ('Label', 'Configuration')],
+            w.property_group([('Condition', "'$(Configuration)|$(Platform)'=='{}|{}'".format(conf, plat)), ('Label', 'Configuration')],
                 ('ConfigurationType', 'Application'),
                 ('UseDefaultLibraries', 'true' if conf == 'Debug' else 'false'),
                 ('PlatformToolset', 'v140'),
                 ('CharacterSet', 'Unicode'),
-                ))
+                )
 
-    root.appendChild(_make_elem(doc, 'Import', ('Project', '$(VCTargetsPath)\Microsoft.Cpp.props')))
+    w.elem('Import', ('Project', '$(VCTargetsPath)\\Microsoft.Cpp.props'))
 
-    root.appendChild(_make_elem(doc, 'ImportGroup', ('Label', 'ExtensionSettings')))
-    root.appendChild(_make_elem(doc, 'ImportGroup', ('Label', 'Shared')))
+    w.elem('ImportGroup', ('Label', 'ExtensionSettings'))
+    w.elem('ImportGroup', ('Label', 'Shared'))
 
     for plat in _platforms:
         for conf in _configs:
-            e = _make_elem(doc, 'ImportGroup', ('Label', 'PropertySheets'))
-            e.appendChild(_make_elem(doc, 'Import',
-                ('Project', '$(UserRootDir)\Microsoft.Cpp.$(Platform).user.props'),
-                ('Condition', "exists('$(UserRootDir)\Microsoft.Cpp.$(Platform).user.props')"),
+            w.start('ImportGroup', ('Label', 'PropertySheets'))
+            w.elem('Import',
+                ('Project', '$(UserRootDir)\\Microsoft.Cpp.$(Platform).user.props'),
+                ('Condition', "exists('$(UserRootDir)\\Microsoft.Cpp.$(Platform).user.props')"),
                 ('Label', 'LocalAppDataPlatform'),
-                ))
-
-            root.appendChild(e)
+                )
+            w.end()
 
-    root.appendChild(_make_elem(doc, 'PropertyGroup', ('Label', 'UserMacros')))
+    w.elem('PropertyGroup', ('Label', 'UserMacros'))
 
     for plat in _platforms:
         for conf in _configs:
-            root.appendChild(_make_property_group(doc, [('Condition', "'$(Configuration)|$(Platform)'=='{}|{}'".format(conf, plat))],
+            w.property_group([('Condition', "'$(Configuration)|$(Platform)'=='{}|{}'".format(conf, plat))],
                 ('LinkIncremental', 'true' if conf == 'Debug' else 'false'),
-                ))
+                )
 
     for plat in _platforms:
         conf = 'Debug'
 
-        gr = _make_elem(doc, 'ItemDefinitionGroup', ('Condition', "'$(Configuration)|$(Platform)'=='{}|{}'".format(conf, plat)))
-        gr.appendChild(_make_item(doc, 'ClCompile', None,
+        w.start('ItemDefinitionGroup', ('Condition', "'$(Configuration)|$(Platform)'=='{}|{}'".format(conf, plat)))
+        w.item('ClCompile', None,
             ('PrecompiledHeader', ''),
             ('WarningLevel', 'Level3'),
             ('Optimization', 'Disabled'),
-            ('PreprocessorDefinitions', 'WIN32;_DEBUG;_CONSOLE;%(PreprocessorDefinitions)'),
-            ))
+            ('PreprocessorDefinitions', 'WIN32;_DEBUG;_CONSOLE;{}%(PreprocessorDefinitions)'.format(_defines(configs, conf, plat))),
+            )
 
-        gr.appendChild(_make_item(doc, 'Link', None,
+        w.item('Link', None,
             ('SubSystem', 'Console'),
             ('GenerateDebugInformation', 'true'),
-            ))
+            )
 
-        root.appendChild(gr)
+        w.end()
 
     for plat in _platforms:
         conf = 'Release'
 
-        gr = _make_elem(doc, 'ItemDefinitionGroup', ('Condition', "'$(Configuration)|$(Platform)'=='{}|{}'".format(conf, plat)))
-        gr.appendChild(_make_item(doc, 'ClCompile', None,
+        w.start('ItemDefinitionGroup', ('Condition', "'$(Configuration)|$(Platform)'=='{}|{}'".format(conf, plat)))
+        w.item('ClCompile', None,
             ('WarningLevel', 'Level3'),
             ('PrecompiledHeader', ''),
             ('Optimization', 'MaxSpeed'),
             ('FunctionLevelLinking', 'true'),
             ('IntrinsicFunctions', 'true'),
-            ('PreprocessorDefinitions', 'WIN32;NDEBUG;_CONSOLE;%(PreprocessorDefinitions)'),
-            ))
+            ('PreprocessorDefinitions', 'WIN32;NDEBUG;_CONSOLE;{}%(PreprocessorDefinitions)'.format(_defines(configs, conf, plat))),
+            )
 
-        gr.appendChild(_make_item(doc, 'Link', None,
+        w.item('Link', None,
             ('SubSystem', 'Console'),
             ('EnableCOMDATFolding', 'true'),
             ('OptimizeReferences', 'true'),
             ('GenerateDebugInformation', 'true'),
-            ))
-
-        root.appendChild(gr)
-
-    gr = _make_elem(doc, 'ItemGroup')
-    root.appendChild(gr)
-    for src in tgt.srcs:
-        base = src.rsplit('.', 1)
-        if len(base) == 2:
-            base, ext = base
-        else:
-            base, ext = base[0], ''
-        
-        if ext in ('c', 'cc', 'cxx', 'cpp'):
-            type = 'ClCompile'
-        elif ext in ('h', 'hh', 'hpp', 'hxx'):
-            type = 'ClInclude'
-        else:
-            type = None
-
-        gr.appendChild(_make_item(doc, type, src))
-
-    gr = _make_elem(doc, 'ItemGroup')
-    root.appendChild(gr)
-
-    for dep in tgt.deps:
-        fname, guid = proj_map[dep]
-        root.appendChild(_make_item(doc, 'ProjectReference', fname,
-            ('Project', guid),
-            ))
-
-    root.appendChild(_make_elem(doc, 'Import', ('Project', '$(VCTargetsPath)\Microsoft.Cpp.targets')))
-    root.appendChild(_make_elem(doc, 'ImportGroup', ('Label', 'ExtensionTargets')))
-
-    s = doc.toprettyxml(indent='  ', encoding='utf-8')
-    return s
+            )
+
+        w.end()
+
+    if tgt.srcs:
+        w.start('ItemGroup')
+        for src in tgt.srcs:
+            base = src.rsplit('.', 1)
+            if len(base) == 2:
+                base, ext = base
+            else:
+                base, ext = base[0], ''
+
+            if ext in ('c', 'cc', 'cxx', 'cpp'):
+                type = 'ClCompile'
+            elif ext in ('h', 'hh', 'hpp', 'hxx'):
+                type = 'ClInclude'
+            else:
+                type = 'None'
+
+            conditions = _item_conditions(configs, src, 'srcs')
+            if conditions is None:
+                w.item(type, src)
+            else:
+                for condition in conditions:
+                    w.item(type, src, condition=condition)
+        w.end()
+    else:
+        w.elem('ItemGroup')
+
+    if tgt.deps:
+        w.start('ItemGroup')
+        for dep in tgt.deps:
+            fname, guid = proj_map[dep]
+            for condition in _item_conditions(configs, dep, 'deps') or (None,):
+                w.item('ProjectReference', fname,
+                    ('Project', '{{{}}}'.format(guid)),
+                    condition=condition,
+                    )
+        w.end()
+    else:
+        w.elem('ItemGroup')
+
+    w.elem('Import', ('Project', '$(VCTargetsPath)\\Microsoft.Cpp.targets'))
+    w.elem('ImportGroup', ('Label', 'ExtensionTargets'))
+
+    w.end()
+
+# The project type GUID of Visual C++ projects.
+_vcxproj_type_guid = '8BC9CEB8-8B4A-11D0-8D11-00A0C91BC942'
+
+_sln_platforms = (('Win32', 'x86'), ('x64', 'x64'))
+
+def make_sln(projects):
+    fout = io.BytesIO()
+    write_sln(fout, projects)
+    return fout.getvalue()
+
+def write_sln(fout, projects):
+    """
+    Write a solution containing `projects`, a list of
+    `(name, fname, guid)` tuples, with all project configurations.
+    """
+
+    lines = [
+        '',
+        'Microsoft Visual Studio Solution File, Format Version 12.00',
+        '# Visual Studio 14',
+        'VisualStudioVersion = 14.0.25420.1',
+        'MinimumVisualStudioVersion = 10.0.40219.1',
+        ]
+
+    for name, fname, guid in projects:
+        lines.append('Project("{{{}}}") = "{}", "{}", "{{{}}}"'.format(_vcxproj_type_guid, name, fname, guid))
+        lines.append('EndProject')
+
+    lines.append('Global')
+    lines.append('\tGlobalSection(SolutionConfigurationPlatforms) = preSolution')
+    for conf in _configs:
+        for _, sln_plat in _sln_platforms:
+            lines.append('\t\t{0}|{1} = {0}|{1}'.format(conf, sln_plat))
+    lines.append('\tEndGlobalSection')
+
+    lines.append('\tGlobalSection(ProjectConfigurationPlatforms) = postSolution')
+    for _, _, guid in projects:
+        for conf in _configs:
+            for proj_plat, sln_plat in _sln_platforms:
+                lines.append('\t\t{{{}}}.{}|{}.ActiveCfg = {}|{}'.format(guid, conf, sln_plat, conf, proj_plat))
+                lines.append('\t\t{{{}}}.{}|{}.Build.0 = {}|{}'.format(guid, conf, sln_plat, conf, proj_plat))
+    lines.append('\tEndGlobalSection')
+
+    lines.append('\tGlobalSection(SolutionProperties) = preSolution')
+    lines.append('\t\tHideSolutionNode = FALSE')
+    lines.append('\tEndGlobalSection')
+    lines.append('EndGlobal')
+
+    fout.write(b'\xef\xbb\xbf' + '\r\n'.join(lines).encode('utf-8') + b'\r\n')
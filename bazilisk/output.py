@@ -0,0 +1,114 @@
+import hashlib
+import os, os.path
+import tempfile
+
+from .manifest import file_digest, file_mode
+
+class _HashingWriter:
+    def __init__(self, fout):
+        self._fout = fout
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._fout.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+def write_temp(dir, render):
+    """
+    Call `render` with a binary file to write to, streaming the output
+    into a new temporary file in `dir`. Returns the `(path, size, sha256)`
+    of the temporary file, to be handed to `OutputDir.commit` (or
+    `discard`). May be called from any process.
+    """
+
+    fd, tmp_path = tempfile.mkstemp(dir=dir, prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fout:
+            w = _HashingWriter(fout)
+            render(w)
+    except BaseException:
+        discard((tmp_path, None, None))
+        raise
+    return tmp_path, w.size, w.hexdigest()
+
+def discard(temp):
+    """
+    Remove a temporary file made by `write_temp`.
+    """
+
+    try:
+        os.remove(temp[0])
+    except OSError:
+        pass
+
+class OutputDir:
+    """
+    Writes generated files, leaving unchanged ones alone.
+
+    `records` maps file names to the `(mtime_ns, size, sha256)` of what
+    was written last time (e.g. from the manifest) and is kept up to date.
+    New contents are streamed into a temporary file. A file whose record
+    matches both its stat and the new contents' hash is left without
+    being read; otherwise the existing file is hashed and only replaced,
+    atomically, if it differs. Untouched files keep their timestamps,
+    so IDEs don't reload them; replaced ones keep their permissions.
+    """
+
+    def __init__(self, path, records=None):
+        self._path = path
+        self.records = {} if records is None else records
+        self.written = 0
+        self.unchanged = 0
+
+    def write(self, fname, data):
+        """
+        Write `data` (bytes) to `fname` unless it already holds it.
+        Returns whether the file was written.
+        """
+
+        return self.commit(fname, write_temp(self._path, lambda fout: fout.write(data)))
+
+    def commit(self, fname, temp):
+        """
+        Move the temporary file `temp` (see `write_temp`) to `fname`,
+        unless `fname` already has the same contents, in which case
+        `temp` is removed. Returns whether the file was written.
+        """
+
+        tmp_path, size, digest = temp
+        path = os.path.join(self._path, fname)
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+
+        try:
+            if st is not None and st.st_size == size:
+                rec = self.records.get(fname)
+                if rec is not None and tuple(rec) == (st.st_mtime_ns, st.st_size, digest):
+                    self.unchanged += 1
+                    discard(temp)
+                    return False
+
+                if file_digest(path) == digest:
+                    self.records[fname] = (st.st_mtime_ns, st.st_size, digest)
+                    self.unchanged += 1
+                    discard(temp)
+                    return False
+
+            os.chmod(tmp_path, file_mode(path))
+            os.replace(tmp_path, path)
+        except BaseException:
+            discard(temp)
+            raise
+
+        st = os.stat(path)
+        self.records[fname] = (st.st_mtime_ns, st.st_size, digest)
+        self.written += 1
+        return True
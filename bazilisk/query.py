@@ -0,0 +1,246 @@
+"""
+A subset of the Bazel query language over the resolved target graph.
+
+Supported expressions:
+
+    //pkg:target               a single target
+    deps(X)                    X and everything it depends on
+    deps(X, depth)             ... at most `depth` edges away
+    rdeps(U, X)                everything in deps(U) that depends on X
+    rdeps(U, X, depth)
+    somepath(A, B)             a path from some target in A to some in B
+    allpaths(A, B)             all targets on any path from A to B
+    A + B, A - B, A ^ B        union, difference, intersection
+
+All label-valued attributes are followed; source files are not part of
+the graph. The graph is resolved once, stored as a `TargetGraph` with
+forward and reverse indexes, and every operator works on bitsets
+over it.
+"""
+
+import re
+
+from .graph import TargetGraph
+from .label import parse_label
+from .workspace import Rule
+
+class QueryError(Exception):
+    pass
+
+_token_re = re.compile(r'\s*(?:([(),+^-])|([^\s(),+^]+))')
+
+def _tokenize(text):
+    r = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _token_re.match(text, pos)
+        if m is None or m.end() == pos:
+            raise QueryError('invalid character at {}: {!r}'.format(pos, text[pos:]))
+        r.append(m.group(1) or m.group(2))
+        pos = m.end()
+    return r
+
+_functions = {
+    'deps': (1, 2),
+    'rdeps': (2, 3),
+    'somepath': (2, 2),
+    'allpaths': (2, 2),
+    }
+
+def parse(text):
+    """
+    Parse a query expression into nested tuples: `('label', abslabel)`,
+    `('int', n)`, `(op, lhs, rhs)` or `(function, *args)`.
+    """
+
+    tokens = _tokenize(text)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take(expected=None):
+        nonlocal pos
+        tok = peek()
+        if tok is None or (expected is not None and tok != expected):
+            raise QueryError('expected {}, found {}'.format(expected or 'an expression', tok or 'end of input'))
+        pos += 1
+        return tok
+
+    def expr():
+        lhs = primary()
+        while peek() in ('+', '-', '^'):
+            op = take()
+            lhs = (op, lhs, primary())
+        return lhs
+
+    def primary():
+        tok = take()
+        if tok == '(':
+            r = expr()
+            take(')')
+            return r
+
+        if tok in _functions and peek() == '(':
+            take('(')
+            args = [arg()]
+            while peek() == ',':
+                take(',')
+                args.append(arg())
+            take(')')
+
+            lo, hi = _functions[tok]
+            if not lo <= len(args) <= hi:
+                raise QueryError('{} takes {} to {} arguments'.format(tok, lo, hi))
+            if tok in ('deps', 'rdeps') and len(args) == hi and args[-1][0] != 'int':
+                raise QueryError('the depth of {} must be an integer'.format(tok))
+            return (tok,) + tuple(args)
+
+        if tok in '()+-^,':
+            raise QueryError('unexpected {}'.format(tok))
+        try:
+            return ('label', parse_label(tok, '', '').abslabel)
+        except RuntimeError as e:
+            raise QueryError('{}: {}'.format(tok, e)) from e
+
+    def arg():
+        tok = peek()
+        if tok is not None and tok.isdigit():
+            take()
+            return ('int', int(tok))
+        return expr()
+
+    r = expr()
+    if peek() is not None:
+        raise QueryError('unexpected {}'.format(peek()))
+    return r
+
+def _literals(e):
+    if e[0] == 'label':
+        yield e[1]
+    elif e[0] != 'int':
+        for arg in e[1:]:
+            yield from _literals(arg)
+
+def _rule_deps(value):
+    if isinstance(value, Rule):
+        yield value.label
+    elif isinstance(value, tuple):
+        for el in value:
+            yield from _rule_deps(el)
+    elif isinstance(value, dict):
+        for el in value.values():
+            yield from _rule_deps(el)
+
+class QueryEngine:
+    """
+    Answers queries against a workspace.
+
+    The graph is built from the targets named in the queries and grows
+    as new ones come up. It is dropped whenever the workspace's
+    `generation` changes, i.e. when a refresh reloaded some packages,
+    or when the workspace is switched to another configuration.
+    """
+
+    def __init__(self, ws):
+        self._ws = ws
+        self._state = None
+        self._graph = None
+
+    def graph(self, roots):
+        state = self._ws.generation, self._ws.config_key
+        g = self._graph
+        if g is not None and self._state == state:
+            if all(r in g.index for r in roots):
+                return g
+            roots = list(g.nodes) + list(roots)
+
+        # Set after the build, which fails on a bad target.
+        self._graph = TargetGraph.build(roots, self._get_deps)
+        self._state = state
+        return self._graph
+
+    def _get_deps(self, label):
+        # Errors in a BUILD or .bzl file can be of any type; they are
+        # reported along with the target that needed the package.
+        ws = self._ws
+        try:
+            tgt = ws.resolve_target(label, '', '')
+            if not isinstance(tgt, Rule):
+                if not ws._fs.exists(tgt._path):
+                    raise QueryError('no such target: {}'.format(label))
+                return ()
+
+            values = list(tgt.attrs.values())
+        except QueryError:
+            raise
+        except KeyError as e:
+            raise QueryError('{}: no such repository: {}'.format(label, e.args[0])) from e
+        except (IOError, OSError) as e:
+            raise QueryError('{}: no such package: {}'.format(label, e)) from e
+        except Exception as e:
+            raise QueryError('{}: {}: {}'.format(label, type(e).__name__, e)) from e
+
+        seen = set()
+        r = []
+        for value in values:
+            for dep in _rule_deps(value):
+                if dep not in seen:
+                    seen.add(dep)
+                    r.append(dep)
+        return r
+
+    def run(self, text):
+        """
+        Evaluate a query, returning the list of matching labels.
+        `somepath` results are in path order; everything else lists
+        dependents before their dependencies.
+        """
+
+        e = parse(text)
+        g = self.graph(list(_literals(e)))
+
+        if e[0] == 'somepath':
+            path = g.path(self._eval(g, e[1]), self._eval(g, e[2]))
+            return [g.nodes[i] for i in path or ()]
+
+        bits = self._eval(g, e)
+        return [g.nodes[i] for i in reversed(g.topo_order()) if (bits >> i) & 1]
+
+    def _eval(self, g, e):
+        kind = e[0]
+        if kind == 'label':
+            return 1 << g.index[e[1]]
+        if kind == 'int':
+            raise QueryError('unexpected integer')
+
+        if kind == '+':
+            return self._eval(g, e[1]) | self._eval(g, e[2])
+        if kind == '-':
+            return self._eval(g, e[1]) & ~self._eval(g, e[2])
+        if kind == '^':
+            return self._eval(g, e[1]) & self._eval(g, e[2])
+
+        if kind == 'deps':
+            depth = e[2][1] if len(e) > 2 else None
+            return g.reachable(self._eval(g, e[1]), depth=depth)
+
+        if kind == 'rdeps':
+            universe = g.reachable(self._eval(g, e[1]))
+            depth = e[3][1] if len(e) > 3 else None
+            return g.reachable(self._eval(g, e[2]), reverse=True, depth=depth) & universe
+
+        if kind == 'somepath':
+            path = g.path(self._eval(g, e[1]), self._eval(g, e[2]))
+            bits = 0
+            for i in path or ():
+                bits |= 1 << i
+            return bits
+
+        if kind == 'allpaths':
+            src = g.reachable(self._eval(g, e[1]))
+            dst = g.reachable(self._eval(g, e[2]), reverse=True)
+            return src & dst
+
+        raise QueryError('unknown expression: {}'.format(kind))
@@ -0,0 +1,105 @@
+import json
+import os
+import socket
+import sys
+import traceback
+
+def default_socket_path():
+    base = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(base, 'bzlsk-{}.sock'.format(os.getuid()))
+
+class WorkspaceCache:
+    """
+    Keeps loaded workspaces between requests.
+
+    Workspaces are keyed by whatever determines their contents (root
+    directory, config, evaluator options). Before a cached workspace is
+    handed out, it is refreshed so that packages whose files changed
+    are reloaded.
+    """
+
+    def __init__(self):
+        self._workspaces = {}
+
+    def get(self, key, factory):
+        ws = self._workspaces.get(key)
+        if ws is not None and not ws.refresh():
+            ws = None
+
+        if ws is None:
+            ws = factory()
+            self._workspaces[key] = ws
+        return ws
+
+class Server:
+    """
+    Serves requests from thin clients over a Unix socket.
+
+    A request is a single line of JSON, `{"command": ..., "argv": [...],
+    "cwd": ...}`, answered with `{"status": ..., "output": ...}`.
+    `handlers` maps command names to functions taking `argv` and `cwd`
+    and returning the status and output. Requests are served
+    one at a time.
+    """
+
+    def __init__(self, path, handlers):
+        self._path = path
+        self._handlers = handlers
+
+    def serve_forever(self):
+        try:
+            os.unlink(self._path)
+        except OSError:
+            pass
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(self._path)
+            sock.listen(8)
+
+            while True:
+                conn, _ = sock.accept()
+                with conn:
+                    self._serve_one(conn)
+        finally:
+            sock.close()
+            os.unlink(self._path)
+
+    def _serve_one(self, conn):
+        with conn.makefile('rwb') as f:
+            line = f.readline()
+            if not line:
+                return
+
+            try:
+                req = json.loads(line.decode('utf-8'))
+                handler = self._handlers.get(req.get('command'))
+                if handler is None:
+                    resp = { 'status': 2, 'output': 'unknown command: {}\n'.format(req.get('command')) }
+                else:
+                    status, output = handler(req['argv'], req['cwd'])
+                    resp = { 'status': status, 'output': output }
+            except Exception as e:
+                traceback.print_exc()
+                resp = { 'status': 1, 'output': 'error: {}\n'.format(e) }
+
+            f.write(json.dumps(resp).encode('utf-8') + b'\n')
+            f.flush()
+
+def request(path, command, argv):
+    """
+    Send a request to a running server, print its output and
+    return the status.
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with sock:
+        sock.connect(path)
+        with sock.makefile('rwb') as f:
+            req = { 'command': command, 'argv': argv, 'cwd': os.getcwd() }
+            f.write(json.dumps(req).encode('utf-8') + b'\n')
+            f.flush()
+            resp = json.loads(f.readline().decode('utf-8'))
+
+    sys.stdout.write(resp['output'])
+    return resp['status']
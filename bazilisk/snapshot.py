@@ -0,0 +1,287 @@
+"""
+A persistent snapshot of the loaded packages.
+
+The snapshot holds everything the packages of a workspace resolved to:
+their rules, the attribute values (those that `select` once for
+each configuration they were read in), config_settings, the files that
+were read and the links between packages. It is stored with `marshal`
+and loaded through `mmap`, so that restoring a workspace doesn't
+evaluate a single BUILD or .bzl file.
+
+The snapshot is only used if the files read by WORKSPACE didn't change,
+i.e. if the repositories are the same. Packages whose inputs changed,
+along with the packages that refer to them, are not restored and are
+loaded as usual. A restored package is evaluated after all if something
+the snapshot lacks is requested, e.g. an attribute in a configuration
+that wasn't used before.
+"""
+
+import hashlib
+import marshal
+import mmap
+import os, os.path
+import tempfile
+
+from . import trace
+from .workspace import Package, Rule, File
+
+_version = 1
+
+def snapshot_name(ws, evaluator, lazy_rules):
+    """
+    Return the file name of the snapshot of `ws`. Workspaces opened
+    with different settings don't share snapshots.
+    """
+
+    key = '{}\0{}\0{}\0{}'.format(_version, ws._fs.native_path(ws._root_dir), evaluator, bool(lazy_rules))
+    return hashlib.sha256(key.encode('utf-8', 'surrogateescape')).hexdigest() + '.bin'
+
+def _stats(ws, native_paths):
+    fs = ws._fs
+    return { native_path: ws._stat_key(fs.make_path(native_path)) for native_path in native_paths }
+
+def _fingerprint(stats):
+    h = hashlib.sha256()
+    for native_path, key in sorted(stats.items(), key=lambda item: item[0]):
+        h.update('{}\0{}\0'.format(native_path, key).encode('utf-8', 'surrogateescape'))
+    return h.hexdigest()
+
+def _encode(value, fs):
+    if isinstance(value, Rule):
+        return ['r', value.package._repo.name, value.package.name, value.name]
+    if isinstance(value, File):
+        return ['f', fs.native_path(value._path)]
+    if isinstance(value, tuple):
+        return tuple(_encode(el, fs) for el in value)
+    if isinstance(value, dict):
+        return { _encode(k, fs): _encode(v, fs) for k, v in value.items() }
+    return value
+
+def _decode(value, pkg):
+    if isinstance(value, list):
+        if value[0] == 'r':
+            _, repo_name, pkg_name, name = value
+            return pkg.get_package(pkg_name, repo_name).get_target(name)
+        return File(pkg._repo._ws._fs.make_path(value[1]))
+    if isinstance(value, tuple):
+        return tuple(_decode(el, pkg) for el in value)
+    if isinstance(value, dict):
+        return { _decode(k, pkg): _decode(v, pkg) for k, v in value.items() }
+    return value
+
+class _RuleSnapshot:
+    """
+    The attributes of a restored rule, decoded on first access.
+    Configurations that `select` the same value share the decoded one,
+    as they would share the static attributes.
+    """
+
+    def __init__(self, rule, names, static, configs):
+        self._rule = rule
+        self.names = names
+        self._static = static
+        self._configs = configs
+        self._decoded = {}
+
+    def get(self, k, config_key):
+        """
+        Return the value of attribute `k` in the configuration
+        `config_key`. Raises `KeyError` if the snapshot doesn't have it.
+        """
+
+        rule = self._rule
+        try:
+            return rule._static_attrs[k]
+        except KeyError:
+            pass
+
+        if k in self._static:
+            r = rule._static_attrs[k] = _decode(self._static[k], rule.package)
+            return r
+
+        value = self._configs[config_key][k]
+        decoded = self._decoded.setdefault(k, [])
+        for encoded, r in decoded:
+            if encoded == value:
+                return r
+
+        r = _decode(value, rule.package)
+        decoded.append((value, r))
+        return r
+
+    def encoded(self):
+        return self._static, self._configs
+
+def _save_rule(rule, fs):
+    static = {}
+    configs = {}
+    if rule._snapshot is not None:
+        names = rule._snapshot.names
+        old_static, old_configs = rule._snapshot.encoded()
+        static.update(old_static)
+        for key, values in old_configs.items():
+            configs[key] = dict(values)
+
+    if rule._pre_attrs is not None:
+        names = tuple(rule._pre_attrs)
+
+    for k, value in rule._static_attrs.items():
+        static[k] = _encode(value, fs)
+
+    for key, attrs in rule._attrs.items():
+        values = configs.setdefault(key, {})
+        for k, value in attrs._values.items():
+            if k not in static:
+                values[k] = _encode(value, fs)
+
+    return rule.name, rule.kind, names, static, configs
+
+def save(ws, path):
+    """
+    Write the snapshot of the packages loaded in `ws` to `path`.
+    """
+
+    fs = ws._fs
+    packages = []
+    inputs = set()
+    for repo in ws._repos.values():
+        for pkg in repo._packages.values():
+            dependents = [(dep._repo.name, dep.name) for dep in pkg._dependents
+                if dep._repo._packages.get(dep.name) is dep]
+            rules = [_save_rule(rule, fs) for rule in pkg._rules.values()]
+            unrestored = tuple(pkg._unrestored | set(pkg._deferred))
+
+            packages.append((repo.name, pkg.name, tuple(pkg.inputs), dependents,
+                pkg._config_settings, rules, unrestored))
+            inputs.update(pkg.inputs)
+
+    workspace_inputs = _stats(ws, ws.inputs)
+    data = {
+        'version': _version,
+        'fingerprint': _fingerprint(workspace_inputs),
+        'inputs': _stats(ws, inputs),
+        'packages': packages,
+        }
+
+    with trace.span('save_snapshot', 'io', packages=len(packages)):
+        dir = os.path.dirname(path) or '.'
+        os.makedirs(dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dir, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fout:
+                marshal.dump(data, fout)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+def _read(path):
+    with open(path, 'rb') as fin:
+        try:
+            mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files and file systems without mmap support.
+            return marshal.load(fin)
+
+    with mm:
+        return marshal.loads(mm)
+
+def load(ws, path):
+    """
+    Restore the packages of the snapshot at `path` into `ws`, which
+    mustn't have loaded any packages yet. Returns the number
+    of restored packages.
+    """
+
+    try:
+        with trace.span('read_snapshot', 'io'):
+            data = _read(path)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return 0
+
+    if not isinstance(data, dict) or data.get('version') != _version:
+        return 0
+    if data['fingerprint'] != _fingerprint(_stats(ws, ws.inputs)):
+        return 0
+
+    with trace.span('restore_snapshot', 'load'):
+        return _restore(ws, data)
+
+def _restore(ws, data):
+    fs = ws._fs
+
+    changed = set()
+    current = {}
+    for native_path, key in data['inputs'].items():
+        path = fs.make_path(native_path)
+        cur = ws._stat_key(path)
+        if cur != (None if key is None else tuple(key)):
+            changed.add(native_path)
+        else:
+            current[native_path] = path, cur
+
+    # Packages that read a changed file are loaded again, and so are
+    # the packages that refer to them.
+    by_name = { (repo_name, pkg_name): entry for repo_name, pkg_name, *entry in data['packages'] }
+    stale = [name for name, entry in by_name.items()
+        if name[0] not in ws._repos or not changed.isdisjoint(entry[0])]
+
+    dropped = set()
+    while stale:
+        name = stale.pop()
+        if name in dropped:
+            continue
+        dropped.add(name)
+        entry = by_name.get(name)
+        if entry is not None:
+            stale.extend(tuple(dep) for dep in entry[1])
+
+    restored = {}
+    for name, (inputs, _, config_settings, rules, unrestored) in by_name.items():
+        if name in dropped:
+            continue
+
+        repo_name, pkg_name = name
+        repo = ws._repos[repo_name]
+        if pkg_name in repo._packages:
+            continue
+
+        pkg = Package(repo, pkg_name, repo._materialize() + pkg_name.split('/'))
+        pkg.restored = True
+        pkg.inputs = frozenset(inputs)
+        pkg._unrestored = frozenset(unrestored)
+
+        for setting_name, values in config_settings.items():
+            pkg.add_config_setting(setting_name, values)
+
+        for rule_name, kind, names, static, configs in rules:
+            rule = Rule(kind, None, pkg, rule_name, None)
+            rule._base_pkg = pkg
+            rule._snapshot = _RuleSnapshot(rule, names, static, configs)
+            pkg._rules[rule_name] = rule
+
+        for native_path in inputs:
+            stat = current.get(native_path)
+            if stat is not None:
+                ws._input_stats[native_path] = stat
+
+        repo._packages[pkg_name] = pkg
+        restored[name] = pkg
+
+    # Packages loaded by WORKSPACE are there already; they get
+    # their restored dependents as well.
+    for (repo_name, pkg_name), entry in by_name.items():
+        repo = ws._repos.get(repo_name)
+        pkg = repo._packages.get(pkg_name) if repo is not None else None
+        if pkg is None:
+            continue
+
+        for dep in entry[1]:
+            dep_pkg = restored.get(tuple(dep))
+            if dep_pkg is not None and dep_pkg is not pkg:
+                pkg._dependents.add(dep_pkg)
+
+    return len(restored)
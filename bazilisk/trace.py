@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+import time
+
+class Tracer:
+    """
+    Records spans as Chrome trace events.
+
+    The output of `write` can be opened in Perfetto or chrome://tracing.
+    """
+
+    def __init__(self):
+        self._events = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._t0 = time.perf_counter()
+
+    def span(self, name, cat, args):
+        return _Span(self, name, cat, args)
+
+    def _add(self, name, cat, args, start, end):
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'pid': self._pid,
+            'tid': threading.get_ident(),
+            'ts': (start - self._t0) * 1e6,
+            'dur': (end - start) * 1e6,
+            }
+        if args:
+            event['args'] = args
+
+        with self._lock:
+            self._events.append(event)
+
+    def counter(self, name, values):
+        event = {
+            'name': name,
+            'ph': 'C',
+            'pid': self._pid,
+            'tid': threading.get_ident(),
+            'ts': (time.perf_counter() - self._t0) * 1e6,
+            'args': values,
+            }
+
+        with self._lock:
+            self._events.append(event)
+
+    def write(self, fout):
+        with self._lock:
+            events = list(self._events)
+        json.dump({ 'traceEvents': events, 'displayTimeUnit': 'ms' }, fout)
+
+class _Span:
+    __slots__ = ('_tracer', '_name', '_cat', '_args', '_start')
+
+    def __init__(self, tracer, name, cat, args):
+        self._tracer = tracer
+        self._name = name
+        self._cat = cat
+        self._args = args
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._tracer._add(self._name, self._cat, self._args, self._start, time.perf_counter())
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+null_span = _NullSpan()
+_tracer = None
+
+def set_tracer(tracer):
+    global _tracer
+    _tracer = tracer
+
+def span(name, cat='', **args):
+    """
+    Return a context manager recording a span with the current
+    tracer; a no-op if there is none.
+    """
+
+    if _tracer is None:
+        return null_span
+    return _tracer.span(name, cat, args)
+
+def enabled():
+    """
+    Return whether there is a tracer. Hot paths check it so as not to
+    compute the arguments of spans that aren't recorded:
+
+        with trace.span('x', label=rule.label) if trace.enabled() else trace.null_span:
+    """
+
+    return _tracer is not None
+
+def counter(name, **values):
+    """
+    Record the current values of a set of counters, e.g. cache hits
+    and misses; a no-op if there is no tracer.
+    """
+
+    if _tracer is not None:
+        _tracer.counter(name, values)
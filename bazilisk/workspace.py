@@ -1,30 +1,118 @@
-from . import bzlfile
-from .bzlfile import builtin, make_builtins
-from .label import parse_label, abslabel
-import errno, ast
+from . import bzlfile, bzlcompile, trace
+from .bzlglob import DirIndex
+from .cache import default_cache_dir
+from .fetch import RepoCache
+from .label import parse_label, make_label
+from .loader import Prefetcher
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import collections.abc
+import contextlib
 import functools
+import itertools
+import operator
+import os
+import threading
 
 class Rule:
-    def __init__(self, implementation, name, pre_attrs):
+    def __init__(self, kind, implementation, package, name, pre_attrs):
+        self.kind = kind
         self.impl = implementation
+        self.package = package
         self.name = name
         self._pre_attrs = pre_attrs
+        self._base_pkg = None
+        self._static_attrs = {}
+        self._attrs = {}
+
+        # Set instead of `_pre_attrs` for rules restored from a snapshot,
+        # see `snapshot.load`.
+        self._snapshot = None
+
+    @property
+    def label(self):
+        return self.package.label(self.name)
 
     def resolve_attrs(self, base_pkg):
-        if not hasattr(self, '_pre_attrs'):
-            return
+        if self._base_pkg is None:
+            self._base_pkg = base_pkg
+
+    @property
+    def attrs(self):
+        """
+        The attributes in the workspace's current configuration.
+        Only attributes that `select` are resolved separately for each
+        configuration, the rest is shared.
+        """
+
+        key = self.package._repo._ws.config_key
+        r = self._attrs.get(key)
+        if r is None:
+            r = self._attrs[key] = _RuleAttrs(self)
+        return r
+
+class _RuleAttrs(collections.abc.Mapping):
+    """
+    The attributes of a rule, resolved one at a time on first access.
+
+    Resolving a label attribute loads the packages it names, so a backend
+    that only reads `srcs` and `deps` never loads the packages
+    in `data` or `visibility`.
+    """
+
+    def __init__(self, rule):
+        self._rule = rule
+        self._values = {}
+
+    def __getitem__(self, k):
+        try:
+            return self._values[k]
+        except KeyError:
+            pass
+
+        rule = self._rule
+        if rule._pre_attrs is None:
+            if k not in rule._snapshot.names:
+                raise KeyError(k)
+
+            try:
+                r = rule._snapshot.get(k, rule.package._repo._ws.config_key)
+            except KeyError:
+                # Not in the snapshot; the package must be evaluated after all.
+                rule.package.ensure_evaluated()
+            else:
+                self._values[k] = r
+                return r
+
+        spec, value = rule._pre_attrs[k]
+        if not isinstance(value, _Lazy):
+            try:
+                r = rule._static_attrs[k]
+            except KeyError:
+                with trace.span('resolve_attr', 'resolve', label=rule.label, attr=k) if trace.enabled() else trace.null_span:
+                    r = rule._static_attrs[k] = spec.parse(value, rule._base_pkg)
+        else:
+            with trace.span('resolve_attr', 'resolve', label=rule.label, attr=k) if trace.enabled() else trace.null_span:
+                r = spec.parse(value.resolve(rule._base_pkg), rule._base_pkg)
+
+        self._values[k] = r
+        return r
+
+    def _names(self):
+        rule = self._rule
+        if rule._pre_attrs is None:
+            return rule._snapshot.names
+        return rule._pre_attrs
 
-        attrs = {}
-        for k, (spec, value) in self._pre_attrs.items():
-            if isinstance(value, _Lazy):
-                value = value.resolve(base_pkg)
-            value = spec.parse(value, base_pkg)
-            attrs[k] = value
+    def __contains__(self, k):
+        return k in self._names()
 
-        self.attrs = attrs
-        del self._pre_attrs
+    def __iter__(self):
+        return iter(self._names())
 
-def _make_rule(*, implementation=None, attrs={}, outputs=()):
+    def __len__(self):
+        return len(self._names())
+
+def _make_rule(*, kind=None, implementation=None, attrs={}, outputs=()):
     attrs = dict(attrs)
 
     attrs.update({
@@ -56,9 +144,10 @@ def _make_rule(*, implementation=None, attrs={}, outputs=()):
 
             pre_attrs[k] = (attrs[k], value)
 
-        r = Rule(implementation, name, pre_attrs)
+        r = Rule(kind, implementation, pkg, name, pre_attrs)
         pkg.add_rule(r)
 
+    rule.deferrable = True
     return rule
 
 class Attr:
@@ -175,6 +264,9 @@ def _bld_licenses(pkg, license_types):
     pass
 
 class _Lazy:
+    def operands(self):
+        return ()
+
     def __add__(self, rhs):
         return _LazyBinOp(self, rhs)
 
@@ -186,52 +278,115 @@ class _LazyBinOp(_Lazy):
         self._lhs = lhs
         self._rhs = rhs
 
-    def resolve(self, pkg):
-        lhs = self._lhs
-        rhs = self._rhs
+    def operands(self):
+        return self._lhs, self._rhs
 
-        if isinstance(lhs, _Lazy):
-            lhs = lhs.resolve(pkg)
-        if isinstance(rhs, _Lazy):
-            rhs = rhs.resolve(pkg)
+    def resolve(self, pkg):
+        # Long `+` chains nest deeply; collect the operands iteratively,
+        # left to right, and concatenate them in one go.
+        values = []
+        stack = [self]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, _LazyBinOp):
+                stack.append(value._rhs)
+                stack.append(value._lhs)
+            elif isinstance(value, _Lazy):
+                values.append(value.resolve(pkg))
+            else:
+                values.append(value)
 
-        return lhs + rhs
+        if all(type(value) is tuple for value in values):
+            return tuple(itertools.chain.from_iterable(values))
+        return functools.reduce(operator.add, values)
 
-class _Select(_Lazy):
-    def __init__(self, mapping):
-        self._mapping = mapping
+class _Conditions:
+    """
+    The parsed condition labels of a `select`, shared by all selects
+    with the same keys (see `_get_conditions`).
+    """
 
-    def resolve(self, pkg):
-        matching = []
+    def __init__(self, keys):
+        labels = []
         default = None
+        relative = False
+        for i, k in enumerate(keys):
+            label = tuple(parse_label(k))
+            if label == (None, 'conditions', 'default'):
+                default = i
+                label = None
+            elif label[1] is None:
+                relative = True
+            labels.append(label)
+
+        self._labels = labels
+        self._default = default
+        self._relative = relative
+
+    def match(self, pkg):
+        """
+        Return the index of the key to select in `pkg`. The result is
+        memoized in the workspace, per configuration and repository (and
+        package, if some of the labels are package-relative).
+        """
+
+        ws = pkg._repo._ws
+        key = self, ws.config_key, pkg._repo.name, pkg.name if self._relative else None
+
+        memo = ws._select_memo.get(key)
+        if memo is None:
+            memo = ws._select_memo[key] = self._match(pkg)
+
+        setting_pkgs, index = memo
+        for setting_pkg in setting_pkgs:
+            if setting_pkg is not pkg:
+                setting_pkg._dependents.add(pkg)
+        return index
+
+    def _match(self, pkg):
+        ws = pkg._repo._ws
+        matching = []
+        setting_pkgs = set()
 
-        for k, v in self._mapping.items():
-            repo_name, pkg_name, target_name = parse_label(k)
-            if (repo_name, pkg_name, target_name) == (None, 'conditions', 'default'):
-                default = v
+        for i, label in enumerate(self._labels):
+            if label is None:
                 continue
 
-            pkg = pkg.get_package(pkg_name, repo_name)
-
-            m = pkg.get_config_setting(target_name)
+            setting_pkg, m = ws.get_config_setting(pkg, label)
+            setting_pkgs.add(setting_pkg)
             if m is not None:
-                matching.append((m, v))
+                matching.append((m, i))
 
-        if not matching and default is None:
+        if not matching and self._default is None:
             raise RuntimeError('no matching case in a select')
 
         if not matching:
-            return default
+            return setting_pkgs, self._default
 
-        mm, vv = matching[0]
-        for m, v in matching[1:]:
+        mm, ii = matching[0]
+        for m, i in matching[1:]:
             if m >= mm:
                 mm = m
-                vv = v
+                ii = i
             elif not m <= mm:
                 raise RuntimeError('can\'t select: not largest matching condition')
 
-        return vv
+        return setting_pkgs, ii
+
+@functools.lru_cache(maxsize=4096)
+def _get_conditions(keys):
+    return _Conditions(keys)
+
+class _Select(_Lazy):
+    def __init__(self, mapping):
+        self._mapping = mapping
+
+    def operands(self):
+        return tuple(self._mapping.values())
+
+    def resolve(self, pkg):
+        conditions = _get_conditions(tuple(self._mapping))
+        return tuple(self._mapping.values())[conditions.match(pkg)]
 
 def _bld_select(pkg, mapping):
     return _Select(mapping)
@@ -239,6 +394,15 @@ def _bld_select(pkg, mapping):
 def _bld_config_setting(pkg, *, name, values, visibility):
     pkg.add_config_setting(name, values)
 
+def _bld_glob(pkg, include, exclude=(), exclude_directories=1, allow_empty=True):
+    return pkg.glob(include, exclude, exclude_directories, allow_empty)
+
+def _bld_package_name(pkg):
+    return pkg.name
+
+def _bld_repository_name(pkg):
+    return '@' + pkg._repo.name
+
 def _bld_exports_files(pkg, *labels, visibility=None, licenses=None):
     pass
 
@@ -246,6 +410,117 @@ def _bld_rule(pkg, implementation, test=False, attrs=None, outputs=None, executa
         output_to_genfiles=False, fragments=[], host_fragments=[], toolchains=[], doc=''):
     return _make_rule(implementation=implementation, attrs=attrs, outputs=outputs)
 
+class _ImpureMacro(Exception):
+    pass
+
+class _MacroRecorder:
+    """
+    Stands in for the calling package while a pure macro runs for the
+    first time with some arguments, recording the rules and
+    config_settings it adds. Anything else the macro asks the package
+    for (its name, a glob, ...) makes it impure.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def add_rule(self, rule):
+        self.calls.append((True, (rule.kind, rule.impl, rule.name, rule._pre_attrs)))
+
+    def add_config_setting(self, name, values):
+        self.calls.append((False, (name, values)))
+
+    def __getattr__(self, name):
+        raise _ImpureMacro(name)
+
+def _freeze(value):
+    t = type(value)
+    if t is tuple:
+        return t, tuple(_freeze(el) for el in value)
+    if t is dict:
+        return t, tuple((_freeze(k), _freeze(v)) for k, v in value.items())
+
+    # Raises `TypeError` for values that can't be memoized.
+    hash(value)
+    return t, value
+
+def _copy(value):
+    """
+    Copy the dicts in `value`, the only mutable values of BUILD files.
+    """
+
+    t = type(value)
+    if t is tuple:
+        return tuple(_copy(el) for el in value)
+    if t is dict:
+        return { k: _copy(v) for k, v in value.items() }
+    return value
+
+class _PureMacro:
+    """
+    A macro whose expansion only depends on its arguments, see
+    `_bzl_pure_macro`.
+
+    The first call with a given set of arguments runs the macro against
+    a `_MacroRecorder`; later calls replay the recorded rule calls
+    into the calling package. Every call gets its own copy of the
+    attributes and of the result, so that a caller mutating a dict
+    doesn't change the expansion of the next one. Macros that turn out
+    to read the package are run normally from then on.
+    """
+
+    deferrable = False
+
+    def __init__(self, fn):
+        self._fn = fn
+        self._pure = True
+        self._expansions = {}
+        self.hits = 0
+
+    def __call__(self, pkg, *args, **kw):
+        if not self._pure or isinstance(pkg, _MacroRecorder):
+            return self._fn(pkg, *args, **kw)
+
+        try:
+            key = _freeze(args), tuple(sorted((k, _freeze(v)) for k, v in kw.items()))
+        except TypeError:
+            return self._fn(pkg, *args, **kw)
+
+        expansion = self._expansions.get(key)
+        if expansion is None:
+            recorder = _MacroRecorder()
+            try:
+                result = self._fn(recorder, *args, **kw)
+            except _ImpureMacro:
+                self._pure = False
+                self._expansions.clear()
+                return self._fn(pkg, *args, **kw)
+
+            expansion = self._expansions[key] = _copy(tuple(recorder.calls)), _copy(result)
+        else:
+            self.hits += 1
+
+        calls, result = expansion
+        for is_rule, call in calls:
+            if is_rule:
+                kind, impl, name, pre_attrs = call
+                pkg.add_rule(Rule(kind, impl, pkg, name, _copy(pre_attrs)))
+            else:
+                pkg.add_config_setting(*call)
+        return _copy(result)
+
+def _bzl_pure_macro(pkg, fn):
+    """
+    `pure_macro(fn)` returns a memoized version of the macro `fn`;
+    calls with the same arguments expand to the same rules without
+    running `fn` again. Opt-in, as only the author of a macro knows
+    that it doesn't depend on mutable state.
+    """
+
+    if not callable(fn):
+        raise RuntimeError('pure_macro expects a function')
+    return _PureMacro(fn)
+
 _build_builtins = {
     'package': _bld_package,
     'licenses': _bld_licenses,
@@ -254,8 +529,12 @@ _build_builtins = {
     'config_setting': _bld_config_setting,
 
     'exports_files': _bld_exports_files,
+    'glob': _bld_glob,
+    'package_name': _bld_package_name,
+    'repository_name': _bld_repository_name,
 
     'cc_library': _make_rule(
+        kind='cc_library',
         implementation=None,
         attrs={
             'alwayslink': _attr.bool(),
@@ -269,6 +548,7 @@ _build_builtins = {
         outputs=['%(name)']
         ),
     'cc_binary': _make_rule(
+        kind='cc_binary',
         implementation=None,
         attrs={
             'srcs': _attr.label_list(),
@@ -280,6 +560,7 @@ _build_builtins = {
         outputs=['%(name)']
         ),
     'cc_test': _make_rule(
+        kind='cc_test',
         implementation=None,
         attrs={
             'srcs': _attr.label_list(),
@@ -293,10 +574,22 @@ _build_builtins = {
         ),
     }
 
+class _Native:
+    """
+    The `native` module of .bzl files, through which macros call
+    the functions available in BUILD files. Like all builtins, these
+    get the package of the BUILD file being evaluated.
+    """
+
+    def __init__(self, builtins):
+        self.__dict__.update(builtins)
+
 _bzl_builtins = {
     'select': _bld_select,
     'rule': _bld_rule,
     'attr': _Attr,
+    'native': _Native(_build_builtins),
+    'pure_macro': _bzl_pure_macro,
     }
 
 class Package:
@@ -308,30 +601,124 @@ class Package:
     the parse contents of .bzl files.
     """
 
-    def __init__(self, repo, path):
+    def __init__(self, repo, name, path):
+        self.name = name
         self._repo = repo
         self._path = path
         self._bzls = {}
+        self._bzl_inputs = {}
+        self._dependents = set()
         self._rules = {}
+        self._deferred = {}
         self._config_settings = {}
+        self.inputs = frozenset()
 
-    def parse_build_file(self, fin):
-        parsed = bzlfile.parse(fin)
-        bzlfile.evaluate(parsed, _build_builtins, self, self._load_bzl)
+        # Set for packages restored from a snapshot, whose build file
+        # hasn't been evaluated; `_unrestored` holds the names of rules
+        # that weren't instantiated when the snapshot was taken.
+        self.restored = False
+        self._unrestored = frozenset()
+
+    def label(self, target_name):
+        return make_label(self._repo.name, self.name, target_name).abslabel
+
+    def parse_build_file(self, fin, path=None):
+        self.evaluate_build_file(self._repo._ws.parse(fin), path)
+
+    def evaluate_build_file(self, parsed, path=None):
+        ws = self._repo._ws
+        defer = self.defer_rule if ws._lazy_rules else None
+        with ws.record_inputs(path) as inputs:
+            bzlfile.evaluate(parsed, _build_builtins, self, self._load_bzl, defer)
+        self.inputs = inputs
 
     def get_config_setting(self, name):
-        return self._config_settings.get(name)
+        values = self._config_settings.get(name)
+        if values is None:
+            return None
+        return self._repo._ws.match_config_setting(values)
 
     def get_package(self, pkg_name=None, repo_name=None):
         if pkg_name is None:
             return self
 
-        return self._repo.get_package(pkg_name, repo_name)
+        pkg = self._repo.get_package(pkg_name, repo_name)
+        if pkg is not self:
+            pkg._dependents.add(self)
+        return pkg
+
+    def defer_rule(self, name, thunk):
+        """
+        Record a rule call to be made when the target is first requested.
+        """
+
+        rule = self._rules.get(name)
+        if rule is not None and rule._pre_attrs is None:
+            # A restored rule (see `ensure_evaluated`) is needed right away.
+            thunk()
+            return
+
+        self._rules.pop(name, None)
+        self._deferred[name] = thunk
+
+    def ensure_evaluated(self):
+        """
+        Evaluate the build file of a package restored from a snapshot.
+        The restored rules stay and get their attributes back.
+        """
+
+        if not self.restored:
+            return
+
+        unrestored = self._unrestored
+        self.restored = False
+        self._unrestored = frozenset()
+        try:
+            with trace.span('evaluate_restored', 'load', repo=self._repo.name, package=self.name):
+                build_file, parsed = self._repo._load_build_file(self.name)
+                self.evaluate_build_file(parsed, build_file)
+        except BaseException:
+            # Try again, and fail the same way, on the next request.
+            self.restored = True
+            self._unrestored = unrestored
+            raise
+
+        for rule in self._rules.values():
+            if rule._pre_attrs is None:
+                raise RuntimeError('{} is no longer defined'.format(rule.label))
 
     def add_rule(self, rule):
+        self._deferred.pop(rule.name, None)
+
+        restored = self._rules.get(rule.name)
+        if restored is not None and restored._pre_attrs is None:
+            restored.impl = rule.impl
+            restored._pre_attrs = rule._pre_attrs
+            rule = restored
+
         self._rules[rule.name] = rule
 
+        loader = self._repo._ws._loader
+        if loader is not None:
+            loader.rule_added(self, rule._pre_attrs)
+
     def get_target(self, name):
+        if name in self._unrestored:
+            self.ensure_evaluated()
+
+        thunk = self._deferred.pop(name, None)
+        if thunk is not None:
+            ws = self._repo._ws
+            span = trace.span('instantiate_rule', 'load', label=self.label(name)) if trace.enabled() else trace.null_span
+            try:
+                with span, ws.record_inputs() as inputs:
+                    thunk()
+            except BaseException:
+                # Otherwise the target would be taken for a file.
+                self._deferred[name] = thunk
+                raise
+            self.inputs = self.inputs | inputs
+
         if name in self._rules:
             rule = self._rules[name]
             rule.resolve_attrs(self)
@@ -341,30 +728,58 @@ class Package:
     def get_file(self, path):
         return self._path + path.split('/')
 
+    def glob(self, include, exclude=(), exclude_directories=1, allow_empty=True):
+        if isinstance(include, str) or isinstance(exclude, str):
+            raise RuntimeError('glob patterns must be lists of strings')
+
+        pkg_rel = tuple(el for el in self.name.split('/') if el)
+        with trace.span('glob', 'load', package=self.name) if trace.enabled() else trace.null_span:
+            r, dirs = self._repo.dir_index().glob(pkg_rel, tuple(include), tuple(exclude), bool(exclude_directories))
+
+        # The listings are inputs too: adding a file that matches
+        # must reload the package.
+        ws = self._repo._ws
+        for path in dirs:
+            ws.add_input(path)
+
+        if not r and not allow_empty:
+            raise RuntimeError('glob({!r}) matched nothing'.format(list(include)))
+        return r
+
     def get_bzl(self, name):
         r = self._bzls.get(name)
         if r is None:
             self._bzls[name] = {}
 
+            ws = self._repo._ws
             path = self.get_file(name)
-            with self._repo._ws._fs.open(path, 'r') as fin:
-                parsed = bzlfile.parse(fin)
-                r = bzlfile.evaluate(parsed, _bzl_builtins, self, self._load_bzl)
+            span = trace.span('get_bzl', 'load', label=self.label(name)) if trace.enabled() else trace.null_span
+            with span, ws.record_inputs(path) as inputs:
+                with ws._fs.open(path, 'r') as fin:
+                    parsed = ws.parse(fin)
+                    r = bzlfile.evaluate(parsed, _bzl_builtins, self, self._load_bzl)
 
             self._bzls[name] = r
+            self._bzl_inputs[name] = inputs
 
         return r
 
+    def forget_config_settings(self):
+        index = self._repo._ws._config_index
+        for label in [label for label, (pkg, _) in index.items() if pkg is self]:
+            del index[label]
+
     def add_config_setting(self, name, values):
-        if self._repo._ws.is_config_matching(values):
-            self._config_settings[name] = set(values)
-        else:
-            self._config_settings[name] = None
+        values = dict(values)
+        self._config_settings[name] = values
+        self._repo._ws._config_index[make_label(self._repo.name, self.name, name)] = self, values
 
     def _load_bzl(self, label):
         repo_name, pkg_name, target_name = parse_label(label)
         pkg = self.get_package(pkg_name, repo_name)
-        return pkg.get_bzl(target_name)
+        r = pkg.get_bzl(target_name)
+        self._repo._ws.add_inputs(pkg._bzl_inputs.get(target_name, ()))
+        return r
 
 class Repo:
     """
@@ -375,35 +790,75 @@ class Repo:
     to appear in the filesystem. Instead, it is only materialized when
     first access to a package is performed.
     """
-    def __init__(self, ws):
+    def __init__(self, ws, name):
+        self.name = name
         self._ws = ws
         self._packages = {}
+        self._dir_index = None
 
     def get_repo(self, name):
         return self._ws.get_repo(name)
 
+    def dir_index(self):
+        if self._dir_index is None:
+            self._dir_index = DirIndex(self._ws._fs, self._materialize(), _build_file_names)
+        return self._dir_index
+
     def get_package(self, pkg_name, repo_name=None):
-        if repo_name is None:
-            pkg = self._packages.get(pkg_name)
-            if pkg is None:
+        if repo_name is not None:
+            repo = self._ws.get_repo(repo_name)
+            return repo.get_package(pkg_name)
+
+        pkg = self._packages.get(pkg_name)
+        if pkg is None:
+            with trace.span('get_package', 'load', repo=self.name, package=pkg_name):
+                build_file, parsed = self._load_build_file(pkg_name)
+
                 path = self._materialize()
-                full_package_path = path + pkg_name.split('/')
+                pkg = Package(self, pkg_name, path + pkg_name.split('/'))
 
+                # Registered before it's evaluated, for the .bzl files
+                # it loads from itself, but a package that fails to
+                # evaluate mustn't stay: it would have no inputs to
+                # be refreshed by.
+                self._packages[pkg_name] = pkg
                 try:
-                    fin = self._ws._fs.open(full_package_path / 'BUILD.bazel', 'r')
-                except IOError:
-                    fin = self._ws._fs.open(full_package_path / 'BUILD', 'r')
-
-                with fin:
-                    pkg = Package(self, full_package_path)
-                    self._packages[pkg_name] = pkg
-                    pkg.parse_build_file(fin)
-        else:
-            repo = self._ws.get_repo(repo_name)
-            pkg = repo.get_package(pkg_name)
+                    pkg.evaluate_build_file(parsed, build_file)
+                except BaseException:
+                    del self._packages[pkg_name]
+                    pkg.forget_config_settings()
+                    raise
 
         return pkg
 
+    def _load_build_file(self, pkg_name):
+        loader = self._ws._loader
+        if loader is not None:
+            future = loader.take(self, pkg_name)
+            if future is not None:
+                return future.result()
+
+        return self.read_build_file(pkg_name)
+
+    def read_build_file(self, pkg_name):
+        """
+        Read and parse the BUILD file of a package, returning its path
+        along with the parsed module. This doesn't touch
+        any state besides the parse cache and may be called from
+        any thread.
+        """
+
+        full_package_path = self._materialize() + pkg_name.split('/')
+
+        fs = self._ws._fs
+        for fname in _build_file_names:
+            path = full_package_path / fname
+            if fs.isfile(path):
+                break
+
+        with trace.span('read_build_file', 'io', repo=self.name, package=pkg_name), fs.open(path, 'r') as fin:
+            return path, self._ws.parse(fin)
+
 class LocalRepo(Repo):
     """
     A repository located somewhere in the filesystem.
@@ -412,16 +867,89 @@ class LocalRepo(Repo):
     are `LocalRepo`s.
     """
 
-    def __init__(self, ws, path):
-        Repo.__init__(self, ws)
+    def __init__(self, ws, name, path):
+        Repo.__init__(self, ws, name)
         self._path = path
 
     def _materialize(self):
         return self._path
 
+    def find_build_files(self):
+        """
+        Yield `(pkg_name, path)` for every BUILD file in the repository.
+        """
+
+        fs = self._ws._fs
+        for rel, dirnames, filenames in fs.walk(self._path):
+            dirnames[:] = [d for d in dirnames if d not in _vcs_dirs]
+            for fname in _build_file_names:
+                if fname in filenames:
+                    yield '/'.join(rel), (self._path + rel) / fname
+                    break
+
+class HttpArchiveRepo(Repo):
+    """
+    A repository defined by `http_archive`.
+
+    The archive is only downloaded and extracted, through the workspace's
+    repository cache, when the repository is first materialized, i.e.
+    when one of its packages is requested. Materialization is
+    thread-safe, so that several archives can be fetched at once.
+    """
+
+    def __init__(self, ws, name, urls, sha256=None, strip_prefix=None, type=None):
+        Repo.__init__(self, ws, name)
+        self._urls = urls
+        self._sha256 = sha256
+        self._strip_prefix = strip_prefix
+        self._type = type
+        self._path = None
+        self._lock = threading.Lock()
+
+    def _materialize(self):
+        path = self._path
+        if path is not None:
+            return path
+
+        with self._lock:
+            if self._path is None:
+                ws = self._ws
+                if ws._http is None:
+                    raise RuntimeError('can\'t fetch @{}: no http client'.format(self.name))
+
+                with trace.span('fetch', 'io', repo=self.name):
+                    native_path = ws.repo_cache().materialize(ws._http, self._urls, self._sha256,
+                        self._strip_prefix, self._type)
+                self._path = ws._fs.make_path(native_path)
+            return self._path
+
+_build_file_names = ('BUILD.bazel', 'BUILD')
+_vcs_dirs = frozenset(('.git', '.hg', '.svn'))
+
+def _warm_parse_cache(fs, parse_cache, paths):
+    for path in paths:
+        try:
+            with fs.open(path, 'r') as fin:
+                bzlfile.warm(fin, parse_cache)
+        except (IOError, SyntaxError, ValueError):
+            # Left to the serial loader, which will report the error
+            # if the package is ever requested.
+            pass
+
 class File:
     def __init__(self, path):
         self._path = path
+        self._hash = None
+
+    def __eq__(self, rhs):
+        return isinstance(rhs, File) and self._path == rhs._path
+
+    def __hash__(self):
+        # Files end up in large depsets; paths are slow to hash.
+        h = self._hash
+        if h is None:
+            h = self._hash = hash(self._path)
+        return h
 
 class _LoadCtx:
     pass
@@ -430,23 +958,174 @@ class Workspace:
     """
     Workspace is mostly a collection of repositories. It also serves as a holder
     for injected dependencies.
+
+    `evaluator` is either `'ast'` or `'compiled'`. Each module is only
+    run once, so the time spent compiling it is not won back, unless
+    the workspace is refreshed and `keep_modules` is set (see `parse`);
+    the compiled evaluator is needed for `lazy_rules`, though. With
+    `lazy_rules`, rule calls in BUILD files are only recorded when
+    the file is evaluated and are made when their target is first
+    requested.
     """
 
-    def __init__(self, base_dir, config, *, fs, http):
+    def __init__(self, base_dir, config, *, fs, http, parse_cache=None, evaluator='ast',
+            prefetch_jobs=0, lazy_rules=False, repo_cache=None, keep_modules=False):
+        if evaluator not in ('ast', 'compiled'):
+            raise ValueError('unknown evaluator: {}'.format(evaluator))
+
         self._fs = fs
         self._http = http
+        self._repo_cache = repo_cache
+        self._parse_cache = parse_cache
+        self._compile = evaluator == 'compiled'
+        self._modules = {} if keep_modules else None
+        self._old_modules = {}
+        self._lazy_rules = lazy_rules
+        self._loader = Prefetcher(self, prefetch_jobs) if prefetch_jobs else None
 
         self._config = config
+        self.config_key = tuple(sorted(config.items()))
+        self._config_index = {}
+        self._select_memo = {}
+        self.generation = 0
+        self._input_stack = []
+        self._input_stats = {}
         self._root_dir, ws_file = self._find_workspace_file(base_dir)
         self._repos = {
-            '': LocalRepo(self, self._root_dir)
+            '': LocalRepo(self, '', self._root_dir)
             }
 
-        self._ws_bzl = self._real_load(ws_file, '', '')
+        with self.record_inputs(self._root_dir / 'WORKSPACE') as inputs:
+            self._ws_bzl = self._real_load(ws_file, '', '')
+        self.inputs = inputs
+
+    def close(self):
+        """
+        Stop the prefetch threads, if any. The workspace stays usable;
+        prefetching resumes with the next package that is loaded.
+        """
+
+        if self._loader is not None:
+            self._loader.close()
+
+    @contextlib.contextmanager
+    def record_inputs(self, path=None):
+        """
+        Collect the paths of all files read while the context is active,
+        along with `path`, if given. The yielded set is complete once
+        the context exits.
+        """
+
+        inputs = set()
+        if path is not None:
+            native_path = self._fs.native_path(path)
+            inputs.add(native_path)
+            self._input_stats[native_path] = path, self._stat_key(path)
+
+        self._input_stack.append(inputs)
+        try:
+            yield inputs
+        finally:
+            self._input_stack.pop()
+
+    def _stat_key(self, path):
+        try:
+            st = self._fs.stat(path)
+        except (IOError, OSError):
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def refresh(self):
+        """
+        Drop every package whose BUILD or .bzl files changed since
+        they were read, along with the packages that refer to them.
+
+        Returns `False` if the files read by WORKSPACE changed; the
+        workspace has to be recreated in that case. `generation` is
+        bumped whenever packages are dropped.
+        """
+
+        self._fs.invalidate()
+        if self._modules is not None:
+            self._old_modules = self._modules
+            self._modules = {}
+
+        changed = set()
+        for native_path, (path, key) in list(self._input_stats.items()):
+            if self._stat_key(path) != key:
+                changed.add(native_path)
+                del self._input_stats[native_path]
+
+        # Prefetched modules aren't tracked, so they may be
+        # stale as well.
+        for repo in self._repos.values():
+            repo._dir_index = None
+        if self._loader is not None:
+            self._loader.clear()
+
+        if not changed:
+            return True
+
+        if not changed.isdisjoint(self.inputs):
+            return False
+
+        stale = []
+        for repo in self._repos.values():
+            for pkg in repo._packages.values():
+                if not changed.isdisjoint(pkg.inputs) or any(not changed.isdisjoint(inputs) for inputs in pkg._bzl_inputs.values()):
+                    stale.append(pkg)
+
+        dropped = set()
+        while stale:
+            pkg = stale.pop()
+            if pkg in dropped:
+                continue
+
+            dropped.add(pkg)
+            if pkg._repo._packages.get(pkg.name) is pkg:
+                del pkg._repo._packages[pkg.name]
+            stale.extend(pkg._dependents)
+
+        if dropped:
+            self.generation += 1
+            self._config_index.clear()
+            self._select_memo.clear()
+        return True
+
+    def package_dependencies(self):
+        """
+        Return a dict mapping loaded packages to the set of packages
+        they referred to, i.e. the inverse of `Package._dependents`:
+        the packages they loaded .bzl files from and those whose
+        targets or config_settings they named.
+        """
+
+        r = {}
+        for repo in self._repos.values():
+            for pkg in repo._packages.values():
+                for dependent in pkg._dependents:
+                    r.setdefault(dependent, set()).add(pkg)
+        return r
+
+    def add_input(self, path):
+        """
+        Record `path` (a file or a directory) as an input of whatever
+        is being loaded.
+        """
+
+        if self._input_stack:
+            native_path = self._fs.native_path(path)
+            if native_path not in self._input_stats:
+                self._input_stats[native_path] = path, self._stat_key(path)
+            self._input_stack[-1].add(native_path)
+
+    def add_inputs(self, paths):
+        if self._input_stack:
+            self._input_stack[-1].update(paths)
 
     def _real_load(self, fin, cur_repo, cur_pkg):
         with fin:
-            mod = bzlfile.parse(fin)
+            mod = self.parse(fin)
 
         def load(label):
             repo_name, pkg_name, target_name = parse_label(label)
@@ -457,22 +1136,156 @@ class Workspace:
             else:
                 pkg = self._repos[repo_name].get_package(pkg_name)
 
-            return pkg.get_bzl(target_name)
+            r = pkg.get_bzl(target_name)
+            self.add_inputs(pkg._bzl_inputs.get(target_name, ()))
+            return r
 
         return bzlfile.evaluate(mod, self._make_builtins(), None, load)
 
+    def parse(self, fin):
+        """
+        Parse (and compile) a file.
+
+        With `keep_modules`, modules are kept by source, so that files
+        read again after a `refresh`, e.g. the BUILD files of the
+        dependents of a package that changed, are neither parsed nor
+        compiled again. Modules that weren't used since the previous
+        `refresh` are dropped by the next one. This is for long-lived
+        workspaces only: the kept modules make the garbage collector's
+        full collections slower, which doubles the time of a first load.
+        """
+
+        if self._modules is None:
+            return self.compile(bzlfile.parse(fin, self._parse_cache))
+
+        source = fin.read()
+        mod = self._modules.get(source)
+        if mod is None:
+            mod = self._old_modules.pop(source, None)
+            if mod is None:
+                mod = self.compile(bzlfile.parse_string(source, self._parse_cache))
+            self._modules[source] = mod
+        return mod
+
+    def compile(self, mod):
+        if self._compile:
+            mod = bzlcompile.compile(mod)
+        return mod
+
+    def preparse(self, jobs=None, chunk_size=64):
+        """
+        Parse the BUILD files of all local repositories in a process pool,
+        storing them in the parse cache; loading a package later reads
+        its module from there. Returns the number of files that were
+        handed out, or 0 without a parse cache.
+
+        Modules aren't sent back to this process: unpickling one takes
+        about as long as parsing the file in the first place.
+        """
+
+        if self._parse_cache is None:
+            return 0
+
+        chunks = []
+        for repo in self._repos.values():
+            if not isinstance(repo, LocalRepo):
+                continue
+
+            paths = [path for pkg_name, path in repo.find_build_files() if pkg_name not in repo._packages]
+            chunks.extend(paths[i:i+chunk_size] for i in range(0, len(paths), chunk_size))
+
+        if not chunks:
+            return 0
+
+        with ProcessPoolExecutor(jobs) as executor:
+            for _ in executor.map(functools.partial(_warm_parse_cache, self._fs, self._parse_cache), chunks):
+                pass
+        return sum(len(chunk) for chunk in chunks)
+
     def _make_builtins(self):
         def local_repository(ctx, name, path):
-            self._repos[name] = LocalRepo(self, self._fs.make_path(path))
+            self._repos[name] = LocalRepo(self, name, self._fs.make_path(path))
 
         def http_archive(ctx, name, sha256=None, strip_prefix=None, type=None, url=None, urls=None):
-            pass
+            all_urls = ([url] if url else []) + list(urls or ())
+            if not all_urls:
+                raise RuntimeError('http_archive {} has no urls'.format(name))
+            self._repos[name] = HttpArchiveRepo(self, name, all_urls, sha256, strip_prefix, type)
 
         return vars()
 
+    def repo_cache(self):
+        if self._repo_cache is None:
+            self._repo_cache = RepoCache(os.path.join(default_cache_dir(), 'repos'))
+        return self._repo_cache
+
+    def fetch_repos(self, jobs=None):
+        """
+        Materialize all `http_archive` repositories, fetching
+        them in parallel.
+        """
+
+        repos = [repo for repo in self._repos.values() if isinstance(repo, HttpArchiveRepo)]
+        if not repos:
+            return
+
+        with ThreadPoolExecutor(jobs) as executor:
+            for _ in executor.map(HttpArchiveRepo._materialize, repos):
+                pass
+
+    @contextlib.contextmanager
+    def configure(self, config):
+        """
+        Make `config` the current configuration while the context
+        is active. Packages, rules and the attributes that don't `select`
+        are shared between configurations.
+        """
+
+        saved = self._config, self.config_key
+        self._config = config
+        self.config_key = tuple(sorted(config.items()))
+        try:
+            yield
+        finally:
+            self._config, self.config_key = saved
+
     def is_config_matching(self, match_set):
         return all(self._config.get(k) == v for k, v in match_set.items())
 
+    def match_config_setting(self, values):
+        """
+        Return the keys of a config_setting's `values` if it matches
+        the current configuration, or `None`.
+        """
+
+        if self.is_config_matching(values):
+            return frozenset(values)
+        return None
+
+    def get_config_setting(self, base_pkg, label):
+        """
+        Look up the config_setting `label` (a parsed label, relative
+        to `base_pkg`). Returns the package that defines it, along with
+        the result of `match_config_setting`.
+
+        Settings are indexed by interned label as their packages load,
+        so most lookups are a single dict probe.
+        """
+
+        repo_name, pkg_name, target_name = label
+        key = make_label(base_pkg._repo.name if repo_name is None else repo_name,
+            base_pkg.name if pkg_name is None else pkg_name, target_name)
+
+        r = self._config_index.get(key)
+        if r is None:
+            pkg = base_pkg.get_package(pkg_name, repo_name)
+            return pkg, pkg.get_config_setting(target_name)
+
+        pkg, values = r
+        if pkg is not base_pkg:
+            pkg._dependents.add(base_pkg)
+        return pkg, self.match_config_setting(values)
+
     def load_package(self, repo, package):
         pass
 
@@ -481,17 +1294,14 @@ class Workspace:
 
     def resolve_target(self, label, cur_repo, cur_pkg):
         repo, pkg_name, tgt = parse_label(label, cur_repo, cur_pkg)
-        pkg = self._repos[repo].get_package(pkg_name)
+        pkg = self._repos[repo or ''].get_package(pkg_name)
         return pkg.get_target(tgt)
 
     def _find_workspace_file(self, base):
         cur = self._fs.make_path(base)
         while True:
-            try:
+            if self._fs.isfile(cur / 'WORKSPACE'):
                 return cur, self._fs.open(cur / 'WORKSPACE', 'r')
-            except IOError as e:
-                if e.errno != errno.ENOENT:
-                    raise
 
             cur, tail = self._fs.split(cur)
             if tail == '':
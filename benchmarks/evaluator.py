@@ -0,0 +1,72 @@
+"""
+Compares the AST-walking evaluator against the closure compiler.
+Modules are compiled for every evaluation, so the compiled evaluator
+is timed with the compilation included.
+
+    python -m benchmarks.evaluator --rules 5000 --repeat 5
+"""
+
+import argparse
+import io
+import sys
+import timeit
+
+from bazilisk import bzlfile, bzlcompile
+from bazilisk.workspace import _build_builtins
+
+class _Package:
+    def __init__(self):
+        self.rules = 0
+
+    def add_rule(self, rule):
+        self.rules += 1
+
+    def add_config_setting(self, name, values):
+        pass
+
+def make_build_file(rules):
+    lines = [
+        'COPTS = ["-Wall", "-Werror"]',
+        'config_setting(name = "dbg", values = {"compilation_mode": "dbg"}, visibility = ["//visibility:public"])',
+        ]
+
+    for i in range(rules):
+        lines.append(
+            'cc_library(name = "lib{i}", srcs = ["lib{i}.cc", "lib{i}_impl.cc"], hdrs = ["lib{i}.h"], '
+            'copts = COPTS + select({{":dbg": ["-g"], "//conditions:default": []}}), '
+            'deps = [":lib{j}", "//base:base"], visibility = ["//visibility:public"])'.format(i=i, j=max(i - 1, 0)))
+
+    return '\n'.join(lines) + '\n'
+
+def _main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rules', type=int, default=2000)
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+
+    mod = bzlfile.parse(io.StringIO(make_build_file(args.rules)))
+
+    def run_ast():
+        bzlfile.evaluate(mod, _build_builtins, _Package(), None)
+
+    def run_compiled():
+        bzlfile.evaluate(bzlcompile.compile(mod), _build_builtins, _Package(), None)
+
+    compiled = bzlcompile.compile(mod)
+    def run_precompiled():
+        bzlfile.evaluate(compiled, _build_builtins, _Package(), None)
+
+    ast_time = min(timeit.repeat(run_ast, number=1, repeat=args.repeat))
+    compiled_time = min(timeit.repeat(run_compiled, number=1, repeat=args.repeat))
+    compile_time = min(timeit.repeat(lambda: bzlcompile.compile(mod), number=1, repeat=args.repeat))
+    eval_time = min(timeit.repeat(run_precompiled, number=1, repeat=args.repeat))
+
+    print('rules:     {}'.format(args.rules))
+    print('ast:       {:.4f}s'.format(ast_time))
+    print('compiled:  {:.4f}s ({:.2f}x)'.format(compiled_time, ast_time / compiled_time))
+    print('  compile: {:.4f}s'.format(compile_time))
+    print('  eval:    {:.4f}s'.format(eval_time))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(_main())
@@ -0,0 +1,188 @@
+"""
+Times the phases of a bazilisk run on synthetic workspaces.
+
+    python -m benchmarks.suite run --packages 100,1000,10000 -o results.json
+    python -m benchmarks.suite compare baseline.json results.json
+"""
+
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+
+from bazilisk import msvc_ccproj
+from bazilisk.fs import MemFs
+from bazilisk.workspace import Workspace, File
+from . import synth
+
+_phases = ('workspace', 'load', 'resolve_attrs', 'resolve_target', 'generate')
+
+class _Project:
+    def __init__(self, label, srcs, deps):
+        self.label = label
+        self.srcs = srcs
+        self.deps = deps
+
+def run_one(params, config={}, evaluator='ast'):
+    files, labels = synth.generate(params)
+    fs = MemFs(files)
+    times = {}
+
+    t = time.perf_counter()
+    w = Workspace('/ws', config, fs=fs, http=None, evaluator=evaluator)
+    times['workspace'] = time.perf_counter() - t
+
+    repo = w.get_repo('')
+    pkg_names = ['config', 'defs'] + [synth.package_name(i) for i in range(params.packages)]
+
+    t = time.perf_counter()
+    pkgs = [repo.get_package(name) for name in pkg_names]
+    times['load'] = time.perf_counter() - t
+
+    # Attributes are resolved lazily; read them all, so that this phase
+    # measures the same work as when they were resolved up front.
+    t = time.perf_counter()
+    for pkg in pkgs:
+        for rule in pkg._rules.values():
+            rule.resolve_attrs(pkg)
+            attrs = rule.attrs
+            for k in attrs:
+                attrs[k]
+    times['resolve_attrs'] = time.perf_counter() - t
+
+    rules = [w.resolve_target(label, '', '') for label in labels]
+
+    # Resolving the targets of the workspace above would only look them
+    # up; time it the way a run does it, on a workspace that hasn't
+    # loaded any package yet.
+    cold = Workspace('/ws', config, fs=MemFs(files), http=None, evaluator=evaluator)
+    t = time.perf_counter()
+    for label in labels:
+        cold.resolve_target(label, '', '')
+    times['resolve_target'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    proj_map = { rule.label: (rule.label + '.vcxproj', '00000000-0000-0000-0000-000000000000') for rule in rules }
+    for rule in rules:
+        srcs = [fs.native_path(src._path) for src in rule.attrs.get('srcs', ()) + rule.attrs.get('hdrs', ())
+            if isinstance(src, File)]
+        deps = [dep.label for dep in rule.attrs.get('deps', ())]
+        msvc_ccproj.make_vcxproj(_Project(rule.label, srcs, deps), proj_map)
+    times['generate'] = time.perf_counter() - t
+
+    return { 'packages': params.packages, 'targets': len(labels), 'phases': times }
+
+def run(args):
+    results = {
+        'python': platform.python_version(),
+        'evaluator': args.evaluator,
+        'runs': [],
+        }
+
+    for packages in args.packages:
+        params = synth.Params(packages=packages, rules=args.rules, fanout=args.fanout, depth=args.depth,
+            select_density=args.select_density, load_chain=args.load_chain, seed=args.seed)
+
+        best = None
+        for _ in range(args.repeat):
+            r = run_one(params, { 'mode': 'dbg' }, args.evaluator)
+            if best is None:
+                best = r
+            else:
+                best['phases'] = { k: min(v, r['phases'][k]) for k, v in best['phases'].items() }
+
+        best['params'] = params.as_dict()
+        results['runs'].append(best)
+        _print_run(best)
+
+    _print_scaling(results['runs'])
+
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(results, fout, indent=2, sort_keys=True)
+    return 0
+
+def _print_run(r):
+    print('{:>7} packages, {:>8} targets: {}'.format(r['packages'], r['targets'],
+        ', '.join('{} {:.3f}s'.format(k, r['phases'][k]) for k in _phases)))
+
+def _print_scaling(runs):
+    # The exponent k in time ~ targets^k between consecutive sizes;
+    # 1 means linear, 2 quadratic.
+    for prev, cur in zip(runs, runs[1:]):
+        if cur['targets'] == prev['targets']:
+            continue
+
+        size_ratio = math.log(cur['targets'] / prev['targets'])
+        exps = []
+        for k in _phases:
+            a, b = prev['phases'][k], cur['phases'][k]
+            if a > 0 and b > 0:
+                exps.append('{} {:.2f}'.format(k, math.log(b / a) / size_ratio))
+        print('scaling {} -> {} targets: {}'.format(prev['targets'], cur['targets'], ', '.join(exps)))
+
+def compare(args):
+    with open(args.baseline, 'r') as fin:
+        base = json.load(fin)
+    with open(args.results, 'r') as fin:
+        cur = json.load(fin)
+
+    base_runs = { (r['packages'], r['targets']): r for r in base['runs'] }
+
+    regressions = 0
+    for r in cur['runs']:
+        b = base_runs.get((r['packages'], r['targets']))
+        if b is None:
+            continue
+
+        for k in _phases:
+            old = b['phases'].get(k)
+            new = r['phases'].get(k)
+            if not old or new is None:
+                continue
+
+            ratio = new / old
+            flag = ''
+            if ratio > 1 + args.threshold and new - old > args.min_delta:
+                flag = '  REGRESSION'
+                regressions += 1
+            print('{:>7} packages {:<15} {:8.3f}s -> {:8.3f}s ({:+.1%}){}'.format(
+                r['packages'], k, old, new, ratio - 1, flag))
+
+    return 1 if regressions else 0
+
+def _int_list(s):
+    return [int(x) for x in s.split(',')]
+
+def _main():
+    ap = argparse.ArgumentParser(prog='python -m benchmarks.suite')
+    sub = ap.add_subparsers(dest='command')
+    sub.required = True
+
+    p = sub.add_parser('run')
+    p.add_argument('--packages', type=_int_list, default=[100, 1000])
+    p.add_argument('--rules', type=int, default=10)
+    p.add_argument('--fanout', type=int, default=3)
+    p.add_argument('--depth', type=int, default=8)
+    p.add_argument('--select-density', type=float, default=0.2)
+    p.add_argument('--load-chain', type=int, default=3)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--evaluator', choices=('ast', 'compiled'), default='ast')
+    p.add_argument('--output', '-o')
+    p.set_defaults(fn=run)
+
+    p = sub.add_parser('compare')
+    p.add_argument('baseline')
+    p.add_argument('results')
+    p.add_argument('--threshold', type=float, default=0.10, help='relative slowdown to flag')
+    p.add_argument('--min-delta', type=float, default=0.005, help='ignore slowdowns below this many seconds')
+    p.set_defaults(fn=compare)
+
+    args = ap.parse_args()
+    return args.fn(args)
+
+if __name__ == '__main__':
+    sys.exit(_main())
@@ -0,0 +1,89 @@
+import random
+
+class Params:
+    """
+    The shape of a synthetic workspace.
+
+    Packages are split into `depth` layers; each rule depends on
+    `fanout` rules from lower layers, so the graph is acyclic. A fraction
+    `select_density` of the rules select their copts and deps on one
+    of the config settings in `//config`. Every package loads the head
+    of a chain of `load_chain` .bzl files.
+    """
+
+    def __init__(self, packages=100, rules=10, fanout=3, depth=8, select_density=0.2, load_chain=3, seed=0):
+        self.packages = packages
+        self.rules = rules
+        self.fanout = fanout
+        self.depth = depth
+        self.select_density = select_density
+        self.load_chain = load_chain
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(vars(self))
+
+_config_settings = ('dbg', 'opt', 'x64')
+
+def package_name(i):
+    return 'pkg/p{}'.format(i)
+
+def generate(params, root='/ws'):
+    """
+    Return a dict mapping paths to file contents, as accepted
+    by `bazilisk.fs.MemFs`, and the list of all rule labels.
+    """
+
+    rnd = random.Random(params.seed)
+    files = { root + '/WORKSPACE': '' }
+    labels = []
+
+    files[root + '/config/BUILD'] = ''.join(
+        'config_setting(name = "{0}", values = {{"mode": "{0}"}}, visibility = ["//visibility:public"])\n'.format(name)
+        for name in _config_settings)
+
+    files[root + '/defs/BUILD'] = ''
+    for i in range(params.load_chain):
+        if i == 0:
+            body = 'COPTS = ["-DCHAIN0"]\n'
+        else:
+            body = 'load("//defs:d{}.bzl", _COPTS = "COPTS")\nCOPTS = _COPTS + ["-DCHAIN{}"]\n'.format(i - 1, i)
+        files[root + '/defs/d{}.bzl'.format(i)] = body
+
+    layer_size = max(params.packages // max(params.depth, 1), 1)
+    for i in range(params.packages):
+        lines = []
+        if params.load_chain:
+            lines.append('load("//defs:d{}.bzl", "COPTS")'.format(params.load_chain - 1))
+        else:
+            lines.append('COPTS = []')
+
+        lower = (i // layer_size) * layer_size
+        for r in range(params.rules):
+            deps = []
+            if lower:
+                for _ in range(params.fanout):
+                    deps.append('//{}:r{}'.format(package_name(rnd.randrange(lower)), rnd.randrange(params.rules)))
+            deps = sorted(set(deps))
+
+            deps_expr = repr(deps).replace("'", '"')
+            copts_expr = 'COPTS'
+            if rnd.random() < params.select_density:
+                cond = rnd.choice(_config_settings)
+                copts_expr = 'COPTS + select({{"//config:{}": ["-D{}"], "//conditions:default": []}})'.format(cond, cond.upper())
+                if deps:
+                    deps_expr = '{} + select({{"//config:{}": [], "//conditions:default": []}})'.format(deps_expr, cond)
+
+            lines.append(
+                'cc_library(\n'
+                '    name = "r{r}",\n'
+                '    srcs = ["r{r}.cc", "r{r}_impl.cc"],\n'
+                '    hdrs = ["r{r}.h"],\n'
+                '    copts = {copts},\n'
+                '    deps = {deps},\n'
+                ')'.format(r=r, copts=copts_expr, deps=deps_expr))
+            labels.append('//{}:r{}'.format(package_name(i), r))
+
+        files['{}/{}/BUILD'.format(root, package_name(i))] = '\n'.join(lines) + '\n'
+
+    return files, labels
@@ -14,8 +14,6 @@ setup(
     license='MIT',
 
     packages=['bazilisk'],
-    data_files=[('bazilisk', ['bazilisk/sln.mako', 'bazilisk/vcxproj.mako'])],
-    install_requires=['mako'],
     entry_points={
         'console_scripts': ['bzlsk=bazilisk.bazilisk:_main'],
         },
@@ -0,0 +1,43 @@
+"""
+Deferred rule calls (`lazy_rules`) must see the same values as
+eager ones.
+"""
+
+import pytest
+
+from bazilisk.fs import MemFs
+from bazilisk.workspace import Workspace
+
+def _srcs(build, lazy_rules, files={}):
+    fs = MemFs(dict(files, **{ '/ws/WORKSPACE': '', '/ws/p/BUILD': build }))
+    w = Workspace('/ws', {}, fs=fs, http=None, evaluator='compiled', lazy_rules=lazy_rules)
+    rule = w.resolve_target('//p:l', '', '')
+    return [fs.native_path(src._path) for src in rule.attrs['srcs']]
+
+@pytest.mark.parametrize('mutation', [
+    'd.update(s = "y.cc")',
+    'd["s"] = "y.cc"',
+    'd.pop("s")',
+    'd.clear()',
+    ])
+def test_mutation_after_rule_call(mutation):
+    build = 'd = {"s": "x.cc"}\ncc_library(name = "l", srcs = [d["s"]])\n' + mutation + '\n'
+    assert _srcs(build, False) == ['/ws/p/x.cc']
+    assert _srcs(build, True) == ['/ws/p/x.cc']
+
+def test_reassignment_after_rule_call():
+    build = 's = "x.cc"\ncc_library(name = "l", srcs = [s])\ns = "y.cc"\n'
+    assert _srcs(build, True) == ['/ws/p/x.cc']
+
+@pytest.mark.parametrize('call', [
+    'cc_library(name = "l", srcs = [d["a"]["s"]])',
+    'cc_library(name = "l", **d["a"]["kw"])',
+    'cc_library(name = "l", srcs = [t[0]["a"]["s"]])',
+    ])
+def test_mutation_by_function(call):
+    files = { '/ws/p/defs.bzl': 'def mut(d):\n    d["a"]["s"] = "y.cc"\n    d["a"]["kw"]["srcs"] = ["y.cc"]\n' }
+    build = ('load(":defs.bzl", "mut")\n'
+        'd = {"a": {"s": "x.cc", "kw": {"srcs": ["x.cc"]}}}\n'
+        't = (d,)\n' + call + '\nmut(d)\n')
+    assert _srcs(build, False, files) == ['/ws/p/x.cc']
+    assert _srcs(build, True, files) == ['/ws/p/x.cc']
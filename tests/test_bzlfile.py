@@ -0,0 +1,81 @@
+"""
+The AST evaluator and the compiled one must agree.
+"""
+
+import warnings
+
+import pytest
+
+from bazilisk import bzlcompile, bzlfile
+
+_lib = {
+    'base': ('a', 'b'),
+    'flags': {'opt': '-O2'},
+    }
+
+def _evaluate(source, evaluator):
+    mod = bzlfile.parse_string(source)
+    if evaluator == 'compiled':
+        mod = bzlcompile.compile(mod)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        return bzlfile.evaluate(mod, {}, None, lambda label: _lib)
+
+evaluators = pytest.mark.parametrize('evaluator', ['ast', 'compiled'])
+
+@evaluators
+@pytest.mark.parametrize('expr, value', [
+    ('[x + "1" for x in ["a", "b"] if x != "b"]', ('a1',)),
+    ('{k: len(k) for k in ["a", "bc"]}', {'a': 1, 'bc': 2}),
+    ('"a" if 1 < 2 else "b"', 'a'),
+    ('(1, "x")', (1, 'x')),
+    ('1 <= 2 < 3 and "a" in ["a"]', True),
+    ('None or "x"', 'x'),
+    ('not True', False),
+    ('-(1 + 2)', -3),
+    ('[x for x in base]', ('a', 'b')),
+    ])
+def test_top_level_expression(evaluator, expr, value):
+    g = _evaluate('load("//lib.bzl", "base")\nv = {}\n'.format(expr), evaluator)
+    assert g['v'] == value
+
+@evaluators
+def test_load(evaluator):
+    g = _evaluate('load("//lib.bzl", "base", f = "flags")\n', evaluator)
+    assert g['base'] == ('a', 'b')
+    assert g['f'] == {'opt': '-O2'}
+
+@evaluators
+def test_function(evaluator):
+    g = _evaluate('''
+def f(items, sep = ",", *, prefix, suffix = ""):
+    r = []
+    for item in items:
+        if item == "skip":
+            continue
+        elif item == "stop":
+            break
+        r += [prefix + item + suffix]
+    return sep.join(r)
+
+a = f(["x", "skip", "y", "stop", "z"], prefix = "-")
+b = f(["x", "y"], "+", prefix = "<", suffix = ">")
+c = [f([x], prefix = x) for x in ["p", "q"]]
+''', evaluator)
+    assert g['a'] == '-x,-y'
+    assert g['b'] == '<x>+<y>'
+    assert g['c'] == ('pp', 'qq')
+
+@evaluators
+def test_missing_keyword_only(evaluator):
+    with pytest.raises(RuntimeError, match='missing argument prefix'):
+        _evaluate('def f(*, prefix, suffix = ""):\n    return prefix\n\nf(suffix = "x")\n', evaluator)
+
+@evaluators
+@pytest.mark.parametrize('stmt', [
+    'if True:\n    x = 1\n',
+    'for x in [1]:\n    pass\n',
+    ])
+def test_top_level_control_flow(evaluator, stmt):
+    with pytest.raises(RuntimeError, match='only allowed in functions'):
+        _evaluate(stmt, evaluator)
@@ -0,0 +1,74 @@
+import pytest
+
+from bazilisk.bzlglob import DirIndex
+from bazilisk.fs import MemFs
+
+def _index():
+    fs = MemFs({
+        '/ws/p/BUILD': '',
+        '/ws/p/a.cc': '',
+        '/ws/p/a.h': '',
+        '/ws/p/a_test.cc': '',
+        '/ws/p/src/b.cc': '',
+        '/ws/p/src/deep/c.cc': '',
+        '/ws/p/src/deep/c.h': '',
+        '/ws/p/sub/BUILD': '',
+        '/ws/p/sub/d.cc': '',
+        '/ws/p/sub/more/e.cc': '',
+        })
+    return DirIndex(fs, fs.make_path('/ws'), ('BUILD', 'BUILD.bazel')), fs
+
+def _glob(index, include, exclude=(), exclude_directories=True):
+    return index.glob(('p',), tuple(include), tuple(exclude), exclude_directories)[0]
+
+def test_simple():
+    index, _ = _index()
+    assert _glob(index, ['*.cc']) == ('a.cc', 'a_test.cc')
+    assert _glob(index, ['?.h', 'src/*.cc']) == ('a.h', 'src/b.cc')
+    assert _glob(index, ['*.cpp']) == ()
+    assert _glob(index, []) == ()
+
+def test_recursive():
+    index, _ = _index()
+    # `**` matches zero or more directories, and stops at subpackages.
+    assert _glob(index, ['**/*.cc']) == ('a.cc', 'a_test.cc', 'src/b.cc', 'src/deep/c.cc')
+    assert _glob(index, ['src/**/*.h']) == ('src/deep/c.h',)
+    assert _glob(index, ['src/**']) == ('src/b.cc', 'src/deep/c.cc', 'src/deep/c.h')
+
+def test_exclude():
+    index, _ = _index()
+    assert _glob(index, ['**/*.cc'], ['*_test.cc', 'src/deep/**']) == ('a.cc', 'src/b.cc')
+    assert _glob(index, ['*.cc'], ['*']) == ()
+
+def test_directories():
+    index, _ = _index()
+    assert _glob(index, ['*']) == ('BUILD', 'a.cc', 'a.h', 'a_test.cc')
+    assert _glob(index, ['*'], exclude_directories=False) == ('BUILD', 'a.cc', 'a.h', 'a_test.cc', 'src')
+
+def test_read_dirs():
+    index, fs = _index()
+    _, dirs = index.glob(('p',), ('**/*.cc',), (), True)
+    assert sorted(fs.native_path(d) for d in dirs) == ['/ws/p', '/ws/p/src', '/ws/p/src/deep']
+    _, dirs = index.glob(('p',), ('*.cc',), (), True)
+    assert [fs.native_path(d) for d in dirs] == ['/ws/p']
+
+def test_cache():
+    index, fs = _index()
+    r = index.glob(('p',), ('**/*.cc',), (), True)
+    assert isinstance(r[0], tuple) and isinstance(r[1], tuple)
+
+    # Later changes aren't seen until the index is rebuilt; the cached
+    # result is returned as is, which is safe as it's immutable.
+    fs.write('/ws/p/new.cc', '')
+    assert index.glob(('p',), ('**/*.cc',), (), True) is r
+    assert 'new.cc' not in _glob(index, ['*.cc'])
+
+    entries = index.entries(('p',), True)
+    assert isinstance(entries[0], tuple) and isinstance(entries[1], tuple)
+    assert index.entries(('p',), True) is entries
+
+@pytest.mark.parametrize('pattern', ['', '/a', 'a/', 'a/../b', 'a**', './a'])
+def test_invalid(pattern):
+    index, _ = _index()
+    with pytest.raises(RuntimeError):
+        _glob(index, [pattern])
@@ -0,0 +1,77 @@
+"""
+The orders are the examples of Bazel's depset documentation.
+"""
+
+import pytest
+
+from bazilisk.depset import Depset
+
+def _fan_out(order):
+    cd = Depset(['c', 'd'], order=order)
+    gh = Depset(['g', 'h'], order=order)
+    return Depset(['a', 'b', 'e', 'f'], [cd, gh], order=order)
+
+def _diamond(order):
+    d = Depset(['d'], order=order)
+    b = Depset(['b'], [d], order=order)
+    c = Depset(['c'], [d], order=order)
+    return Depset(['a'], [b, c], order=order)
+
+@pytest.mark.parametrize('order, expected', [
+    ('default', 'cdghabef'),
+    ('postorder', 'cdghabef'),
+    ('preorder', 'abefcdgh'),
+    ])
+def test_fan_out(order, expected):
+    assert _fan_out(order).to_list() == tuple(expected)
+
+def test_fan_out_topological():
+    r = _fan_out('topological').to_list()
+    assert r[:4] == tuple('abef')
+    assert sorted(r[4:]) == list('cdgh')
+
+@pytest.mark.parametrize('order, expected', [
+    ('default', 'dbca'),
+    ('postorder', 'dbca'),
+    ('preorder', 'abdc'),
+    ('topological', 'abcd'),
+    ])
+def test_diamond(order, expected):
+    assert _diamond(order).to_list() == tuple(expected)
+
+def test_duplicates():
+    d = Depset(['x', 'y', 'x'])
+    assert d.to_list() == ('x', 'y')
+    assert Depset(['y', 'z'], [d]).to_list() == ('x', 'y', 'z')
+
+def test_cached_list():
+    b = Depset(['b'], [Depset(['d'])])
+    a = Depset(['a'], [b])
+    assert a.to_list() is a.to_list()
+
+    # Flattening `a` reuses the list cached by `b` rather than
+    # walking `b` again.
+    assert b.to_list() == ('d', 'b')
+    b._list = ('B',)
+    assert a.to_list() == ('d', 'b', 'a')
+    a._list = None
+    assert a.to_list() == ('B', 'a')
+
+def test_cached_list_other_order():
+    # A `default` child is flattened in its parent's order.
+    d = Depset(['d'])
+    b = Depset(['b'], [d])
+    assert b.to_list() == ('d', 'b')
+    assert Depset(['a'], [b], order='preorder').to_list() == ('a', 'b', 'd')
+
+def test_incompatible_orders():
+    with pytest.raises(RuntimeError):
+        Depset([], [Depset(['x'], [Depset(['y'])], order='preorder')], order='postorder')
+    Depset([], [Depset(['x'], order='preorder')])
+    Depset([], [Depset(['x'])], order='topological')
+
+def test_deep_chain():
+    d = Depset([0])
+    for i in range(1, 50000):
+        d = Depset([i], [d], order='preorder')
+    assert d.to_list()[:2] == (49999, 49998)
@@ -0,0 +1,130 @@
+"""
+Fetching archives into the repository cache, from `file://` URLs.
+"""
+
+import hashlib
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from bazilisk.fetch import Http, RepoCache
+
+class _CountingHttp(Http):
+    def __init__(self):
+        self.opened = []
+
+    def open(self, url):
+        self.opened.append(url)
+        return super().open(url)
+
+def _tarball(path, files):
+    with tarfile.open(str(path), 'w:gz') as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path.as_uri(), hashlib.sha256(path.read_bytes()).hexdigest()
+
+def _read(path):
+    with open(path, 'rb') as fin:
+        return fin.read()
+
+def test_file_url(tmp_path):
+    url, sha256 = _tarball(tmp_path / 'lib.tar.gz', {
+        'lib-1.0/BUILD': b'cc_library(name = "lib")\n',
+        'lib-1.0/src/lib.cc': b'int x;\n',
+        })
+
+    cache = RepoCache(str(tmp_path / 'cache'))
+    out_dir = cache.materialize(Http(), [url], sha256, strip_prefix='lib-1.0')
+    assert _read(os.path.join(out_dir, 'src', 'lib.cc')) == b'int x;\n'
+    assert os.listdir(str(tmp_path / 'cache' / 'tmp')) == []
+
+def test_content_addressed(tmp_path):
+    url, sha256 = _tarball(tmp_path / 'lib.tar.gz', { 'BUILD': b'' })
+    cache = RepoCache(str(tmp_path / 'cache'))
+
+    http = _CountingHttp()
+    out_dir = cache.materialize(http, [url], sha256)
+    assert http.opened == [url]
+
+    # Any URL (or none at all) gets the same archive by its hash, and
+    # it's neither downloaded nor extracted again.
+    marker = os.path.join(out_dir, 'marker')
+    open(marker, 'w').close()
+    other = (tmp_path / 'elsewhere.tar.gz').as_uri()
+    assert cache.materialize(http, [other], sha256.upper()) == out_dir
+    assert RepoCache(str(tmp_path / 'cache')).materialize(http, [], sha256) == out_dir
+    assert http.opened == [url]
+    assert os.path.exists(marker)
+
+def test_no_sha256(tmp_path):
+    url, sha256 = _tarball(tmp_path / 'lib.tar.gz', { 'BUILD': b'' })
+    cache = RepoCache(str(tmp_path / 'cache'))
+    http = _CountingHttp()
+
+    path = cache.fetch(http, [url])
+    assert path == cache.fetch(http, [url])
+    assert http.opened == [url, url]
+    assert path == os.path.join(str(tmp_path / 'cache'), 'sha256', sha256, 'file')
+
+def test_fallback_url(tmp_path):
+    url, sha256 = _tarball(tmp_path / 'lib.tar.gz', { 'BUILD': b'' })
+    missing = (tmp_path / 'missing.tar.gz').as_uri()
+    cache = RepoCache(str(tmp_path / 'cache'))
+    assert _read(cache.fetch(Http(), [missing, url], sha256)) == _read(str(tmp_path / 'lib.tar.gz'))
+
+    with pytest.raises(RuntimeError, match='missing.tar.gz'):
+        cache.fetch(Http(), [missing], '0' * 64)
+
+def test_checksum_mismatch(tmp_path):
+    url, sha256 = _tarball(tmp_path / 'lib.tar.gz', { 'BUILD': b'' })
+    cache = RepoCache(str(tmp_path / 'cache'))
+    with pytest.raises(RuntimeError, match='checksum mismatch'):
+        cache.fetch(Http(), [url], '0' * 64)
+    assert not os.path.exists(str(tmp_path / 'cache' / 'sha256'))
+    assert os.listdir(str(tmp_path / 'cache' / 'tmp')) == []
+
+def test_parent_member(tmp_path):
+    url, sha256 = _tarball(tmp_path / 'evil.tar.gz', {
+        'BUILD': b'',
+        '../evil': b'x',
+        })
+
+    cache = RepoCache(str(tmp_path / 'cache'))
+    with pytest.raises(RuntimeError, match='outside the archive'):
+        cache.materialize(Http(), [url], sha256)
+
+    entry_dir = tmp_path / 'cache' / 'sha256' / sha256
+    assert sorted(os.listdir(str(entry_dir))) == ['file']
+    assert not (tmp_path / 'cache' / 'sha256' / 'evil').exists()
+
+def test_symlink_member(tmp_path):
+    path = tmp_path / 'link.tar'
+    with tarfile.open(str(path), 'w') as tar:
+        info = tarfile.TarInfo('dir/link')
+        info.type = tarfile.SYMTYPE
+        info.linkname = '../../outside'
+        tar.addfile(info)
+
+    cache = RepoCache(str(tmp_path / 'cache'))
+    with pytest.raises(RuntimeError, match='outside the archive'):
+        cache.materialize(Http(), [path.as_uri()])
+
+def test_zip_member(tmp_path):
+    path = tmp_path / 'evil.zip'
+    with zipfile.ZipFile(str(path), 'w') as z:
+        z.writestr('/abs', b'x')
+
+    cache = RepoCache(str(tmp_path / 'cache'))
+    with pytest.raises(RuntimeError, match='outside the archive'):
+        cache.materialize(Http(), [path.as_uri()])
+
+def test_strip_prefix_missing(tmp_path):
+    url, sha256 = _tarball(tmp_path / 'lib.tar.gz', { 'lib/BUILD': b'' })
+    cache = RepoCache(str(tmp_path / 'cache'))
+    with pytest.raises(RuntimeError, match='prefix'):
+        cache.materialize(Http(), [url], sha256, strip_prefix='other')
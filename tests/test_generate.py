@@ -0,0 +1,33 @@
+"""
+End-to-end runs of `bzlsk` on small workspaces.
+"""
+
+from bazilisk import bazilisk
+
+def _write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+def _generate(ws, out, *argv):
+    args = bazilisk._make_arg_parser().parse_args(['-w', str(ws), '-o', str(out), '--no-cache'] + list(argv))
+    assert bazilisk.generate(args) == 0
+
+def test_single_config_defines(tmp_path):
+    ws = tmp_path / 'ws'
+    out = tmp_path / 'out'
+    out.mkdir()
+
+    _write(ws / 'WORKSPACE', '')
+    _write(ws / 'cfg' / 'BUILD', 'config_setting(name = "dbg", values = {"mode": "dbg"}, visibility = ["//visibility:public"])\n')
+    _write(ws / 'app' / 'BUILD',
+        'cc_binary(name = "app", srcs = ["main.cc"], defines = ["APP"] + select({\n'
+        '    "//cfg:dbg": ["DBG"],\n'
+        '    "//conditions:default": [],\n'
+        '}))\n')
+
+    # Every project configuration gets the same config.
+    _generate(ws, out, '//app:app', 'mode=dbg')
+
+    data = (out / 'appapp.vcxproj').read_text()
+    assert data.count('APP;DBG;%(PreprocessorDefinitions)') == 4
+    assert '<ClCompile Include="../ws/app/main.cc"/>' in data
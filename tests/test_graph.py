@@ -0,0 +1,86 @@
+import pytest
+
+from bazilisk.graph import TargetGraph, iter_bits
+
+#   a -> b -> d
+#   a -> c -> d -> e
+#   f (separate)
+_edges = {
+    'a': ['b', 'c'],
+    'b': ['d'],
+    'c': ['d'],
+    'd': ['e'],
+    'e': [],
+    'f': [],
+    }
+
+def _graph(roots=('a', 'f')):
+    calls = []
+    def get_deps(node):
+        calls.append(node)
+        return _edges[node]
+    return TargetGraph.build(roots, get_deps), calls
+
+def _bits(g, *nodes):
+    r = 0
+    for node in nodes:
+        r |= 1 << g.index[node]
+    return r
+
+def _nodes(g, bits):
+    return sorted(g.nodes[i] for i in iter_bits(bits))
+
+def test_build():
+    g, calls = _graph()
+    assert sorted(calls) == sorted(_edges)
+    assert len(g) == 6
+    assert g.nodes[:2] == ['a', 'f']
+    assert [g.nodes[j] for j in g.direct_deps(g.index['a'])] == ['b', 'c']
+    assert sorted(g.nodes[j] for j in g.direct_rdeps(g.index['d'])) == ['b', 'c']
+
+def test_iter_bits():
+    assert list(iter_bits(0)) == []
+    assert list(iter_bits(0b101001)) == [0, 3, 5]
+    assert list(iter_bits(1 << 200)) == [200]
+
+def test_closure():
+    g, _ = _graph()
+    assert _nodes(g, g.closure(g.index['a'])) == ['b', 'c', 'd', 'e']
+    assert _nodes(g, g.closure(g.index['d'])) == ['e']
+    assert g.closure(g.index['e']) == 0
+    assert sorted(g.closure_nodes(g.index['b'])) == ['d', 'e']
+    assert _nodes(g, g.transitive([g.index['b'], g.index['f']])) == ['b', 'd', 'e', 'f']
+
+def test_reachable():
+    g, _ = _graph()
+    assert _nodes(g, g.reachable(_bits(g, 'b'))) == ['b', 'd', 'e']
+    assert _nodes(g, g.reachable(_bits(g, 'a'), depth=1)) == ['a', 'b', 'c']
+    assert _nodes(g, g.reachable(_bits(g, 'd'), reverse=True)) == ['a', 'b', 'c', 'd']
+    assert _nodes(g, g.reachable(_bits(g, 'e'), reverse=True, depth=1)) == ['d', 'e']
+
+def test_path():
+    g, _ = _graph()
+    path = [g.nodes[i] for i in g.path(_bits(g, 'a'), _bits(g, 'e'))]
+    assert path in (['a', 'b', 'd', 'e'], ['a', 'c', 'd', 'e'])
+    assert g.path(_bits(g, 'a'), _bits(g, 'f')) is None
+    assert g.path(_bits(g, 'd'), _bits(g, 'd')) == [g.index['d']]
+
+def test_topo_order():
+    g, _ = _graph()
+    order = [g.nodes[i] for i in g.topo_order()]
+    assert sorted(order) == sorted(_edges)
+    for node, deps in _edges.items():
+        for dep in deps:
+            assert order.index(dep) < order.index(node)
+
+def test_cycle():
+    edges = { 'a': ['b'], 'b': ['c'], 'c': ['a'] }
+    g = TargetGraph.build(['a'], edges.__getitem__)
+    with pytest.raises(RuntimeError, match='cycle'):
+        g.topo_order()
+
+def test_deep_chain():
+    # Neither the build nor the closures recurse.
+    n = 50000
+    g = TargetGraph.build([0], lambda i: [i + 1] if i + 1 < n else [])
+    assert g.closure(0) == (1 << n) - 2
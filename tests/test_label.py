@@ -0,0 +1,21 @@
+import doctest
+
+from bazilisk import label
+
+def test_doctests():
+    failures, _ = doctest.testmod(label)
+    assert failures == 0
+
+def test_main_repo_is_interned_once():
+    a = label.make_label('', 'pkg', 'target')
+    b = label.parse_label('//pkg:target')
+    c = label.parse_label(':target', '', 'pkg')
+    assert a is b is c
+    assert a.repo is None
+    assert a.abslabel == '//pkg:target'
+
+def test_external_repo():
+    a = label.parse_label('@ext//pkg:target')
+    assert a is label.make_label('ext', 'pkg', 'target')
+    assert a is not label.make_label(None, 'pkg', 'target')
+    assert a.abslabel == '@ext//pkg:target'
@@ -0,0 +1,269 @@
+"""
+Checks that the streaming vcxproj writer produces the same document
+as the minidom-based builder it replaced.
+"""
+
+from types import SimpleNamespace
+import xml.dom.minidom
+import xml.etree.ElementTree as ET
+
+from bazilisk import msvc_ccproj
+
+_platforms = 'Win32', 'x64'
+_configs = 'Debug', 'Release'
+
+# The previous implementation, extended by per-configuration
+# items and defines the same way as `write_vcxproj`.
+
+def _make_item(doc, name, include, *meta, condition=None):
+    item = doc.createElement(name)
+    if include is not None:
+        item.setAttribute('Include', include)
+    if condition is not None:
+        item.setAttribute('Condition', condition)
+
+    for k, v in meta:
+        m = doc.createElement(k)
+        m.appendChild(doc.createTextNode(v))
+        item.appendChild(m)
+
+    return item
+
+def _make_property_group(doc, attrs, *props):
+    gr = doc.createElement('PropertyGroup')
+
+    for k, v in attrs:
+        gr.setAttribute(k, v)
+
+    for k, v in props:
+        prop = doc.createElement(k)
+        prop.appendChild(doc.createTextNode(v))
+        gr.appendChild(prop)
+    return gr
+
+def _make_elem(doc, tag, *attrs):
+    e = doc.createElement(tag)
+    for k, v in attrs:
+        e.setAttribute(k, v)
+    return e
+
+def _condition(name):
+    return "'$(Configuration)|$(Platform)'=='{}'".format(name)
+
+def _defines(configs, conf, plat):
+    settings = configs.get('{}|{}'.format(conf, plat))
+    if settings is None:
+        return ''
+    return ''.join(define + ';' for define in settings.defines)
+
+def _conditions(configs, item, attr):
+    if not configs:
+        return [None]
+
+    present = [name for name, settings in configs.items() if item in getattr(settings, attr)]
+    if len(present) == len(configs):
+        return [None]
+    return [_condition(name) for name in present]
+
+def make_vcxproj_dom(tgt, proj_map):
+    fname_root, guid = proj_map[tgt.label]
+    configs = tgt.configs or {}
+
+    impl = xml.dom.minidom.getDOMImplementation()
+    doc = impl.createDocument('http://schemas.microsoft.com/developer/msbuild/2003', 'Project', None)
+
+    root = doc.documentElement
+    root.setAttribute('DefaultTargets', 'Build')
+    root.setAttribute('ToolsVersion', '14.0')
+    root.setAttribute('xmlns', root.namespaceURI)
+
+    conf_group = doc.createElement('ItemGroup')
+    root.appendChild(conf_group)
+    conf_group.setAttribute('Label', 'ProjectConfigurations')
+
+    for plat in _platforms:
+        for conf in _configs:
+            conf_group.appendChild(_make_item(doc, 'ProjectConfiguration', '{}|{}'.format(conf, plat),
+                ('Configuration', conf),
+                ('Platform', plat),
+                ))
+
+    root.appendChild(_make_property_group(doc, [('Label', 'Globals')],
+        ('ProjectGuid', '{{{}}}'.format(guid)),
+        ('WindowsTargetPlaform', '8.1'),
+        ))
+
+    root.appendChild(_make_elem(doc, 'Import', ('Project', '$(VCTargetsPath)\\Microsoft.Cpp.Default.props')))
+
+    for plat in _platforms:
+        for conf in _configs:
+            root.appendChild(_make_property_group(doc, [('Condition', "'$(Configuration)|$(Platform)'=='{}|{}'".format(conf, plat)), ('Label', 'Configuration')],
+                ('ConfigurationType', 'Application'),
+                ('UseDefaultLibraries', 'true' if conf == 'Debug' else 'false'),
+                ('PlatformToolset', 'v140'),
+                ('CharacterSet', 'Unicode'),
+                ))
+
+    root.appendChild(_make_elem(doc, 'Import', ('Project', '$(VCTargetsPath)\\Microsoft.Cpp.props')))
+
+    root.appendChild(_make_elem(doc, 'ImportGroup', ('Label', 'ExtensionSettings')))
+    root.appendChild(_make_elem(doc, 'ImportGroup', ('Label', 'Shared')))
+
+    for plat in _platforms:
+        for conf in _configs:
+            e = _make_elem(doc, 'ImportGroup', ('Label', 'PropertySheets'))
+            e.appendChild(_make_elem(doc, 'Import',
+                ('Project', '$(UserRootDir)\\Microsoft.Cpp.$(Platform).user.props'),
+                ('Condition', "exists('$(UserRootDir)\\Microsoft.Cpp.$(Platform).user.props')"),
+                ('Label', 'LocalAppDataPlatform'),
+                ))
+
+            root.appendChild(e)
+
+    root.appendChild(_make_elem(doc, 'PropertyGroup', ('Label', 'UserMacros')))
+
+    for plat in _platforms:
+        for conf in _configs:
+            root.appendChild(_make_property_group(doc, [('Condition', "'$(Configuration)|$(Platform)'=='{}|{}'".format(conf, plat))],
+                ('LinkIncremental', 'true' if conf == 'Debug' else 'false'),
+                ))
+
+    for plat in _platforms:
+        conf = 'Debug'
+
+        gr = _make_elem(doc, 'ItemDefinitionGroup', ('Condition', "'$(Configuration)|$(Platform)'=='{}|{}'".format(conf, plat)))
+        gr.appendChild(_make_item(doc, 'ClCompile', None,
+            ('PrecompiledHeader', ''),
+            ('WarningLevel', 'Level3'),
+            ('Optimization', 'Disabled'),
+            ('PreprocessorDefinitions', 'WIN32;_DEBUG;_CONSOLE;{}%(PreprocessorDefinitions)'.format(_defines(configs, conf, plat))),
+            ))
+
+        gr.appendChild(_make_item(doc, 'Link', None,
+            ('SubSystem', 'Console'),
+            ('GenerateDebugInformation', 'true'),
+            ))
+
+        root.appendChild(gr)
+
+    for plat in _platforms:
+        conf = 'Release'
+
+        gr = _make_elem(doc, 'ItemDefinitionGroup', ('Condition', "'$(Configuration)|$(Platform)'=='{}|{}'".format(conf, plat)))
+        gr.appendChild(_make_item(doc, 'ClCompile', None,
+            ('WarningLevel', 'Level3'),
+            ('PrecompiledHeader', ''),
+            ('Optimization', 'MaxSpeed'),
+            ('FunctionLevelLinking', 'true'),
+            ('IntrinsicFunctions', 'true'),
+            ('PreprocessorDefinitions', 'WIN32;NDEBUG;_CONSOLE;{}%(PreprocessorDefinitions)'.format(_defines(configs, conf, plat))),
+            ))
+
+        gr.appendChild(_make_item(doc, 'Link', None,
+            ('SubSystem', 'Console'),
+            ('EnableCOMDATFolding', 'true'),
+            ('OptimizeReferences', 'true'),
+            ('GenerateDebugInformation', 'true'),
+            ))
+
+        root.appendChild(gr)
+
+    gr = _make_elem(doc, 'ItemGroup')
+    root.appendChild(gr)
+    for src in tgt.srcs:
+        base = src.rsplit('.', 1)
+        if len(base) == 2:
+            base, ext = base
+        else:
+            base, ext = base[0], ''
+
+        if ext in ('c', 'cc', 'cxx', 'cpp'):
+            type = 'ClCompile'
+        elif ext in ('h', 'hh', 'hpp', 'hxx'):
+            type = 'ClInclude'
+        else:
+            type = 'None'
+
+        for condition in _conditions(configs, src, 'srcs'):
+            gr.appendChild(_make_item(doc, type, src, condition=condition))
+
+    gr = _make_elem(doc, 'ItemGroup')
+    root.appendChild(gr)
+
+    for dep in tgt.deps:
+        fname, guid = proj_map[dep]
+        for condition in _conditions(configs, dep, 'deps'):
+            gr.appendChild(_make_item(doc, 'ProjectReference', fname,
+                ('Project', '{{{}}}'.format(guid)),
+                condition=condition,
+                ))
+
+    root.appendChild(_make_elem(doc, 'Import', ('Project', '$(VCTargetsPath)\\Microsoft.Cpp.targets')))
+    root.appendChild(_make_elem(doc, 'ImportGroup', ('Label', 'ExtensionTargets')))
+
+    return doc.toprettyxml(indent='  ', encoding='utf-8')
+
+def _tree(data):
+    def convert(e):
+        return e.tag, sorted(e.attrib.items()), (e.text or '').strip(), [convert(child) for child in e]
+    return convert(ET.fromstring(data))
+
+def _project(label, srcs, deps, configs=None):
+    return SimpleNamespace(label=label, srcs=srcs, deps=deps, configs=configs)
+
+def _settings(srcs, deps, defines):
+    return SimpleNamespace(srcs=frozenset(srcs), deps=frozenset(deps), defines=defines)
+
+def _check(tgt, proj_map):
+    expected = make_vcxproj_dom(tgt, proj_map)
+    actual = msvc_ccproj.make_vcxproj(tgt, proj_map)
+    assert _tree(actual) == _tree(expected)
+
+_proj_map = {
+    '//app:app': ('app.vcxproj', '11111111-1111-1111-1111-111111111111'),
+    '//lib:lib': ('lib.vcxproj', '22222222-2222-2222-2222-222222222222'),
+    '//lib:dbg': ('dbg.vcxproj', '33333333-3333-3333-3333-333333333333'),
+    }
+
+def test_empty():
+    _check(_project('//app:app', [], []), _proj_map)
+
+def test_includes():
+    srcs = ['main.cc', 'util.c', 'util.h', 'impl.hpp', 'README', 'x.cxx', 'y.hh']
+    _check(_project('//app:app', srcs, ['//lib:lib']), _proj_map)
+
+def test_multi_config():
+    debug = _settings(['main.cc', 'debug.cc'], ['//lib:lib', '//lib:dbg'], ('DBG', 'LEVEL=2'))
+    release = _settings(['main.cc'], ['//lib:lib'], ('NDBG',))
+    configs = {
+        'Debug|Win32': debug,
+        'Debug|x64': debug,
+        'Release|Win32': release,
+        'Release|x64': release,
+        }
+
+    tgt = _project('//app:app', ['main.cc', 'debug.cc'], ['//lib:lib', '//lib:dbg'], configs)
+    _check(tgt, _proj_map)
+
+def test_single_config_defines():
+    settings = _settings(['main.cc'], [], ('DBG',))
+    configs = { name: settings for name in msvc_ccproj.configurations }
+    tgt = _project('//app:app', ['main.cc'], [], configs)
+    _check(tgt, _proj_map)
+    assert b'DBG;' in msvc_ccproj.make_vcxproj(tgt, _proj_map)
+
+def test_escaping():
+    srcs = ['a&b.cc', 'x<y>.h', 'q"uote".cpp', "it's.c", 'dir/&amp;.cc']
+    proj_map = dict(_proj_map)
+    proj_map['//lib:odd'] = ('o&d<d>"\'.vcxproj', '44444444-4444-4444-4444-444444444444')
+
+    settings = _settings(srcs, ['//lib:odd'], ('NAME="a&b"', 'LT=<', "Q='x'"))
+    other = _settings(srcs[:2], [], ())
+    configs = {
+        'Debug|Win32': settings,
+        'Debug|x64': other,
+        'Release|Win32': settings,
+        'Release|x64': other,
+        }
+
+    _check(_project('//app:app', srcs, ['//lib:odd'], configs), proj_map)
@@ -0,0 +1,97 @@
+import pytest
+
+from bazilisk.fs import MemFs
+from bazilisk.query import QueryEngine, QueryError, parse
+from bazilisk.workspace import Workspace
+
+#   //app:app -> //lib:a -> //lib:c
+#   //app:app -> //lib:b -> //lib:c
+#   //app:tool (no deps)
+_files = {
+    '/ws/WORKSPACE': '',
+    '/ws/app/BUILD':
+        'cc_binary(name = "app", srcs = ["main.cc"], deps = ["//lib:a", "//lib:b"])\n'
+        'cc_binary(name = "tool", srcs = ["main.cc"])\n',
+    '/ws/app/main.cc': '',
+    '/ws/lib/BUILD':
+        'cc_library(name = "a", deps = [":c"])\n'
+        'cc_library(name = "b", deps = [":c"])\n'
+        'cc_library(name = "c")\n',
+    '/ws/bad/BUILD': 'cc_library(name = "x", deps = ["//lib:a"])\nundefined()\n',
+    '/ws/broken/BUILD': 'cc_library(name = "y", deps = ["//nope:z"])\n',
+    }
+
+def _engine():
+    return QueryEngine(Workspace('/ws', {}, fs=MemFs(_files), http=None))
+
+def test_parse():
+    assert parse('//a:b') == ('label', '//a:b')
+    assert parse('deps(//a:b, 2)') == ('deps', ('label', '//a:b'), ('int', 2))
+    assert parse('//a:b + //c:d - //e:f') == ('-', ('+', ('label', '//a:b'), ('label', '//c:d')), ('label', '//e:f'))
+    assert parse('//a:b ^ (//c:d + //e:f)') == ('^', ('label', '//a:b'), ('+', ('label', '//c:d'), ('label', '//e:f')))
+    assert parse('somepath(//a, deps(//c:d))') == ('somepath', ('label', '//a:a'), ('deps', ('label', '//c:d')))
+
+@pytest.mark.parametrize('text, message', [
+    ('deps(//a:b', 'expected'),
+    ('deps(//a:b,)', 'expected'),
+    ('deps(//a:b, //c:d)', 'integer'),
+    ('rdeps(//a:b)', 'arguments'),
+    ('somepath(//a:b, //c:d, 1)', 'arguments'),
+    ('//a:b //c:d', 'unexpected'),
+    ('//a:b +', 'expected'),
+    (')', 'unexpected'),
+    ('//a/..:b', 'package names'),
+    ('', 'expected'),
+    ])
+def test_parse_errors(text, message):
+    with pytest.raises(QueryError, match=message):
+        parse(text)
+
+def test_deps():
+    q = _engine()
+    # Dependents come before their dependencies.
+    r = q.run('deps(//app:app)')
+    assert sorted(r) == ['//app:app', '//lib:a', '//lib:b', '//lib:c']
+    assert r[0] == '//app:app' and r[-1] == '//lib:c'
+    assert sorted(q.run('deps(//app:app, 1)')) == ['//app:app', '//lib:a', '//lib:b']
+    assert q.run('deps(//lib:c)') == ['//lib:c']
+
+def test_rdeps():
+    q = _engine()
+    assert sorted(q.run('rdeps(//app:app, //lib:c)')) == ['//app:app', '//lib:a', '//lib:b', '//lib:c']
+    assert sorted(q.run('rdeps(//app:app, //lib:c, 1)')) == ['//lib:a', '//lib:b', '//lib:c']
+    assert q.run('rdeps(//lib:a, //lib:b)') == []
+
+def test_paths():
+    q = _engine()
+    assert q.run('somepath(//app:app, //lib:c)') in (
+        ['//app:app', '//lib:a', '//lib:c'], ['//app:app', '//lib:b', '//lib:c'])
+    assert q.run('somepath(//app:app, //app:tool)') == []
+    assert sorted(q.run('allpaths(//app:app, //lib:c)')) == ['//app:app', '//lib:a', '//lib:b', '//lib:c']
+    assert q.run('allpaths(//lib:a, //lib:b)') == []
+
+def test_set_operators():
+    q = _engine()
+    assert sorted(q.run('deps(//lib:a) + deps(//lib:b)')) == ['//lib:a', '//lib:b', '//lib:c']
+    assert q.run('deps(//app:app) - deps(//lib:a) - deps(//lib:b)') == ['//app:app']
+    assert q.run('deps(//lib:a) ^ deps(//lib:b)') == ['//lib:c']
+
+def test_files():
+    q = _engine()
+    assert q.run('//app:main.cc') == ['//app:main.cc']
+
+@pytest.mark.parametrize('text, message', [
+    ('deps(//nope:x)', r'//nope:x: no such package'),
+    ('somepath(//app:app, //nope:x)', r'//nope:x: no such package'),
+    ('deps(//app:nope)', r'no such target: //app:nope'),
+    ('deps(@other//a:b)', r'@other//a:b: no such repository'),
+    ('deps(//bad:x)', r'//bad:x: '),
+    ('deps(//broken:y)', r'//broken:y: no such package'),
+    ])
+def test_errors(text, message):
+    q = _engine()
+    with pytest.raises(QueryError, match=message):
+        q.run(text)
+
+    # The engine is still usable.
+    assert q.run('deps(//lib:b)') == ['//lib:b', '//lib:c']
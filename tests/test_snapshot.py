@@ -0,0 +1,160 @@
+"""
+Saving the loaded packages and restoring them into a new workspace.
+"""
+
+import os
+
+from bazilisk import snapshot
+from bazilisk.fs import Fs
+from bazilisk.workspace import Rule, Workspace
+
+def _write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+def _touch(path, content):
+    # A different size, so the change is seen whatever the
+    # resolution of mtimes.
+    path.write_text(path.read_text() + content)
+
+def _workspace(tmp_path):
+    ws = tmp_path / 'ws'
+    _write(ws / 'WORKSPACE', '')
+    _write(ws / 'cfg' / 'BUILD', 'config_setting(name = "dbg", values = {"mode": "dbg"}, visibility = ["//visibility:public"])\n')
+    _write(ws / 'a' / 'BUILD', 'cc_library(name = "a", srcs = ["a.cc"], deps = ["//b"])\n')
+    _write(ws / 'b' / 'BUILD',
+        'cc_library(name = "b", srcs = ["b.cc"], defines = select({\n'
+        '    "//cfg:dbg": ["DBG"],\n'
+        '    "//conditions:default": ["REL"],\n'
+        '}))\n'
+        'cc_library(name = "other", srcs = ["other.cc"])\n')
+    _write(ws / 'c' / 'BUILD', 'cc_library(name = "c", srcs = ["c.cc"])\n')
+    return ws
+
+def _open(ws, lazy_rules=False):
+    return Workspace(str(ws), {}, fs=Fs(), http=None, lazy_rules=lazy_rules,
+        evaluator='compiled' if lazy_rules else 'ast')
+
+def _load_all(w):
+    for label in '//a', '//c':
+        rule = w.resolve_target(label, '', '')
+        list(rule.attrs.items())
+    for config in { 'mode': 'dbg' }, { 'mode': 'opt' }:
+        with w.configure(config):
+            w.resolve_target('//b', '', '').attrs['defines']
+
+def _save(tmp_path, ws, lazy_rules=False):
+    w = _open(ws, lazy_rules)
+    _load_all(w)
+    path = str(tmp_path / 'snapshot.bin')
+    snapshot.save(w, path)
+    return path
+
+def _packages(w):
+    return sorted(w._repos['']._packages)
+
+def _srcs(rule):
+    return [os.path.basename(Fs().native_path(src._path)) for src in rule.attrs['srcs']]
+
+def test_round_trip(tmp_path):
+    ws = _workspace(tmp_path)
+    path = _save(tmp_path, ws)
+
+    w = _open(ws)
+    assert snapshot.load(w, path) == 4
+    assert _packages(w) == ['a', 'b', 'c', 'cfg']
+
+    a = w.resolve_target('//a', '', '')
+    assert a._snapshot is not None
+    assert _srcs(a) == ['a.cc']
+
+    b, = a.attrs['deps']
+    assert isinstance(b, Rule) and b is w.resolve_target('//b', '', '')
+    with w.configure({ 'mode': 'dbg' }):
+        assert b.attrs['defines'] == ('DBG',)
+    with w.configure({ 'mode': 'opt' }):
+        assert b.attrs['defines'] == ('REL',)
+
+    # Nothing was evaluated.
+    assert all(pkg.restored for pkg in w._repos['']._packages.values())
+
+def test_missing_config(tmp_path):
+    ws = _workspace(tmp_path)
+    path = _save(tmp_path, ws)
+
+    w = _open(ws)
+    snapshot.load(w, path)
+    b = w.resolve_target('//b', '', '')
+    with w.configure({ 'mode': 'fastbuild' }):
+        assert b.attrs['defines'] == ('REL',)
+    assert not b.package.restored
+    assert b._pre_attrs is not None
+
+def test_shared_config_values(tmp_path):
+    ws = _workspace(tmp_path)
+    w = _open(ws)
+    _load_all(w)
+    with w.configure({ 'mode': 'fastbuild' }):
+        w.resolve_target('//b', '', '').attrs['defines']
+    path = str(tmp_path / 'snapshot.bin')
+    snapshot.save(w, path)
+
+    w = _open(ws)
+    snapshot.load(w, path)
+    b = w.resolve_target('//b', '', '')
+    with w.configure({ 'mode': 'opt' }):
+        opt = b.attrs['defines']
+    with w.configure({ 'mode': 'fastbuild' }):
+        assert b.attrs['defines'] is opt
+    assert b.package.restored
+
+def test_fingerprint(tmp_path):
+    ws = _workspace(tmp_path)
+    path = _save(tmp_path, ws)
+
+    _touch(ws / 'WORKSPACE', '\n')
+    w = _open(ws)
+    assert snapshot.load(w, path) == 0
+    assert _packages(w) == []
+
+def test_stale_dependents(tmp_path):
+    ws = _workspace(tmp_path)
+    path = _save(tmp_path, ws)
+
+    # //a refers to //b, so it isn't restored either.
+    _touch(ws / 'b' / 'BUILD', '\n')
+    w = _open(ws)
+    assert snapshot.load(w, path) == 2
+    assert _packages(w) == ['c', 'cfg']
+
+    a = w.resolve_target('//a', '', '')
+    assert a._snapshot is None
+    assert _srcs(a) == ['a.cc']
+
+def test_unrestored_rules(tmp_path):
+    ws = _workspace(tmp_path)
+    path = _save(tmp_path, ws, lazy_rules=True)
+
+    w = _open(ws, lazy_rules=True)
+    snapshot.load(w, path)
+    pkg = w._repos['']._packages['b']
+    assert pkg._unrestored == { 'other' }
+    assert pkg.restored
+
+    other = w.resolve_target('//b:other', '', '')
+    assert isinstance(other, Rule)
+    assert _srcs(other) == ['other.cc']
+    assert not pkg.restored
+
+    # The restored rule got its attributes back.
+    b = w.resolve_target('//b', '', '')
+    assert b._pre_attrs is not None
+    assert _srcs(b) == ['b.cc']
+
+def test_corrupt(tmp_path):
+    ws = _workspace(tmp_path)
+    path = tmp_path / 'snapshot.bin'
+    path.write_bytes(b'\xff\x00garbage')
+    assert snapshot.load(_open(ws), str(path)) == 0
+    path.write_bytes(b'')
+    assert snapshot.load(_open(ws), str(path)) == 0
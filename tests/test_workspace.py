@@ -0,0 +1,181 @@
+import io
+
+import pytest
+
+from bazilisk.fs import MemFs
+from bazilisk.workspace import Workspace
+
+_macros = '''
+def _lib(name, srcs, defines = {}):
+    native.cc_library(name = name, srcs = srcs, defines = [k + "=" + v for k, v in defines.items()])
+    return {"name": name, "defines": defines}
+
+lib = pure_macro(_lib)
+
+def _named(name):
+    native.cc_library(name = name, srcs = [native.package_name() + ".cc"])
+
+named = pure_macro(_named)
+'''
+
+def _workspace(files, evaluator='ast'):
+    files = dict(files)
+    files['/ws/WORKSPACE'] = ''
+    files['/ws/m/BUILD'] = ''
+    files['/ws/m/macros.bzl'] = _macros
+    return Workspace('/ws', {}, fs=MemFs(files), http=None, evaluator=evaluator)
+
+def _macro(w, name):
+    return w._repos['']._packages['m']._bzls['macros.bzl'][name]
+
+def _srcs(w, label):
+    rule = w.resolve_target(label, '', '')
+    return [w._fs.native_path(src._path) for src in rule.attrs['srcs']]
+
+def test_pure_macro_hit():
+    w = _workspace({
+        '/ws/a/BUILD': 'load("//m:macros.bzl", "lib")\nlib("l", ["x.cc"])\n',
+        '/ws/b/BUILD': 'load("//m:macros.bzl", "lib")\nlib("l", ["x.cc"])\nlib("k", ["x.cc"])\n',
+        })
+
+    a = w.resolve_target('//a:l', '', '')
+    b = w.resolve_target('//b:l', '', '')
+    assert a is not b
+    assert _srcs(w, '//a:l') == ['/ws/a/x.cc']
+    assert _srcs(w, '//b:l') == ['/ws/b/x.cc']
+    assert _srcs(w, '//b:k') == ['/ws/b/x.cc']
+    assert a._pre_attrs is not b._pre_attrs
+    assert _macro(w, 'lib').hits == 1
+
+@pytest.mark.parametrize('evaluator', ['ast', 'compiled'])
+def test_pure_macro_mutated_result(evaluator):
+    w = _workspace({
+        '/ws/a/BUILD': 'load("//m:macros.bzl", "lib")\n'
+            'd = lib("l", ["x.cc"], {"A": "1"})\n'
+            'd["defines"]["A"] = "2"\n',
+        '/ws/b/BUILD': 'load("//m:macros.bzl", "lib")\n'
+            'd = lib("l", ["x.cc"], {"A": "1"})\n'
+            'cc_library(name = "r", srcs = [d["defines"]["A"] + ".cc"])\n',
+        }, evaluator)
+
+    w.resolve_target('//a:l', '', '')
+    assert _srcs(w, '//b:r') == ['/ws/b/1.cc']
+    assert _macro(w, 'lib').hits == 1
+
+def test_impure_macro():
+    w = _workspace({
+        '/ws/a/BUILD': 'load("//m:macros.bzl", "named")\nnamed("n")\n',
+        '/ws/b/BUILD': 'load("//m:macros.bzl", "named")\nnamed("n")\n',
+        })
+
+    assert _srcs(w, '//a:n') == ['/ws/a/a.cc']
+    assert _srcs(w, '//b:n') == ['/ws/b/b.cc']
+    macro = _macro(w, 'named')
+    assert not macro._pure and macro.hits == 0
+
+def test_unhashable_arguments():
+    w = _workspace({
+        '/ws/a/BUILD': 'load("//m:macros.bzl", "lib")\n'
+            'lib("l", select({"//conditions:default": ["x.cc"]}))\n'
+            'lib("l2", select({"//conditions:default": ["x.cc"]}))\n',
+        })
+
+    assert _srcs(w, '//a:l') == ['/ws/a/x.cc']
+    assert _srcs(w, '//a:l2') == ['/ws/a/x.cc']
+    macro = _macro(w, 'lib')
+    assert macro._pure and macro.hits == 0
+
+def test_preparse(tmp_path):
+    from bazilisk.cache import ParseCache
+    from bazilisk.fs import Fs
+
+    ws = tmp_path / 'ws'
+    for name in 'a', 'b', 'c/d':
+        (ws / name).mkdir(parents=True)
+        (ws / name / 'BUILD').write_text('cc_library(name = "l", srcs = ["{}.cc"])\n'.format(name))
+    (ws / 'bad').mkdir()
+    (ws / 'bad' / 'BUILD').write_text('cc_library(\n')
+    (ws / 'WORKSPACE').write_text('')
+
+    def open_ws():
+        cache = ParseCache(str(tmp_path / 'cache'))
+        return Workspace(str(ws), {}, fs=Fs(), http=None, parse_cache=cache), cache
+
+    # The cache holds the WORKSPACE file and the three valid BUILD files.
+    w, cache = open_ws()
+    assert w.preparse(1) == 4
+    assert len(list((tmp_path / 'cache').iterdir())) == 4
+
+    w, cache = open_ws()
+    src, = w.resolve_target('//c/d:l', '', '').attrs['srcs']
+    assert w._fs.native_path(src._path) == str(ws / 'c' / 'd' / 'c' / 'd.cc')
+    assert (cache.hits, cache.misses) == (2, 0)
+
+@pytest.mark.parametrize('evaluator', ['ast', 'compiled'])
+def test_keep_modules(evaluator):
+    build = 'load("//q:defs.bzl", "SRCS")\ncc_library(name = "l", srcs = SRCS + [{"a": "x.cc"}["a"]])\n'
+    fs = MemFs({
+        '/ws/WORKSPACE': '',
+        '/ws/p/BUILD': build,
+        '/ws/q/BUILD': '',
+        '/ws/q/defs.bzl': 'SRCS = ["a.cc"]\n',
+        })
+    w = Workspace('/ws', {}, fs=fs, http=None, evaluator=evaluator, keep_modules=True)
+
+    def srcs():
+        rule = w.resolve_target('//p:l', '', '')
+        return [fs.native_path(src._path) for src in rule.attrs['srcs']]
+
+    assert srcs() == ['/ws/p/a.cc', '/ws/p/x.cc']
+    mod = w._modules[build]
+
+    # //p is reloaded along with //q, running the same module again.
+    fs.write('/ws/q/defs.bzl', 'SRCS = ["b.cc"]\n')
+    assert w.refresh()
+    assert srcs() == ['/ws/p/b.cc', '/ws/p/x.cc']
+    assert w._modules[build] is mod
+
+def test_keep_modules_generations():
+    w = Workspace('/ws', {}, fs=MemFs({ '/ws/WORKSPACE': '' }), http=None, keep_modules=True)
+    mod = w.parse(io.StringIO('x = 1\n'))
+    assert w.parse(io.StringIO('x = 1\n')) is mod
+
+    # Kept by a refresh if used since the previous one.
+    w.refresh()
+    assert w.parse(io.StringIO('x = 1\n')) is mod
+    w.refresh()
+    w.refresh()
+    assert w.parse(io.StringIO('x = 1\n')) is not mod
+
+    w = Workspace('/ws', {}, fs=MemFs({ '/ws/WORKSPACE': '' }), http=None)
+    assert w.parse(io.StringIO('x = 1\n')) is not w.parse(io.StringIO('x = 1\n'))
+
+def test_failed_package():
+    fs = MemFs({
+        '/ws/WORKSPACE': '',
+        '/ws/p/BUILD': 'config_setting(name = "c", values = {"mode": "dbg"}, visibility = [])\n'
+            'cc_library(name = "m")\n'
+            'undefined()\n',
+        })
+    w = Workspace('/ws', {}, fs=fs, http=None)
+
+    for _ in range(2):
+        with pytest.raises(Exception, match='undefined'):
+            w.resolve_target('//p:m', '', '')
+        assert 'p' not in w._repos['']._packages
+        assert not w._config_index
+
+    fs.write('/ws/p/BUILD', 'cc_library(name = "m")\n')
+    assert w.refresh()
+    assert w.resolve_target('//p:m', '', '').kind == 'cc_library'
+
+def test_failed_deferred_rule():
+    fs = MemFs({
+        '/ws/WORKSPACE': '',
+        '/ws/p/BUILD': 'cc_library(name = "m", bogus = 1)\n',
+        })
+    w = Workspace('/ws', {}, fs=fs, http=None, evaluator='compiled', lazy_rules=True)
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError, match='unknown attribute'):
+            w.resolve_target('//p:m', '', '')